@@ -2,8 +2,32 @@
 Structure de description d'une table de géométries
 """
 from dataclasses import dataclass
+from dataclasses import field
 from typing import Optional
 
+REDUCTION_MODES = ('full', 'centroid', 'bbox')
+
+
+@dataclass
+class GeoReduction:
+    """
+    Forme réduite des géométries, calculée côté serveur avant le transfert.
+
+    Les opérations sont appliquées dans l'ordre : `mode` (géométrie complète, centroïde ou emprise),
+    puis simplification (`ST_SimplifyPreserveTopology`), puis quantification des coordonnées
+    (`ST_QuantizeCoordinates`).
+    ```
+        ST_QuantizeCoordinates(ST_SimplifyPreserveTopology(ST_Centroid(<column>), <tolerance>), <precision>)
+    ```
+    """
+    mode: str = 'full'
+    tolerance: Optional[float] = None
+    precision: Optional[int] = None
+
+    def __post_init__(self):
+        if self.mode not in REDUCTION_MODES:
+            raise ValueError(f"Unknown reduction mode {self.mode}. Expected one of {REDUCTION_MODES}")
+
 
 @dataclass
 class GeoInfo:
@@ -17,7 +41,10 @@ class GeoInfo:
         FROM <table_path>
         (WHERE <condition>)
     ```
+
+    `reduction` demande au serveur une forme réduite de la géométrie (voir `GeoReduction`).
     """
     column: str
     table_path: str
     condition: Optional[str] = None
+    reduction: Optional[GeoReduction] = field(default=None, repr=False)
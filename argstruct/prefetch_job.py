@@ -0,0 +1,36 @@
+"""
+Structures décrivant les requêtes de pré-chargement du cache et leur compte-rendu
+"""
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+from .geo_table_info import GeoInfo
+
+
+@dataclass
+class PrefetchJob:
+    """
+    Une requête à pré-charger dans le cache de `Tool.fetch_query`.
+    Les priorités les plus basses passent en premier.
+    """
+    name: str
+    query: str
+    geo_info: Optional[GeoInfo] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    priority: int = 0
+    force_epsg: Optional[int] = None
+
+
+@dataclass
+class PrefetchReport:
+    """
+    Compte-rendu d'une requête de pré-chargement.
+    `status` vaut `refreshed`, `skipped` (cache encore frais) ou `failed`.
+    """
+    name: str
+    status: str
+    duration: float
+    error: Optional[str] = None
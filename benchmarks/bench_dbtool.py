@@ -0,0 +1,220 @@
+"""
+Banc d'essai de `dbtool.Tool.fetch_query`.
+
+Utilisation : `python -m utils.benchmarks.bench_dbtool [--connection-string ...] [--rows N] [--output res.json]`
+
+Sans chaine de connexion, la base est simulée par un fichier SQLite où les géométries sont stockées en WKB
+hexadécimal, comme les renvoie PostGIS. Avec une chaine de connexion vers une base PostgreSQL/PostGIS locale,
+les tables sont créées dans le schéma `bench` et supprimées à la fin.
+
+Les tables synthétiques ressemblent à `base_infra.immeuble`, une par SRID du mélange demandé.
+Mesures, par table : latence à froid (requête en base) et à chaud (cache), débit en lignes/s, coût de décodage
+des géométries, temps d'écriture et de lecture du cache, et pic de mémoire résidente.
+"""
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import shapely
+
+from .common import environment
+from .common import peak_rss_mb
+from .common import summarize
+from .common import timeit
+from .common import write_results
+from ..argstruct.geo_table_info import GeoInfo
+from ..dbtool import Tool
+
+# Emprises approximatives (xmin, ymin, xmax, ymax) des SRID rencontrés dans la base
+SRID_BOUNDS = {
+    2154: (100000., 6050000., 1200000., 7100000.),  # Lambert 93, métropole
+    4326: (-5., 41., 9.5, 51.),
+    5490: (630000., 1590000., 740000., 1820000.),  # Antilles
+    2972: (150000., 230000., 400000., 650000.),  # Guyane
+    2975: (310000., 7630000., 380000., 7690000.),  # Réunion
+    }
+ETATS = np.array(['DEPLOYE', 'EN COURS DE DEPLOIEMENT', 'RACCORDABLE DEMANDE', 'ABANDONNE', 'SIGNE', 'CIBLE'])
+
+
+def parse_srid_mix(srid_mix: str) -> Dict[int, float]:
+    """Lis un mélange de SRID `2154:0.9,5490:0.1`.
+
+    Args:
+        srid_mix (str): SRID et part des lignes, séparés par des virgules
+
+    Returns:
+        Dict[int, float]: part des lignes par SRID
+    """
+    mix = {}
+    for item in srid_mix.split(','):
+        srid, share = item.split(':')
+        mix[int(srid)] = float(share)
+    total = sum(mix.values())
+    return {srid: share / total for srid, share in mix.items()}
+
+
+def synthetic_immeubles(rows: int, srid: int, geometry: str = 'point', seed: int = 0) -> pd.DataFrame:
+    """Génère une table d'immeubles synthétique, géométries en WKB hexadécimal.
+
+    Args:
+        rows (int): Nombre de lignes
+        srid (int): SRID des coordonnées
+        geometry (str, optional): `point` ou `polygon` (petits carrés). Defaults to 'point'.
+        seed (int, optional): graine aléatoire. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: la table
+    """
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = SRID_BOUNDS[srid]
+    x = rng.uniform(xmin, xmax, rows)
+    y = rng.uniform(ymin, ymax, rows)
+    if geometry == 'point':
+        geoms = shapely.points(x, y)
+    else:
+        side = (xmax - xmin) * 1e-5
+        geoms = shapely.box(x, y, x + side, y + side)
+
+    insee = rng.integers(1000, 95999, rows)
+    return pd.DataFrame({
+        'identifiant_immeuble': [f'IMB/{srid}/{i:08d}' for i in range(rows)],
+        'code_insee': np.char.zfill(insee.astype(str), 5),
+        'etat_immeuble': ETATS[rng.integers(0, len(ETATS), rows)],
+        'nb_logements': rng.integers(1, 200, rows),
+        'geom': shapely.to_wkb(geoms, hex=True),
+        })
+
+
+def seed_tables(tool: Tool, rows: int, srid_mix: Dict[int, float], geometry: str, standin: bool,
+                seed: int = 0) -> Dict[int, str]:
+    """Crée les tables synthétiques, une par SRID.
+
+    Returns:
+        Dict[int, str]: nom de table par SRID
+    """
+    tables = {}
+    schema = None if standin else 'bench'
+    if not standin:
+        tool.engine.execute('CREATE SCHEMA IF NOT EXISTS bench;')
+
+    for i, (srid, share) in enumerate(srid_mix.items()):
+        table = f'immeuble_{srid}'
+        df = synthetic_immeubles(max(1, int(rows * share)), srid, geometry=geometry, seed=seed + i)
+        df.to_sql(table, tool.engine, schema=schema, index=False, if_exists='replace', chunksize=10000)
+        if not standin:
+            tool.engine.execute(f'ALTER TABLE bench.{table} ALTER COLUMN geom TYPE geometry '
+                                f'USING ST_SetSRID(ST_GeomFromWKB(decode(geom, \'hex\')), {srid});')
+            table = f'bench.{table}'
+        tables[srid] = table
+    return tables
+
+
+def bench_table(tool: Tool, table: str, srid: int, standin: bool, repeat: int = 3) -> Dict[str, Any]:
+    """Mesure `fetch_query` sur une table.
+
+    Returns:
+        Dict[str, Any]: les mesures
+    """
+    query = f'SELECT * FROM {table}'
+    geo_info = GeoInfo(column='geom', table_path=table, condition='geom IS NOT NULL')
+    force_epsg = srid if standin else None
+
+    def _fetch(force_refetch: bool):
+        return tool.fetch_query(query, geo_info=geo_info, force_refetch=force_refetch, force_epsg=force_epsg)
+
+    cold = timeit(lambda: _fetch(True), repeat)
+    warm = timeit(lambda: _fetch(False), repeat)
+
+    raw = pd.read_sql(query, tool.engine)
+    decode = timeit(lambda: pdg.GeoSeries.from_wkb(raw['geom']), repeat)
+
+    gdf = _fetch(False)
+    cache_file = tool.tmp / f'bench_{srid}.fthr'
+    cache_write = timeit(lambda: gdf.to_feather(str(cache_file)), repeat)
+    cache_read = timeit(lambda: pdg.read_feather(cache_file), repeat)
+
+    return {
+        'table': table,
+        'srid': srid,
+        'rows': len(gdf),
+        'cold_s': summarize(cold),
+        'warm_s': summarize(warm),
+        'rows_per_s': len(gdf) / min(cold),
+        'geometry_decode_s': summarize(decode),
+        'cache_write_s': summarize(cache_write),
+        'cache_read_s': summarize(cache_read),
+        'cache_size_mb': cache_file.stat().st_size / 1024 ** 2,
+        'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def run(connection_string: Optional[str] = None,
+        rows: int = 100000,
+        srid_mix: str = '2154:0.9,5490:0.05,2975:0.05',
+        geometry: str = 'point',
+        repeat: int = 3,
+        seed: int = 0,
+        ) -> Dict[str, Any]:
+    """Lance le banc d'essai complet.
+
+    Args:
+        connection_string (Optional[str], optional): Base PostGIS locale. Defaults to None (SQLite simulé).
+        rows (int, optional): Nombre total de lignes. Defaults to 100000.
+        srid_mix (str, optional): mélange de SRID, voir `parse_srid_mix`. Defaults to '2154:0.9,5490:0.05,2975:0.05'.
+        geometry (str, optional): `point` ou `polygon`. Defaults to 'point'.
+        repeat (int, optional): Nombre de répétitions de chaque mesure. Defaults to 3.
+        seed (int, optional): graine aléatoire. Defaults to 0.
+
+    Returns:
+        Dict[str, Any]: paramètres, environnement et mesures par table
+    """
+    standin = connection_string is None
+    with tempfile.TemporaryDirectory(prefix='bench_dbtool_') as workdir:
+        if standin:
+            connection_string = f"sqlite:///{Path(workdir) / 'standin.sqlite'}"
+        tool = Tool(connection_string=connection_string, tmp=workdir)
+        tables = seed_tables(tool, rows, parse_srid_mix(srid_mix), geometry, standin, seed=seed)
+        try:
+            results: List[Dict[str, Any]] = [bench_table(tool, table, srid, standin, repeat=repeat)
+                                             for srid, table in tables.items()]
+        finally:
+            if not standin:
+                tool.engine.execute(f'DROP TABLE IF EXISTS {", ".join(tables.values())};')
+        tool.engine.dispose()
+
+    return {
+        'benchmark': 'dbtool.fetch_query',
+        'backend': 'sqlite-standin' if standin else 'postgis',
+        'parameters': {'rows': rows, 'srid_mix': srid_mix, 'geometry': geometry, 'repeat': repeat, 'seed': seed},
+        'environment': environment(),
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    """Point d'entrée de `python -m utils.benchmarks.bench_dbtool`."""
+    parser = argparse.ArgumentParser(description='Banc d\'essai de dbtool.fetch_query')
+    parser.add_argument('--connection-string', default=None, help='Base PostGIS locale. Sinon, SQLite simulé.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--srid-mix', default='2154:0.9,5490:0.05,2975:0.05')
+    parser.add_argument('--geometry', choices=['point', 'polygon'], default='point')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Fichier JSON de sortie')
+    args = parser.parse_args(argv)
+
+    write_results(run(connection_string=args.connection_string, rows=args.rows, srid_mix=args.srid_mix,
+                      geometry=args.geometry, repeat=args.repeat, seed=args.seed),
+                  output=args.output)
+
+
+if __name__ == '__main__':
+    main()
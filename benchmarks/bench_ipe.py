@@ -0,0 +1,157 @@
+"""
+Banc d'essai de la lecture des IPE.
+
+Utilisation : `python -m utils.benchmarks.bench_ipe [--archive ipe.zip | --members N --rows N] [--output res.json]`
+
+Sans archive, une archive synthétique est générée (voir `synthetic_ipe`). Mesures : durée de `parse_ipe` pour
+chaque moteur (`pandas`, `arrow`, en parallèle, et depuis le jeu de données ingéré), débit en Mo/s de CSV
+décompressé, latence par fichier de `read_single_ipe`, et pic de mémoire résidente.
+Le pic de mémoire est celui du processus : il ne fait que croitre d'une mesure à l'autre. Pour comparer deux
+moteurs, lancer un processus par moteur avec `--engines`.
+"""
+import argparse
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from unittest import mock
+
+from .common import environment
+from .common import peak_rss_mb
+from .common import summarize
+from .common import timeit
+from .common import write_results
+from .synthetic_ipe import V30_COLUMNS
+from .synthetic_ipe import make_synthetic_archive
+from .. import pathtools as pth
+from ..ipe import store
+from ..ipe.rwp import parse_ipe
+from ..ipe.rwp import read_single_ipe
+
+ENGINES = ('pandas', 'arrow', 'pandas-workers', 'arrow-workers', 'store')
+DEFAULT_COLUMNS = ['IdentifiantImmeuble', 'EtatImmeuble', 'CodeInseeImmeuble', 'NombreLogementsAdresseIPE',
+                   'CoordonneeImmeubleX', 'CoordonneeImmeubleY']
+
+
+def _csv_mb(archive: Path) -> float:
+    with zipfile.ZipFile(archive) as z:
+        return sum(info.file_size for info in z.infolist() if info.filename[-3:] == 'csv') / 1024 ** 2
+
+
+def bench_engine(archive: Path, engine: str, columns: List[str], workers: int, repeat: int = 3) -> Dict[str, Any]:
+    """Mesure `parse_ipe` avec un moteur.
+
+    Returns:
+        Dict[str, Any]: les mesures
+    """
+    if engine == 'store':
+        ingest = timeit(lambda: store.ingest_ipe(archive, force=True), 1)
+        durations = timeit(lambda: parse_ipe(archive, columns), repeat)
+        extra = {'ingest_s': ingest[0]}
+    else:
+        name, _, parallel = engine.partition('-')
+        n_workers = workers if parallel else None
+        durations = timeit(lambda: parse_ipe(archive, columns, engine=name, workers=n_workers, use_store=False),
+                           repeat)
+        extra = {'workers': n_workers}
+
+    return {
+        'engine': engine,
+        'parse_s': summarize(durations),
+        'mb_per_s': _csv_mb(archive) / min(durations),
+        'peak_rss_mb': peak_rss_mb(),
+        **extra,
+        }
+
+
+def bench_members(archive: Path, columns: List[str], repeat: int = 1) -> Dict[str, Any]:
+    """Mesure la latence de `read_single_ipe` sur chaque fichier de l'archive.
+
+    Returns:
+        Dict[str, Any]: résumé des latences, et latence par fichier
+    """
+    with zipfile.ZipFile(archive) as z:
+        names = [name for name in z.namelist() if name[-3:] == 'csv']
+    latencies = {name: min(timeit(lambda: read_single_ipe(name, columns, zipfilepath=archive), repeat))
+                 for name in names}
+    values = list(latencies.values())
+    return {'latency_s': {**summarize(values), 'max': max(values)}, 'members': latencies}
+
+
+def run(archive: Optional[Path] = None,
+        members: int = 20,
+        rows: int = 20000,
+        engines: Optional[List[str]] = None,
+        columns: Optional[List[str]] = None,
+        workers: int = 4,
+        repeat: int = 3,
+        seed: int = 0,
+        ) -> Dict[str, Any]:
+    """Lance le banc d'essai complet.
+
+    Args:
+        archive (Optional[Path], optional): Archive IPE à lire. Defaults to None (archive synthétique).
+        members (int, optional): Nombre de fichiers de l'archive synthétique. Defaults to 20.
+        rows (int, optional): Nombre de lignes par fichier de l'archive synthétique. Defaults to 20000.
+        engines (Optional[List[str]], optional): Moteurs mesurés, parmi ENGINES. Defaults to None (tous).
+        columns (Optional[List[str]], optional): Colonnes lues. Defaults to DEFAULT_COLUMNS.
+        workers (int, optional): Nombre de processus des moteurs parallèles. Defaults to 4.
+        repeat (int, optional): Nombre de répétitions de chaque mesure. Defaults to 3.
+        seed (int, optional): graine aléatoire. Defaults to 0.
+
+    Returns:
+        Dict[str, Any]: paramètres, environnement et mesures
+    """
+    engines = list(ENGINES) if engines is None else engines
+    columns = DEFAULT_COLUMNS if columns is None else columns
+    with tempfile.TemporaryDirectory(prefix='bench_ipe_') as workdir:
+        workdir = Path(workdir)
+        manifest = None
+        if archive is None:
+            archive = workdir / 'IPE_synthetique.zip'
+            manifest = make_synthetic_archive(archive, members=members, rows=rows, seed=seed)
+
+        # Caches (encodages, index, jeu de données ingéré) dans le dossier de travail
+        with mock.patch.object(pth, 'tmp_path', return_value=workdir), \
+                mock.patch.object(pth, 'specific_datapath', return_value=workdir):
+            results = [bench_engine(archive, engine, columns, workers, repeat=repeat) for engine in engines]
+            per_member = bench_members(archive, columns)
+        csv_mb = _csv_mb(archive)
+
+    return {
+        'benchmark': 'ipe.parse_ipe',
+        'archive': 'synthetic' if manifest is not None else str(archive),
+        'parameters': {'members': members, 'rows': rows, 'columns': columns, 'workers': workers, 'repeat': repeat,
+                       'seed': seed, 'csv_mb': csv_mb},
+        'environment': environment(),
+        'results': results,
+        'read_single_ipe': per_member,
+        'synthetic_members': manifest,
+        'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    """Point d'entrée de `python -m utils.benchmarks.bench_ipe`."""
+    parser = argparse.ArgumentParser(description='Banc d\'essai de la lecture des IPE')
+    parser.add_argument('--archive', type=Path, default=None, help='Archive IPE. Sinon, archive synthétique.')
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=None)
+    parser.add_argument('--columns', nargs='+', default=None, choices=V30_COLUMNS)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Fichier JSON de sortie')
+    args = parser.parse_args(argv)
+
+    write_results(run(archive=args.archive, members=args.members, rows=args.rows, engines=args.engines,
+                      columns=args.columns, workers=args.workers, repeat=args.repeat, seed=args.seed),
+                  output=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Outils communs aux bancs d'essai : chronométrage, mémoire, description de l'environnement et écriture JSON.
+"""
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .. import pathtools as pth
+
+
+def peak_rss_mb() -> float:
+    """Pic de mémoire résidente du processus depuis son lancement.
+
+    Returns:
+        float: le pic, en Mo
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux compte en ko, macOS en octets
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def timeit(func: Callable[[], Any], repeat: int = 3) -> List[float]:
+    """Chronomètre `repeat` appels de `func`.
+
+    Args:
+        func (Callable[[], Any]): fonction à chronométrer
+        repeat (int, optional): Nombre d'appels. Defaults to 3.
+
+    Returns:
+        List[float]: durées, en secondes
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """Résume une série de durées.
+
+    Args:
+        durations (List[float]): durées, en secondes
+
+    Returns:
+        Dict[str, float]: minimum et médiane
+    """
+    return {'min': min(durations), 'median': statistics.median(durations)}
+
+
+def environment() -> Dict[str, Optional[str]]:
+    """Décris l'environnement d'exécution, pour comparer des résultats entre versions.
+
+    Returns:
+        Dict[str, Optional[str]]: versions de Python, des bibliothèques et commit git courant
+    """
+    env: Dict[str, Optional[str]] = {'python': platform.python_version(), 'platform': platform.platform()}
+    for module in ('pandas', 'geopandas', 'pyarrow', 'sqlalchemy'):
+        try:
+            env[module] = __import__(module).__version__
+        except ImportError:
+            env[module] = None
+    try:
+        env['commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=pth.get_tool_path(), capture_output=True,
+                                       text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        env['commit'] = None
+    return env
+
+
+def write_results(results: Dict[str, Any], output: Optional[Path] = None):
+    """Écris les résultats en JSON, dans `output` ou sur la sortie standard.
+
+    Args:
+        results (Dict[str, Any]): résultats du banc d'essai
+        output (Optional[Path], optional): fichier de sortie. Defaults to None.
+    """
+    text = json.dumps(results, indent=2, default=str)
+    if output is None:
+        print(text)
+    else:
+        Path(output).write_text(text)
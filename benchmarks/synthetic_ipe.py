@@ -0,0 +1,166 @@
+"""
+Générateur d'archives IPE synthétiques, pour mesurer la lecture des IPE sans l'archive réelle.
+
+Les fichiers ressemblent aux livraisons des opérateurs : colonnes du format Interop'Fibre 2.2 ou 3.0, communes et
+voies accentuées, encodages mélangés (UTF-8, Windows-1252, Latin-1). Certains fichiers UTF-8 contiennent quelques
+octets Windows-1252 vers leur fin, comme les fichiers retouchés à la main, et d'autres n'ont pas toutes les colonnes.
+"""
+import zipfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+V22_COLUMNS = [
+    'IdentifiantImmeuble', 'EtatImmeuble', 'CodeInseeImmeuble', 'CodePostalImmeuble', 'CommuneImmeuble',
+    'CodeAdresseImmeuble', 'NumeroVoieImmeuble', 'TypeVoieImmeuble', 'NomVoieImmeuble', 'BatimentImmeuble',
+    'NombreLogementsAdresseIPE', 'NombreLogementsImmeuble', 'CoordonneeImmeubleX', 'CoordonneeImmeubleY',
+    'TypeProjection', 'TypeImmeuble', 'DateMiseEnServiceCommercialeImmeuble', 'DateDebutAcceptationCmdAcces',
+    'ReferencePM', 'EtatPM', 'CoordonneePMX', 'CoordonneePMY', 'TypeEmplacementPM', 'DateInstallationPM',
+    'CodeL331', 'TypeZone',
+    ]
+V30_COLUMNS = V22_COLUMNS + ['CategorieImmeuble', 'DateCompletudeHabitation']
+COLUMNS = {'2.2': V22_COLUMNS, '3.0': V30_COLUMNS}
+
+ENCODINGS = {'UTF-8': 0.6, 'Windows-1252': 0.3, 'Latin-1': 0.1}
+OPERATORS = ['ORAN', 'SFR0', 'FREE', 'BOUY', 'AXIO', 'COVA', 'FIBA', 'TUTO']
+COMMUNES = [('71378', '71500', 'Louhans'), ('42218', '42000', 'Saint-Étienne'), ('21231', '21000', 'Dijon'),
+            ('97411', '97400', 'Saint-Denis'), ('59350', '59000', 'Lille'), ('29019', '29200', 'Brest'),
+            ('2A004', '20000', 'Ajaccio'), ('06088', '06000', 'Nice')]
+VOIES = ['de l\'Église', 'des Frères Lumière', 'du Général de Gaulle', 'Émile Zola', 'de la Gare', 'des Écoles',
+         'Jean Jaurès', 'du Château d\'Eau']
+TYPES_VOIE = ['RUE', 'AVENUE', 'BOULEVARD', 'CHEMIN', 'IMPASSE', 'PLACE']
+ETATS = ['DEPLOYE', 'EN COURS DE DEPLOIEMENT', 'RACCORDABLE DEMANDE', 'ABANDONNE', 'SIGNE', 'CIBLE']
+# 0x81 n'existe pas en Windows-1252 : un fichier qui en contient se lit en Latin-1
+BAD_BYTES = {'Windows-1252': 'é'.encode('Windows-1252'), 'Latin-1': b'\x81'}
+
+
+def synthetic_member(rows: int, version: str = '3.0', seed: int = 0,
+                     missing: Optional[List[str]] = None) -> pd.DataFrame:
+    """Génère le contenu d'un fichier IPE, en chaines comme dans les CSV livrés.
+
+    Args:
+        rows (int): Nombre de lignes
+        version (str, optional): version du format, `2.2` ou `3.0`. Defaults to '3.0'.
+        seed (int, optional): graine aléatoire. Defaults to 0.
+        missing (Optional[List[str]], optional): colonnes à retirer. Defaults to None.
+
+    Returns:
+        pd.DataFrame: le contenu du fichier
+    """
+    rng = np.random.default_rng(seed)
+    communes = np.array(COMMUNES, dtype=object)[rng.integers(0, len(COMMUNES), rows)]
+    numbers = rng.integers(1, 200, rows)
+    x = rng.uniform(100000., 1200000., rows)
+    y = rng.uniform(6050000., 7100000., rows)
+    dates = pd.to_datetime('2015-01-01') + pd.to_timedelta(rng.integers(0, 2500, rows), unit='D')
+    pm = rng.integers(0, max(1, rows // 300), rows)
+
+    df = pd.DataFrame({
+        'IdentifiantImmeuble': [f'IMB/{seed:04d}/S/{i:08X}' for i in range(rows)],
+        'EtatImmeuble': np.array(ETATS)[rng.integers(0, len(ETATS), rows)],
+        'CodeInseeImmeuble': communes[:, 0],
+        'CodePostalImmeuble': communes[:, 1],
+        'CommuneImmeuble': communes[:, 2],
+        'CodeAdresseImmeuble': [f'{insee}_{n:04d}' for insee, n in zip(communes[:, 0], numbers)],
+        'NumeroVoieImmeuble': numbers.astype(str),
+        'TypeVoieImmeuble': np.array(TYPES_VOIE)[rng.integers(0, len(TYPES_VOIE), rows)],
+        'NomVoieImmeuble': np.array(VOIES, dtype=object)[rng.integers(0, len(VOIES), rows)],
+        'BatimentImmeuble': np.where(rng.random(rows) < 0.2, 'A', ''),
+        'NombreLogementsAdresseIPE': rng.integers(1, 120, rows).astype(str),
+        'NombreLogementsImmeuble': rng.integers(1, 120, rows).astype(str),
+        'CoordonneeImmeubleX': np.char.replace(np.round(x, 2).astype(str), '.', ','),
+        'CoordonneeImmeubleY': np.char.replace(np.round(y, 2).astype(str), '.', ','),
+        'TypeProjection': 'L93',
+        'TypeImmeuble': np.where(rng.random(rows) < 0.7, 'PAVILLON', 'IMMEUBLE'),
+        'DateMiseEnServiceCommercialeImmeuble': dates.strftime('%Y%m%d'),
+        'DateDebutAcceptationCmdAcces': dates.strftime('%Y%m%d'),
+        'ReferencePM': [f'PM_{seed:04d}_{p:05d}' for p in pm],
+        'EtatPM': 'DEPLOYE',
+        'CoordonneePMX': np.char.replace(np.round(x, 0).astype(str), '.', ','),
+        'CoordonneePMY': np.char.replace(np.round(y, 0).astype(str), '.', ','),
+        'TypeEmplacementPM': 'PME',
+        'DateInstallationPM': dates.strftime('%d/%m/%Y'),
+        'CodeL331': '',
+        'TypeZone': rng.choice(['1', '2', '3'], rows),
+        'CategorieImmeuble': rng.choice(['LOGEMENT', 'MIXTE', 'ENTREPRISE'], rows),
+        'DateCompletudeHabitation': dates.strftime('%Y%m%d'),
+        })
+    columns = [column for column in COLUMNS[version] if column not in (missing or [])]
+    return df[columns]
+
+
+def member_bytes(df: pd.DataFrame, encoding: str, bad_bytes: Optional[str] = None) -> bytes:
+    """Encode un fichier IPE. Avec `bad_bytes`, le fichier est écrit en UTF-8 sauf un caractère des dernières
+    lignes, écrit dans cet encodage : la détection doit lire tout le fichier pour s'en rendre compte.
+
+    Args:
+        df (pd.DataFrame): contenu du fichier
+        encoding (str): encodage du fichier
+        bad_bytes (Optional[str], optional): `Windows-1252` ou `Latin-1`. Defaults to None.
+
+    Returns:
+        bytes: le fichier
+    """
+    text = df.to_csv(sep=';', index=False)
+    if bad_bytes is None:
+        return text.encode(encoding)
+    data = text.encode('UTF-8')
+    position = data.rfind(b'\n', 0, max(len(data) - 2, 0))
+    return data[:position] + BAD_BYTES[bad_bytes] + data[position:]
+
+
+def make_synthetic_archive(path: Union[str, Path],
+                           members: int = 10,
+                           rows: int = 10000,
+                           v22_share: float = 0.3,
+                           encodings: Optional[Dict[str, float]] = None,
+                           bad_bytes_share: float = 0.1,
+                           missing_share: float = 0.1,
+                           seed: int = 0,
+                           ) -> Dict[str, Dict[str, Any]]:
+    """Écris une archive IPE synthétique.
+
+    Args:
+        path (Union[str, Path]): chemin de l'archive
+        members (int, optional): Nombre de fichiers. Defaults to 10.
+        rows (int, optional): Nombre de lignes par fichier. Defaults to 10000.
+        v22_share (float, optional): Part des fichiers au format 2.2. Defaults to 0.3.
+        encodings (Optional[Dict[str, float]], optional): Part des fichiers par encodage. Defaults to ENCODINGS.
+        bad_bytes_share (float, optional): Part des fichiers UTF-8 avec des octets Windows-1252 ou Latin-1 vers
+                la fin. Defaults to 0.1.
+        missing_share (float, optional): Part des fichiers où il manque des colonnes. Defaults to 0.1.
+        seed (int, optional): graine aléatoire. Defaults to 0.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: description de chaque fichier (version, encodage attendu, colonnes manquantes,
+            lignes)
+    """
+    rng = np.random.default_rng(seed)
+    encodings = ENCODINGS if encodings is None else encodings
+    names = list(encodings)
+    shares = np.array([encodings[name] for name in names], dtype=float)
+
+    manifest = {}
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        for i in range(members):
+            version = '2.2' if rng.random() < v22_share else '3.0'
+            encoding = names[rng.choice(len(names), p=shares / shares.sum())]
+            missing = list(rng.choice(['BatimentImmeuble', 'NombreLogementsImmeuble', 'TypeZone'],
+                                      size=rng.integers(1, 3), replace=False)) if rng.random() < missing_share else []
+            bad_bytes = None
+            if encoding == 'UTF-8' and rng.random() < bad_bytes_share:
+                bad_bytes = 'Windows-1252' if rng.random() < 0.5 else 'Latin-1'
+
+            operator = OPERATORS[i % len(OPERATORS)]
+            name = f'IPE_t1_2021/IPE_Z{i:03d}_{operator}_PM_IPEZMD_V{version.replace(".", "")}_20210419.csv'
+            df = synthetic_member(rows, version=version, seed=seed * 1000 + i, missing=missing)
+            z.writestr(name, member_bytes(df, encoding, bad_bytes=bad_bytes))
+            manifest[name] = {'version': version, 'encoding': bad_bytes or encoding, 'missing': missing,
+                              'rows': rows}
+    return manifest
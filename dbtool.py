@@ -2,20 +2,26 @@
 Outil de requêtes SQL en base, avec fonction de mise en cache des résultats.
 """
 import hashlib
+import json
 import logging
 import os
 import re
+import shutil
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from pathlib import Path
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Iterator
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import geopandas as pdg
 import pandas as pd
+import pyarrow.feather as pa_feather
 import sqlalchemy as sqa
 from sqlalchemy import create_engine
 from sqlalchemy.engine.reflection import Inspector
@@ -25,9 +31,17 @@ from . import pathtools
 from . import pathtools as pth
 from .argstruct.database_secret import ExtendedDatabaseSecret
 from .argstruct.geo_table_info import GeoInfo
+from .argstruct.geo_table_info import GeoReduction
+from .config.reader import ConfigManager
 
 warnings.filterwarnings("ignore", message=".*initial implementation of Parquet.*")
 
+# Rapport entre l'occupation mémoire d'une DataFrame et la largeur estimée par Postgres (objets Python,
+# index...). À calibrer avec les journaux `Memory estimate`.
+MEMORY_OVERHEAD_FACTOR = 3
+# Part du budget mémoire occupée par un morceau lors du chargement par morceaux.
+SPILL_CHUNK_FRACTION = 0.1
+
 
 # TODO REMOVE
 def _create_dir(folder_path: Path):
@@ -41,6 +55,53 @@ def _rm_string_marker(string: str) -> str:
     return string
 
 
+def _quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _strip_query(query: str) -> str:
+    return str(query).strip().rstrip(';').strip()
+
+
+def _reduced_geometry_expression(column: str, reduction: GeoReduction) -> str:
+    expression = _quote_identifier(column)
+    if reduction.mode == 'centroid':
+        expression = f"ST_Centroid({expression})"
+    elif reduction.mode == 'bbox':
+        expression = f"ST_Envelope({expression})"
+
+    if reduction.tolerance is not None:
+        expression = f"ST_SimplifyPreserveTopology({expression}, {float(reduction.tolerance)})"
+    if reduction.precision is not None:
+        expression = f"ST_QuantizeCoordinates({expression}, {int(reduction.precision)})"
+    return expression
+
+
+def _reduced_query(query: str, columns: List[str], geo_info: GeoInfo) -> str:
+    if geo_info.column not in columns:
+        raise ValueError(f"The geometry column {geo_info.column} is not returned by the query.")
+
+    select = []
+    for column in columns:
+        if column == geo_info.column:
+            select.append(f"{_reduced_geometry_expression(column, geo_info.reduction)} AS {_quote_identifier(column)}")
+        else:
+            select.append(f"_q.{_quote_identifier(column)}")
+    return f"SELECT {', '.join(select)} FROM ({_strip_query(query)}) AS _q"
+
+
+def _to_geodataframe(df: pd.DataFrame, geo_info: GeoInfo, crs: Optional[str]) -> pdg.GeoDataFrame:
+    gk = pdg.GeoSeries.from_wkb(df[geo_info.column])  # type: ignore
+    df = pdg.GeoDataFrame(df, geometry=gk, crs=crs)
+    if geo_info.column != 'geometry':
+        df = df.drop([geo_info.column], axis=1)  # type: ignore
+    return df
+
+
+def _frame_memory(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
 def _connection_string_from_secret_file(secret_path_file: Optional[Union[Path, str]] = None):
     parser = ConfigParser()
     secretpath = pth.get_tool_path() / "secret/db.cfg"  # Pour la rétro-compatibilité
@@ -58,18 +119,97 @@ def _connection_string_from_db_secret(database_secret: ExtendedDatabaseSecret):
            f'{database_secret.port}/{database_secret.db}'
 
 
+class SpilledResult:
+    """
+    Résultat de requête écrit sur disque par morceaux (un fichier feather par morceau), et chargé
+    paresseusement. Renvoyé par `Tool.fetch_query` quand le résultat estimé dépasse le budget mémoire.
+    """
+
+    def __init__(self, path: Path, geo_info: Optional[GeoInfo] = None, crs: Optional[str] = None):
+        self._path = Path(path)
+        self._geo_info = geo_info
+        self._crs = crs
+
+    @property
+    def path(self) -> Path:
+        """Dossier contenant les morceaux du résultat
+
+        Returns:
+            Path: chemin du dossier
+        """
+        return self._path
+
+    @property
+    def parts(self) -> List[Path]:
+        """Fichiers des morceaux, dans l'ordre du résultat
+
+        Returns:
+            List[Path]: chemins des fichiers feather
+        """
+        return sorted(self._path.glob('part-*.fthr'))
+
+    def __len__(self) -> int:
+        return sum(pa_feather.read_table(str(part), memory_map=True).num_rows for part in self.parts)
+
+    def iter_chunks(self, columns: Optional[List[str]] = None) -> Iterator[Union[pd.DataFrame, pdg.GeoDataFrame]]:
+        """Parcours le résultat morceau par morceau.
+
+        Args:
+            columns (Optional[List[str]], optional): Colonnes à charger. Defaults to None (toutes).
+
+        Yields:
+            Union[pd.DataFrame, pdg.GeoDataFrame]: un morceau du résultat
+        """
+        if columns is not None and self._geo_info is not None and self._geo_info.column not in columns:
+            columns = list(columns) + [self._geo_info.column]
+        for part in self.parts:
+            df = pd.read_feather(part, columns=columns)
+            if self._geo_info is not None:
+                df = _to_geodataframe(df, self._geo_info, self._crs)
+            yield df
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> Union[pd.DataFrame, pdg.GeoDataFrame]:
+        """Charge tout le résultat en mémoire.
+
+        Args:
+            columns (Optional[List[str]], optional): Colonnes à charger. Defaults to None (toutes).
+
+        Returns:
+            Union[pd.DataFrame, pdg.GeoDataFrame]: Le résultat complet
+        """
+        chunks = list(self.iter_chunks(columns=columns))
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True)
+
+
 class Tool:
     """
     Outil de connexion et de requête en base, de chargement de geo/dataframe.
+
+    Si `memory_budget` (en octets) est renseigné, `fetch_query` estime la taille du résultat avec `EXPLAIN` avant
+    de lancer la requête, et écrit le résultat sur disque par morceaux (`SpilledResult`) s'il dépasse le budget.
+
+    `cache_namespace` préfixe les clefs de cache, pour que deux bases différentes ne partagent pas leurs résultats.
+    `tmp` remplace le dossier de cache par défaut (`pathtools.tmp_path()`). Une base `frozen` ne change plus : la
+    projection d'une colonne géométrique n'y est demandée qu'une fois, puis lue depuis le cache.
     """
 
     def __init__(self,
                  secret_path_file: Optional[Union[Path, str]] = None,
                  connection_string: Optional[str] = None,
-                 database_secret: Optional[ExtendedDatabaseSecret] = None
+                 database_secret: Optional[ExtendedDatabaseSecret] = None,
+                 memory_budget: Optional[int] = None,
+                 cache_namespace: Optional[str] = None,
+                 tmp: Optional[Union[str, Path]] = None,
+                 frozen: bool = False,
                  ):
-        self._tmp = pth.tmp_path()
+        self._tmp = Path(tmp) if tmp is not None else pth.tmp_path()
         self._connexion_string = ""
+        self._memory_budget = memory_budget
+        self._cache_namespace = cache_namespace
+        self._frozen = frozen
+        self._crs_cache: Dict[str, str] = {}
         self._engine = self._create_engine(secret_path_file, connection_string, database_secret)
 
     @property
@@ -92,6 +232,15 @@ class Tool:
         """
         return self._engine
 
+    @property
+    def memory_budget(self) -> Optional[int]:
+        """Budget mémoire, en octets, au delà duquel les résultats sont écrits sur disque par morceaux.
+
+        Returns:
+            Optional[int]: le budget, ou None si la garde est désactivée
+        """
+        return self._memory_budget
+
     @property
     def connexion_string(self) -> str:
         """Retourne la chaine de connexion utilisée pour parler avec la base
@@ -158,6 +307,103 @@ class Tool:
         else:
             return '4326'  # Pas de CRS. On se rabat sur un par défaut.
 
+    def _resolve_crs(self, geo_info: Optional[GeoInfo], force_epsg: Optional[int] = None) -> Optional[str]:
+        crs = None
+        if force_epsg is not None:
+            crs = f'EPSG:{force_epsg}'
+        else:
+            if geo_info is not None:
+                if geo_info.condition is None:
+                    logging.warning(
+                            "You specified the informations to retrieve the CRS info, but you did not "
+                            "provide any condition over the database. Are you sure the table is meant to be"
+                            "unfiltered?"
+                            )
+
+                crs = "EPSG:" + (self._get_frozen_crs(geo_info) if self._frozen else self._get_crs(geo_info))
+                logging.debug("Found CRS = %s", crs)
+        return crs
+
+    def _get_frozen_crs(self, geo_info: GeoInfo) -> str:
+        # Base figée : la projection est gardée en mémoire et sur disque, par espace de cache et par colonne
+        key = pth.hash_data(("crs", self._cache_namespace, geo_info))
+        if key not in self._crs_cache:
+            crs_path = self.tmp / f"crs_{key}.pkl"
+            if crs_path.exists():
+                self._crs_cache[key] = misc.load(filepath=crs_path)
+            else:
+                self._crs_cache[key] = self._get_crs(geo_info)
+                misc.save(data=self._crs_cache[key], filepath=crs_path)
+        return self._crs_cache[key]
+
+    def _cache_path(self, query: str, geo_info: Optional[GeoInfo], crs: Optional[str],
+                    params: Optional[Dict[str, Any]] = None) -> Path:
+        eqry = str(query) + str(geo_info) + str(crs)
+        if self._cache_namespace is not None:
+            eqry = self._cache_namespace + eqry
+        if geo_info is not None and geo_info.reduction is not None:
+            eqry += str(geo_info.reduction)
+        if params is not None:
+            eqry += str(sorted(params.items()))
+        return self.tmp / (str(hashlib.md5(eqry.encode("UTF8")).hexdigest()) + ".fthr")
+
+    def cache_path(self,
+                   query: str,
+                   geo_info: Optional[GeoInfo] = None,
+                   params: Optional[Dict[str, Any]] = None,
+                   force_epsg: int = None
+                   ) -> Path:
+        """Chemin du fichier de cache de `fetch_query` pour ces arguments. Un résultat écrit par morceaux
+        (voir `SpilledResult`) se trouve dans le dossier de même nom, d'extension `.spill`.
+
+        Args:
+            query (str): Requête
+            geo_info (Optional[GeoInfo], optional): voir `fetch_query`. Defaults to None.
+            params (Optional[Dict[str, Any]], optional): voir `fetch_query`. Defaults to None.
+            force_epsg (int, optional): voir `fetch_query`. Defaults to None.
+
+        Returns:
+            Path: chemin du fichier feather de cache, qu'il existe ou non
+        """
+        crs = self._resolve_crs(geo_info, force_epsg)
+        return self._cache_path(query, geo_info, crs, params)
+
+    def _apply_reduction(self, query: str, geo_info: GeoInfo, params: Optional[Dict[str, Any]] = None) -> str:
+        probe = pd.read_sql(f"SELECT * FROM ({_strip_query(query)}) AS _q LIMIT 0", self._engine, params=params)
+        return _reduced_query(query, list(probe.columns), geo_info)
+
+    def _estimate_result_size(self, query: str, params: Optional[Dict[str, Any]] = None
+                              ) -> Optional[Tuple[int, int]]:
+        try:
+            plan = pd.read_sql(f"EXPLAIN (FORMAT JSON) {_strip_query(query)}", self._engine, params=params)
+        except sqa.exc.SQLAlchemyError:
+            logging.debug("Could not estimate the size of the query\n%s", query)
+            return None
+
+        plan = plan.iloc[0, 0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        return int(root["Plan Rows"]), int(root["Plan Width"])
+
+    def _spill_query(self, query: str, spill_path: Path, chunk_rows: int,
+                     params: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+        building_path = spill_path.with_suffix('.spilling')
+        for path in (spill_path, building_path):
+            if path.exists():
+                shutil.rmtree(path)
+        building_path.mkdir(parents=True)
+
+        nrows, nbytes = 0, 0
+        with self._engine.connect().execution_options(stream_results=True) as connection:
+            chunks = pd.read_sql(query, connection, params=params, chunksize=chunk_rows)
+            for i, chunk in enumerate(chunks):
+                chunk.reset_index(drop=True).to_feather(str(building_path / f"part-{i:05d}.fthr"))
+                nrows += len(chunk)
+                nbytes = max(nbytes, _frame_memory(chunk))
+        building_path.rename(spill_path)
+        return nrows, nbytes
+
     @staticmethod
     def _get_proper_loader(geo_info: Optional[GeoInfo]):
         if geo_info is not None:
@@ -173,7 +419,7 @@ class Tool:
             force_refetch: bool = False,
             params: Optional[Dict[str, Any]] = None,
             force_epsg: int = None
-            ) -> Union[pd.DataFrame, pdg.GeoDataFrame]:
+            ) -> Union[pd.DataFrame, pdg.GeoDataFrame, SpilledResult]:
         """Exécute une requête qui va chercher des données en base et les formatte en Geo/Dataframe.
 
         Args:
@@ -185,45 +431,63 @@ class Tool:
             params (Optional[Dict[str, Any]], optional): Paramètres de requêtes supplémentaires.
                                                          Defaults to None.
 
-        Returns:
-            Union[pd.DataFrame, pdg.GeoDataFrame]: La géo/dataframe contenant les données requêtées.
-        """
+        Si `geo_info.reduction` est renseigné, la géométrie est réduite côté serveur (simplification,
+        quantification, centroïde ou emprise) avant d'être transférée.
 
-        crs = None
-        if force_epsg is not None:
-            crs = f'EPSG:{force_epsg}'
-        else:
-            if geo_info is not None:
-                if geo_info.condition is None:
-                    logging.warning(
-                            "You specified the informations to retrieve the CRS info, but you did not "
-                            "provide any condition over the database. Are you sure the table is meant to be"
-                            "unfiltered?"
-                            )
-
-                crs = "EPSG:" + self._get_crs(geo_info)
-                logging.debug("Found CRS = %s", crs)
+        Si l'outil a un budget mémoire et que l'estimation `EXPLAIN` du résultat le dépasse, le résultat est
+        écrit sur disque par morceaux et renvoyé sous forme de `SpilledResult`, chargé paresseusement.
 
+        Returns:
+            Union[pd.DataFrame, pdg.GeoDataFrame, SpilledResult]: La géo/dataframe contenant les données requêtées.
+        """
 
+        crs = self._resolve_crs(geo_info, force_epsg)
         _loader = self._get_proper_loader(geo_info)
-
-        eqry = str(query) + str(geo_info) + str(crs)
-        save_path = self.tmp / (str(hashlib.md5(eqry.encode("UTF8")).hexdigest()) + ".fthr")
+        save_path = self._cache_path(query, geo_info, crs, params)
         loaded_from_server = False
 
+        spill_path = save_path.with_suffix(".spill")
+        estimate = None
+
         # Load
+        if spill_path.is_dir() and not force_refetch:
+            spilled = SpilledResult(spill_path, geo_info=geo_info, crs=crs)
+            return spilled if self._memory_budget is not None else spilled.to_frame()
         if os.path.exists(save_path) and not force_refetch:
             df = _loader(save_path)  # type: ignore
         else:
+            if geo_info is not None and geo_info.reduction is not None:
+                query = self._apply_reduction(query, geo_info, params=params)
+
+            if self._memory_budget is not None:
+                estimate = self._estimate_result_size(query, params=params)
+            if estimate is not None and estimate[0] * estimate[1] * MEMORY_OVERHEAD_FACTOR > self._memory_budget:
+                chunk_rows = max(1, int(self._memory_budget * SPILL_CHUNK_FRACTION
+                                        / (max(estimate[1], 1) * MEMORY_OVERHEAD_FACTOR)))
+                logging.info("Estimated result (%s rows x %s bytes) exceeds the memory budget of %s bytes. "
+                             "Spilling to %s by chunks of %s rows.",
+                             estimate[0], estimate[1], self._memory_budget, spill_path, chunk_rows)
+                nrows, nbytes = self._spill_query(query, spill_path, chunk_rows, params=params)
+                # Le résultat déversé remplace un éventuel résultat en mémoire d'une exécution précédente
+                if os.path.exists(save_path):
+                    os.unlink(save_path)
+                logging.info("Memory estimate: %s rows x %s bytes, actual: %s rows, %s bytes per chunk of %s rows",
+                             estimate[0], estimate[1], nrows, nbytes, chunk_rows)
+                return SpilledResult(spill_path, geo_info=geo_info, crs=crs)
+
             df = pd.read_sql(query, self._engine, params=params)
             loaded_from_server = True
+            # Le dossier `.spill` est lu en premier : un résultat déversé lors d'une exécution précédente
+            # masquerait celui-ci
+            if spill_path.is_dir():
+                shutil.rmtree(spill_path)
+            if estimate is not None:
+                logging.info("Memory estimate: %s rows x %s bytes, actual: %s rows, %s bytes",
+                             estimate[0], estimate[1], len(df), _frame_memory(df))
 
         # Parse
         if loaded_from_server and geo_info is not None:
-            gk = pdg.GeoSeries.from_wkb(df[geo_info.column])  # type: ignore
-            df = pdg.GeoDataFrame(df, geometry=gk, crs=crs)
-            if geo_info.column != 'geometry':
-                df = df.drop([geo_info.column], axis=1)  # type: ignore
+            df = _to_geodataframe(df, geo_info, crs)
 
         # Save
         if df.empty:
@@ -260,3 +524,100 @@ class Tool:
         if to_drop:  # != []:
             engine.execute(f'DROP TABLE {", ".join(to_drop)};')
         return to_drop
+
+
+class MillesimeTool:
+    """
+    Outil de requête sur plusieurs millésimes de la base d'infrastructure (`base_infra_a<millesime>`).
+
+    Chaque millésime a son propre `Tool`, donc son propre moteur et sa propre réserve de connexions, et son propre
+    espace de cache. Les millésimes historiques sont figés : seul le millésime ouvert (le plus récent, par défaut)
+    est concerné par `force_refetch`.
+    """
+
+    def __init__(self,
+                 secret_file_path: Union[str, Path],
+                 millesimes: List[Union[str, int]],
+                 open_millesime: Optional[Union[str, int]] = None,
+                 ):
+        self._millesimes = [str(millesime) for millesime in millesimes]
+        self._open_millesime = str(open_millesime) if open_millesime is not None else max(self._millesimes)
+        self._tools = {
+            millesime: Tool(connection_string=ConfigManager.create_connection_string(secret_file_path, millesime),
+                            cache_namespace=f"base_infra_a{millesime}",
+                            frozen=self.is_frozen(millesime))
+            for millesime in self._millesimes
+            }
+
+    @property
+    def millesimes(self) -> List[str]:
+        """Millésimes interrogés
+
+        Returns:
+            List[str]: la liste des millésimes
+        """
+        return self._millesimes
+
+    @property
+    def tools(self) -> Dict[str, Tool]:
+        """Outils de requête, par millésime
+
+        Returns:
+            Dict[str, Tool]: un `Tool` par millésime
+        """
+        return self._tools
+
+    def is_frozen(self, millesime: Union[str, int]) -> bool:
+        """Un millésime historique ne change plus : son cache n'a jamais besoin d'être revalidé.
+
+        Args:
+            millesime (Union[str, int]): millésime à tester
+
+        Returns:
+            bool: Vrai ssi le millésime est antérieur au millésime ouvert
+        """
+        return str(millesime) < self._open_millesime
+
+    def fetch_query(
+            self,
+            query: str,
+            geo_info: Optional[GeoInfo] = None,
+            force_refetch: bool = False,
+            params: Optional[Dict[str, Any]] = None,
+            force_epsg: int = None,
+            millesime_column: str = "millesime",
+            workers: Optional[int] = None,
+            ) -> Union[pd.DataFrame, pdg.GeoDataFrame]:
+        """Exécute la même requête sur chaque millésime, en parallèle, et empile les résultats.
+
+        Args:
+            query (str): Requête à exécuter. DOIT RETOURNER DES VALEURS
+            geo_info (Optional[GeoInfo], optional): voir `Tool.fetch_query`. Defaults to None.
+            force_refetch (bool, optional): Ignore le cache du millésime ouvert. Les millésimes figés sont toujours
+                            lus depuis le cache s'il existe. Defaults to False.
+            params (Optional[Dict[str, Any]], optional): Paramètres de requêtes supplémentaires. Defaults to None.
+            force_epsg (int, optional): voir `Tool.fetch_query`. Defaults to None.
+            millesime_column (str, optional): Colonne ajoutée portant le millésime de chaque ligne.
+                            Defaults to "millesime".
+            workers (Optional[int], optional): Nombre de requêtes simultanées. Defaults to None (une par millésime).
+
+        Returns:
+            Union[pd.DataFrame, pdg.GeoDataFrame]: Les résultats de chaque millésime, empilés.
+        """
+
+        def _fetch(millesime: str) -> Union[pd.DataFrame, pdg.GeoDataFrame]:
+            df = self._tools[millesime].fetch_query(query,
+                                                    geo_info=geo_info,
+                                                    force_refetch=force_refetch and not self.is_frozen(millesime),
+                                                    params=params,
+                                                    force_epsg=force_epsg)
+            if isinstance(df, SpilledResult):
+                df = df.to_frame()
+            df[millesime_column] = millesime
+            return df
+
+        workers = workers if workers is not None else len(self._millesimes)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            dfs = list(executor.map(_fetch, self._millesimes))
+
+        return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,312 @@
+"""
+Parcours d'arborescences de fichiers avec `os.scandir`, et index persistant des fichiers.
+
+`iter_files` parcourt une arborescence en profondeur d'abord, dans un ordre stable : les fichiers d'un dossier,
+triés par nom, puis ceux de ses sous-dossiers, triés par nom.
+
+`FileIndex` garde la liste des fichiers (chemin, taille, date de modification) dans `data/tmp/file_index/`. Le
+premier parcours liste les dossiers en parallèle. Les suivants ne relisent que les dossiers dont la date de
+modification a changé (ajout, suppression ou renommage d'un fichier) : un fichier réécrit sur place garde
+l'ancienne taille dans l'index jusqu'à `refresh(full=True)`. Une fois l'index chargé, `index[n]` et
+`index.sample()` ne dépendent pas du nombre de fichiers.
+"""
+import fnmatch
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Union
+
+import numpy as np
+
+from . import pathtools as pth
+from . import serialization
+
+logger = logging.getLogger(__name__)
+
+# Un dossier modifié il y a moins longtemps que ça peut encore changer dans la même unité de temps du système de
+# fichiers : il sera relu au prochain rafraichissement.
+RACY_SECONDS = 2.
+
+
+@dataclass
+class DirectoryRecord:
+    """Contenu d'un dossier, triés par nom."""
+    mtime_ns: Optional[int]
+    subdirs: List[str] = field(default_factory=list)
+    names: List[str] = field(default_factory=list)
+    sizes: List[int] = field(default_factory=list)
+    mtimes: List[float] = field(default_factory=list)
+
+
+def _join(directory: str, name: str) -> str:
+    return f'{directory}/{name}' if directory else name
+
+
+def _scan_directory(path: Union[str, Path], full: bool = True) -> Optional[DirectoryRecord]:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        iterator = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return None
+
+    subdirs, files = [], []
+    with iterator:
+        for entry in iterator:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat() if full else None
+                    files.append((entry.name, stat.st_size if stat else -1, stat.st_mtime if stat else 0.))
+            except OSError:  # supprimé pendant le parcours
+                continue
+    files.sort()
+    if time.time_ns() - mtime_ns < RACY_SECONDS * 1e9:
+        mtime_ns = None
+    return DirectoryRecord(mtime_ns, sorted(subdirs), [name for name, _, _ in files],
+                           [size for _, size, _ in files], [mtime for _, _, mtime in files])
+
+
+def _visit(root: Path, directory: str, previous: Optional[DirectoryRecord]) -> Optional[DirectoryRecord]:
+    path = root / directory
+    if previous is not None and previous.mtime_ns is not None:
+        try:
+            if os.stat(path).st_mtime_ns == previous.mtime_ns:
+                return previous
+        except OSError:
+            return None
+    return _scan_directory(path)
+
+
+def scan_tree(root: Union[str, Path],
+              previous: Optional[Dict[str, DirectoryRecord]] = None,
+              workers: Optional[int] = None,
+              ) -> Dict[str, DirectoryRecord]:
+    """Liste une arborescence, un dossier par tâche, en parallèle. Les appels système de `os.scandir` et `stat`
+    relâchent le GIL : des fils suffisent.
+
+    Args:
+        root (Union[str, Path]): dossier racine
+        previous (Optional[Dict[str, DirectoryRecord]], optional): Résultat d'un parcours précédent. Les dossiers
+                dont la date de modification n'a pas changé ne sont pas relus. Defaults to None.
+        workers (Optional[int], optional): Nombre de fils. Defaults to None (voir ThreadPoolExecutor).
+
+    Returns:
+        Dict[str, DirectoryRecord]: contenu de chaque dossier, par chemin relatif (`''` pour la racine)
+    """
+    root = Path(root)
+    previous = previous or {}
+    records = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_visit, root, '', previous.get('')): ''}
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                directory = pending.pop(future)
+                record = future.result()
+                if record is None:
+                    continue
+                records[directory] = record
+                for name in record.subdirs:
+                    subdirectory = _join(directory, name)
+                    pending[executor.submit(_visit, root, subdirectory, previous.get(subdirectory))] = subdirectory
+    return records
+
+
+def _matcher(pattern: Optional[str] = None,
+             extensions: Optional[Iterable[str]] = None,
+             ):
+    regex = re.compile(fnmatch.translate(pattern)) if pattern is not None else None
+    on_name = pattern is not None and '/' not in pattern
+    suffixes = None if extensions is None else tuple(f'.{e.lstrip(".").lower()}' for e in extensions)
+
+    def matches(relative: str, name: str) -> bool:
+        if suffixes is not None and not name.lower().endswith(suffixes):
+            return False
+        return regex is None or regex.match(name if on_name else relative) is not None
+    return matches
+
+
+def iter_files(root: Union[str, Path],
+               pattern: Optional[str] = None,
+               extensions: Optional[Iterable[str]] = None,
+               min_size: Optional[int] = None,
+               max_size: Optional[int] = None,
+               ) -> Iterator[Path]:
+    """Parcours les fichiers d'une arborescence en profondeur d'abord, sans index. Les fichiers d'un dossier
+    viennent avant ceux de ses sous-dossiers.
+
+    Args:
+        root (Union[str, Path]): dossier racine
+        pattern (Optional[str], optional): Motif `fnmatch`. Sans `/`, appliqué au nom du fichier, sinon au chemin
+                relatif à la racine (`*` y traverse les `/`). Defaults to None.
+        extensions (Optional[Iterable[str]], optional): Extensions acceptées, sans tenir compte de la casse
+                (`['csv', '.zip']`). Defaults to None.
+        min_size (Optional[int], optional): Taille minimale en octets. Defaults to None.
+        max_size (Optional[int], optional): Taille maximale en octets. Defaults to None.
+
+    Yields:
+        Iterator[Path]: un chemin de fichier
+    """
+    root = Path(root)
+    matches = _matcher(pattern, extensions)
+    with_size = min_size is not None or max_size is not None
+    stack = ['']
+    while stack:
+        directory = stack.pop()
+        record = _scan_directory(root / directory, full=with_size)
+        if record is None:
+            continue
+        for name, size in zip(record.names, record.sizes):
+            relative = _join(directory, name)
+            if (min_size is not None and size < min_size) or (max_size is not None and size > max_size):
+                continue
+            if matches(relative, name):
+                yield root / relative
+        stack.extend(_join(directory, name) for name in reversed(record.subdirs))
+
+
+class FileIndex:
+    """
+    Index des fichiers d'une arborescence, enregistré sur disque et rafraichi au fil des appels.
+    ```
+        index = FileIndex(ipe_root, extensions=['zip'], min_size=1024)
+        len(index), index[0], index[-1], index.sample(10, seed=0)
+        index.refresh()  # relis les dossiers modifiés depuis
+    ```
+    Les filtres ne changent pas l'index enregistré : deux FileIndex sur la même racine avec des filtres différents
+    partagent le même fichier.
+    """
+
+    def __init__(self,
+                 root: Union[str, Path],
+                 pattern: Optional[str] = None,
+                 extensions: Optional[Iterable[str]] = None,
+                 min_size: Optional[int] = None,
+                 max_size: Optional[int] = None,
+                 workers: Optional[int] = None,
+                 persist: bool = True,
+                 ):
+        self._root = Path(root)
+        self._matches = _matcher(pattern, extensions)
+        self._min_size = min_size
+        self._max_size = max_size
+        self._workers = workers
+        self._persist = persist
+        self._records: Dict[str, DirectoryRecord] = {}
+        self._paths: List[str] = []
+        self._sizes = np.zeros(0, dtype='int64')
+        self._mtimes = np.zeros(0, dtype='float64')
+
+        if persist and self.cache_path.exists():
+            try:
+                self._records = serialization.load(self.cache_path)
+            except Exception as e:  # Index tronqué, ou d'une version incompatible
+                logger.debug('Could not read the file index %s: %s', self.cache_path, e)
+            self._flatten()
+        self.refresh()
+
+    @property
+    def root(self) -> Path:
+        """Dossier racine."""
+        return self._root
+
+    @property
+    def cache_path(self) -> Path:
+        """Chemin de l'index enregistré."""
+        return pth.tmp_path() / 'file_index' / f'{pth.hash_data(os.path.realpath(self._root))}.pkl'
+
+    def refresh(self, full: bool = False):
+        """Met à jour l'index en relisant les dossiers modifiés.
+
+        Args:
+            full (bool, optional): Relis tous les dossiers, pour voir aussi les fichiers réécrits sur place.
+                    Defaults to False.
+        """
+        start = time.perf_counter()
+        previous = self._records
+        self._records = scan_tree(self._root, previous=None if full else previous, workers=self._workers)
+        # `scan_tree` rend tels quels les dossiers inchangés : rien à réécrire si aucun n'a été relu
+        unchanged = not full and self._records.keys() == previous.keys() and \
+            all(record is previous[directory] for directory, record in self._records.items())
+        if unchanged:
+            return
+        self._flatten()
+        logger.debug('Indexed %s files under %s in %.2fs', len(self._paths), self._root, time.perf_counter() - start)
+        if self._persist:
+            path = self.cache_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            building = path.with_name(f'{path.stem}.{uuid.uuid4().hex}.building')
+            serialization.save(self._records, building, format='pickle')
+            os.replace(building, path)
+
+    def _flatten(self):
+        # Ordre en profondeur d'abord : trier par (dossier découpé, nom) place les fichiers d'un dossier avant
+        # ceux de ses sous-dossiers.
+        paths, sizes, mtimes = [], [], []
+        for directory in sorted(self._records, key=lambda d: d.split('/') if d else []):
+            record = self._records[directory]
+            for name, size, mtime in zip(record.names, record.sizes, record.mtimes):
+                if (self._min_size is not None and size < self._min_size) or \
+                        (self._max_size is not None and size > self._max_size):
+                    continue
+                relative = _join(directory, name)
+                if self._matches(relative, name):
+                    paths.append(relative)
+                    sizes.append(size)
+                    mtimes.append(mtime)
+        self._paths = paths
+        self._sizes = np.array(sizes, dtype='int64')
+        self._mtimes = np.array(mtimes, dtype='float64')
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __getitem__(self, n: int) -> Path:
+        return self._root / self._paths[n]
+
+    def __iter__(self) -> Iterator[Path]:
+        return (self._root / path for path in self._paths)
+
+    def sample(self, k: Optional[int] = None, seed: Optional[int] = None) -> Union[Path, List[Path]]:
+        """Tire des fichiers au hasard, sans remise.
+
+        Args:
+            k (Optional[int], optional): Nombre de fichiers. Defaults to None (un seul fichier, pas une liste).
+            seed (Optional[int], optional): graine aléatoire. Defaults to None.
+
+        Returns:
+            Union[Path, List[Path]]: un fichier, ou k fichiers
+        """
+        if not self._paths:
+            raise IndexError(f'No file under {self._root}')
+        rng = random.Random(seed)
+        if k is None:
+            return self[rng.randrange(len(self._paths))]
+        return [self[i] for i in rng.sample(range(len(self._paths)), k)]
+
+    def size(self, n: int) -> int:
+        """Taille en octets du n-ième fichier."""
+        return int(self._sizes[n])
+
+    def mtime(self, n: int) -> float:
+        """Date de modification du n-ième fichier, en secondes depuis l'epoch."""
+        return float(self._mtimes[n])
+
+    def total_size(self) -> int:
+        """Taille totale des fichiers de l'index, en octets."""
+        return int(self._sizes.sum())
@@ -0,0 +1,304 @@
+"""
+Codes INSEE vectorisés : versions de `misc.insee_department_from_city`, `misc.is_drom` et
+`misc.convert_insee_drom_region_to_department` qui prennent une Series pandas, un tableau Arrow ou un tableau numpy
+de chaines, et rendent le même type. Les calculs sont faits par Arrow, sans boucle Python. Pour un tableau numpy,
+les codes rendus sont un tableau d'objets, où les valeurs nulles restent `None`.
+
+`CommuneLookup` donne le département et la région de millions de codes communes d'un coup, y compris pour les
+codes des communes fusionnées (communes nouvelles) d'anciens millésimes du Code officiel géographique (COG).
+"""
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Régions du COG depuis 2016, et leurs départements
+REGION_DEPARTMENTS = {
+    '01': ['971'], '02': ['972'], '03': ['973'], '04': ['974'], '06': ['976'],
+    '11': ['75', '77', '78', '91', '92', '93', '94', '95'],
+    '24': ['18', '28', '36', '37', '41', '45'],
+    '27': ['21', '25', '39', '58', '70', '71', '89', '90'],
+    '28': ['14', '27', '50', '61', '76'],
+    '32': ['02', '59', '60', '62', '80'],
+    '44': ['08', '10', '51', '52', '54', '55', '57', '67', '68', '88'],
+    '52': ['44', '49', '53', '72', '85'],
+    '53': ['22', '29', '35', '56'],
+    '75': ['16', '17', '19', '23', '24', '33', '40', '47', '64', '79', '86', '87'],
+    '76': ['09', '11', '12', '30', '31', '32', '34', '46', '48', '65', '66', '81', '82'],
+    '84': ['01', '03', '07', '15', '26', '38', '42', '43', '63', '69', '73', '74'],
+    '93': ['04', '05', '06', '13', '83', '84'],
+    '94': ['2A', '2B'],
+    }
+DEPARTMENT_REGION = {department: region for region, departments in REGION_DEPARTMENTS.items()
+                     for department in departments}
+DROM_REGIONS = {'01': '971', '02': '972', '03': '973', '04': '974', '06': '976'}
+OVERSEAS_PREFIXES = ['97', '98']
+
+# Modifications du COG qui font disparaitre un code commune au profit d'un autre : fusions simples, communes
+# nouvelles, fusions-associations, changements de département et de chef-lieu.
+MERGE_MODIFICATIONS = {31, 32, 33, 34, 41, 50}
+
+Codes = Union[pd.Series, pa.Array, pa.ChunkedArray, np.ndarray]
+
+
+def _to_arrow(codes: Codes) -> Tuple[Union[pa.Array, pa.ChunkedArray], Callable[[Any], Codes]]:
+    # Convertis les codes en chaines Arrow, et donne la fonction qui remet un résultat au type d'entrée
+    if isinstance(codes, (pa.Array, pa.ChunkedArray)):
+        array, restore = codes, lambda result: result
+    elif isinstance(codes, pd.Series):
+        array = pa.Array.from_pandas(codes)
+
+        def restore(result):
+            return result.to_pandas().set_axis(codes.index).rename(codes.name)
+    else:
+        array = pa.array(np.asarray(codes))
+
+        def restore(result):
+            # Tableau d'objets : `astype(str)` changerait les nuls en 'None'
+            return result.to_numpy(zero_copy_only=False)
+
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode() if isinstance(array, pa.Array) else \
+            pa.chunked_array([chunk.dictionary_decode() for chunk in array.chunks], type=array.type.value_type)
+    if pa.types.is_large_string(array.type):
+        array = array.cast(pa.string())
+    if not (pa.types.is_string(array.type) or pa.types.is_null(array.type)):
+        # 1001 n'est pas un code commune : il faut '01001', avec le zéro
+        raise TypeError(f'INSEE codes must be strings, got {array.type}')
+    return array.cast(pa.string()), restore
+
+
+def _department(array: Union[pa.Array, pa.ChunkedArray]) -> Union[pa.Array, pa.ChunkedArray]:
+    prefix = pc.utf8_slice_codeunits(array, 0, 2)
+    return pc.if_else(pc.is_in(prefix, value_set=pa.array(OVERSEAS_PREFIXES)),
+                      pc.utf8_slice_codeunits(array, 0, 3), prefix)
+
+
+def department_from_city(insee_cities: Codes) -> Codes:
+    """Version vectorisée de `misc.insee_department_from_city`.
+    ```
+        df['departement'] = department_from_city(df['CodeInseeImmeuble'])
+    ```
+
+    Args:
+        insee_cities (Codes): codes INSEE de communes, en chaines. Les valeurs nulles restent nulles.
+
+    Returns:
+        Codes: codes INSEE des départements, du même type
+    """
+    array, restore = _to_arrow(insee_cities)
+    return restore(_department(array))
+
+
+def is_drom(insee_cities: Optional[Codes] = None, insee_regions: Optional[Codes] = None) -> Codes:
+    """Version vectorisée de `misc.is_drom`. Comme elle, compte aussi les collectivités d'outre-mer (`98...`)
+    pour les codes communes.
+
+    Args:
+        insee_cities (Optional[Codes], optional): codes INSEE de communes. Defaults to None.
+        insee_regions (Optional[Codes], optional): codes INSEE de régions, si les communes ne sont pas données.
+                Defaults to None.
+
+    Returns:
+        Codes: booléens, du même type. Faux pour les valeurs nulles.
+    """
+    if insee_cities is not None:
+        array, restore = _to_arrow(insee_cities)
+        result = pc.is_in(pc.utf8_slice_codeunits(array, 0, 2), value_set=pa.array(OVERSEAS_PREFIXES))
+    elif insee_regions is not None:
+        array, restore = _to_arrow(insee_regions)
+        result = pc.is_in(array, value_set=pa.array(list(DROM_REGIONS)))
+    else:
+        raise ValueError('Provide insee_cities or insee_regions')
+    return restore(result)
+
+
+def convert_drom_region_to_department(insee_regions: Codes) -> Codes:
+    """Version vectorisée de `misc.convert_insee_drom_region_to_department`.
+
+    Args:
+        insee_regions (Codes): codes INSEE de régions d'outre-mer
+
+    Returns:
+        Codes: préfixes des départements, du même type. Nuls pour les régions qui ne sont pas des DROM.
+    """
+    array, restore = _to_arrow(insee_regions)
+    positions = pc.index_in(array, value_set=pa.array(list(DROM_REGIONS)))
+    return restore(pc.take(pa.array(list(DROM_REGIONS.values())), positions))
+
+
+@dataclass
+class CommuneLookup:
+    """
+    Table commune → département → région, rangée dans des tableaux numpy triés : une recherche dichotomique par
+    code, faite pour des millions de codes à la fois.
+    ```
+        lookup = CommuneLookup.from_cog('v_commune_2024.csv', 'v_mvt_commune_2024.csv')
+        df['region'] = lookup.region(df['CodeInseeImmeuble'])
+        for department, rows in lookup.shards(df['CodeInseeImmeuble']).items():
+            process(department, df.iloc[rows])
+    ```
+    Sans fichier du COG (`CommuneLookup()`), le département est déduit du code commune, et la région du
+    département.
+    """
+    communes: np.ndarray = field(default_factory=lambda: np.array([], dtype='U5'))  # codes actuels, triés
+    commune_departments: np.ndarray = field(default_factory=lambda: np.array([], dtype='U3'))
+    merged_from: np.ndarray = field(default_factory=lambda: np.array([], dtype='U5'))  # anciens codes, triés
+    merged_to: np.ndarray = field(default_factory=lambda: np.array([], dtype='U5'))  # code actuel de chacun
+
+    @classmethod
+    def from_cog(cls,
+                 communes_path: Union[str, Path],
+                 movements_path: Optional[Union[str, Path]] = None,
+                 ) -> 'CommuneLookup':
+        """Construit la table à partir des fichiers du COG publiés par l'INSEE.
+
+        Args:
+            communes_path (Union[str, Path]): liste des communes (`v_commune_<année>.csv`, colonnes `TYPECOM`,
+                    `COM`, `DEP`)
+            movements_path (Optional[Union[str, Path]], optional): événements sur les communes
+                    (`v_mvt_commune_<année>.csv`, colonnes `MOD`, `TYPECOM_AV`, `COM_AV`, `TYPECOM_AP`,
+                    `COM_AP`), pour retrouver les communes fusionnées. Defaults to None.
+
+        Returns:
+            CommuneLookup: la table
+        """
+        cog = pd.read_csv(communes_path, dtype=str, usecols=['TYPECOM', 'COM', 'DEP'])
+        cog = cog[cog['TYPECOM'] == 'COM'].sort_values('COM')
+        communes = cog['COM'].to_numpy(dtype='U5')
+
+        merges = {}
+        if movements_path is not None:
+            movements = pd.read_csv(movements_path, dtype=str,
+                                    usecols=['MOD', 'TYPECOM_AV', 'COM_AV', 'TYPECOM_AP', 'COM_AP'])
+            movements = movements[movements['MOD'].astype(int).isin(MERGE_MODIFICATIONS)
+                                  & (movements['TYPECOM_AV'] == 'COM') & (movements['TYPECOM_AP'] == 'COM')
+                                  & (movements['COM_AV'] != movements['COM_AP'])
+                                  & ~movements['COM_AV'].isin(cog['COM'])]
+            merges = dict(zip(movements['COM_AV'], movements['COM_AP']))
+        merges = _resolve_chains(merges)
+
+        merged_from = np.array(sorted(merges), dtype='U5')
+        return cls(communes=communes, commune_departments=cog['DEP'].to_numpy(dtype='U3'),
+                   merged_from=merged_from, merged_to=np.array([merges[code] for code in merged_from], dtype='U5'))
+
+    def resolve(self, insee_cities: Codes) -> np.ndarray:
+        """Remplace les codes des communes fusionnées par celui de la commune actuelle.
+
+        Args:
+            insee_cities (Codes): codes INSEE de communes
+
+        Returns:
+            np.ndarray: codes actuels, en chaines numpy (`''` pour les valeurs nulles)
+        """
+        codes = _as_unicode(insee_cities)
+        if len(self.merged_from):
+            found, positions = _search(self.merged_from, codes)
+            codes = np.where(found, self.merged_to[positions], codes)
+        return codes
+
+    def department(self, insee_cities: Codes) -> np.ndarray:
+        """Département de chaque commune, y compris les communes fusionnées. Les codes inconnus du COG sont
+        rattachés au département de leur préfixe.
+
+        Args:
+            insee_cities (Codes): codes INSEE de communes
+
+        Returns:
+            np.ndarray: codes départements (`''` pour les valeurs nulles)
+        """
+        codes = self.resolve(insee_cities)
+        departments = np.asarray(_department(pa.array(codes)).to_numpy(zero_copy_only=False), dtype='U3')
+        if len(self.communes):
+            found, positions = _search(self.communes, codes)
+            departments = np.where(found, self.commune_departments[positions], departments)
+        return departments
+
+    def region(self, insee_cities: Codes) -> np.ndarray:
+        """Région de chaque commune.
+
+        Args:
+            insee_cities (Codes): codes INSEE de communes
+
+        Returns:
+            np.ndarray: codes régions (`''` pour les communes hors régions : valeurs nulles, collectivités
+                d'outre-mer...)
+        """
+        return department_region(self.department(insee_cities))
+
+    def shards(self, insee_cities: Codes) -> Dict[str, np.ndarray]:
+        """Positions des communes par département, pour découper un traitement (voir `misc.parallel_map`).
+
+        Args:
+            insee_cities (Codes): codes INSEE de communes
+
+        Returns:
+            Dict[str, np.ndarray]: positions, dans l'ordre, par code département
+        """
+        departments, inverse = np.unique(self.department(insee_cities), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(departments) + 1))
+        return {department: order[bounds[i]:bounds[i + 1]] for i, department in enumerate(departments)}
+
+    def to_frame(self) -> pd.DataFrame:
+        """Table des communes actuelles et des anciens codes, pour une jointure.
+
+        Returns:
+            pd.DataFrame: colonnes `commune` (code, actuel ou ancien), `commune_actuelle`, `departement`, `region`
+        """
+        codes = np.concatenate([self.communes, self.merged_from])
+        current = self.resolve(codes)
+        departments = self.department(current)
+        return pd.DataFrame({'commune': codes, 'commune_actuelle': current, 'departement': departments,
+                             'region': department_region(departments)})
+
+
+def department_region(departments: Codes) -> np.ndarray:
+    """Région de chaque département.
+
+    Args:
+        departments (Codes): codes départements
+
+    Returns:
+        np.ndarray: codes régions (`''` pour les départements inconnus)
+    """
+    keys = np.array(sorted(DEPARTMENT_REGION), dtype='U3')
+    values = np.array([DEPARTMENT_REGION[key] for key in keys], dtype='U2')
+    found, positions = _search(keys, _as_unicode(departments))
+    return np.where(found, values[positions], '')
+
+
+def _as_unicode(codes: Codes) -> np.ndarray:
+    if isinstance(codes, (pa.Array, pa.ChunkedArray)):
+        codes = codes.to_numpy(zero_copy_only=False)
+    values = np.asarray(codes, dtype=object) if isinstance(codes, pd.Series) else np.asarray(codes)
+    if values.dtype == object:
+        values = np.where(pd.isna(values), '', values)
+    return values.astype(str)
+
+
+def _search(keys: np.ndarray, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    positions = np.clip(np.searchsorted(keys, codes), 0, len(keys) - 1)
+    return keys[positions] == codes, positions
+
+
+def _resolve_chains(merges: Dict[str, str]) -> Dict[str, str]:
+    # A fusionnée dans B, puis B dans C : A donne C. Borné, au cas où le fichier contiendrait un cycle.
+    resolved = {}
+    for code, target in merges.items():
+        seen = {code}
+        while target in merges and target not in seen:
+            seen.add(target)
+            target = merges[target]
+        resolved[code] = target
+    return resolved
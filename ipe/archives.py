@@ -0,0 +1,251 @@
+"""
+Lecture de plusieurs archives IPE à la fois, y compris des archives contenues dans d'autres archives.
+
+Les opérateurs livrent souvent plusieurs archives, parfois des zip dans des zip. Les archives imbriquées sont
+extraites une fois dans le dossier tmp (par CRC), puis traitées comme les autres. Les fichiers IPE sont choisis par
+motif (`fnmatch`) sur leur chemin dans l'archive, plutôt que par un préfixe fixe comme `IPE_t1_2021/`.
+
+Un même immeuble livré deux fois n'est gardé qu'une fois : par défaut, celui du fichier le plus récent d'après le
+suffixe `_AAAAMMJJ` de son nom.
+"""
+import fnmatch
+import glob
+import logging
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import pandas as pd
+import pyarrow as pa
+
+from .. import misc
+from .. import pathtools as pth
+from .encoding import load_encoding_cache
+from .encoding import member_key
+from .encoding import save_encoding_cache
+from .index import build_index
+from .rwp import _read_member
+from .rwp import _read_member_as_arrow
+from .rwp import _type_df
+from .schema import concat_typed
+
+logger = logging.getLogger(__name__)
+
+KEEP_RULES = ('latest', 'earliest')
+_DATE = re.compile(r'_(\d{8})(?:_|$)')
+_DATE_COLUMN = '_date'
+_ORDER_COLUMN = '_order'
+
+
+@dataclass
+class MemberRef:
+    """
+    Fichier IPE d'une archive. `archive` est le chemin d'une archive sur disque, éventuellement extraite d'une
+    autre archive (`parents` donne alors le chemin d'origine).
+    """
+    archive: Path
+    name: str
+    date: Optional[pd.Timestamp] = None
+    parents: Tuple[str, ...] = ()
+
+
+def member_date(name: str) -> Optional[pd.Timestamp]:
+    """Date de livraison lue dans le nom du fichier (dernier suffixe `_AAAAMMJJ`).
+
+    Args:
+        name (str): nom du fichier
+
+    Returns:
+        Optional[pd.Timestamp]: la date, ou None si le nom n'en contient pas
+    """
+    dates = _DATE.findall(Path(name).stem)
+    if not dates:
+        return None
+    date = pd.to_datetime(dates[-1], format='%Y%m%d', errors='coerce')
+    return None if pd.isna(date) else date
+
+
+def _expand_paths(archives: Union[str, Path, Iterable[Union[str, Path]]]) -> List[Path]:
+    if isinstance(archives, (str, Path)):
+        archives = [archives]
+    paths = []
+    for archive in archives:
+        matches = sorted(glob.glob(str(archive))) if glob.has_magic(str(archive)) else [archive]
+        paths.extend(Path(match) for match in matches)
+    return paths
+
+
+def _extract_nested(z: zipfile.ZipFile, name: str) -> Path:
+    info = z.getinfo(name)
+    folder = pth.tmp_path() / 'ipe_nested'
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f'{Path(name).stem}_{info.CRC:08x}.zip'
+    if not path.exists():
+        building = path.with_suffix('.building')
+        with z.open(info, 'r') as source, open(building, 'wb') as target:
+            while True:
+                block = source.read(1 << 20)
+                if not block:
+                    break
+                target.write(block)
+        building.replace(path)
+    return path
+
+
+def flatten_archives(archives: Union[str, Path, Iterable[Union[str, Path]]]
+                     ) -> List[Tuple[Path, Tuple[str, ...]]]:
+    """Liste les archives à lire, en extrayant les archives imbriquées.
+
+    Args:
+        archives (Union[str, Path, Iterable[Union[str, Path]]]): chemins ou motifs `glob` d'archives
+
+    Returns:
+        List[Tuple[Path, Tuple[str, ...]]]: `(chemin sur disque, chemins d'origine)` pour chaque archive,
+                imbriquée ou non
+    """
+    flat = []
+    pending = [(path, ()) for path in _expand_paths(archives)]
+    while pending:
+        path, parents = pending.pop(0)
+        flat.append((path, parents))
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name.lower().endswith('.zip'):
+                    pending.append((_extract_nested(z, name), parents + (f'{path}:{name}',)))
+    return flat
+
+
+def resolve_members(archives: Union[str, Path, Iterable[Union[str, Path]]],
+                    patterns: Union[str, List[str]] = '*.csv') -> List[MemberRef]:
+    """Fichiers IPE des archives dont le chemin correspond à l'un des motifs.
+
+    Args:
+        archives (Union[str, Path, Iterable[Union[str, Path]]]): chemins ou motifs `glob` d'archives
+        patterns (Union[str, List[str]], optional): motifs `fnmatch` sur le chemin dans l'archive.
+                Defaults to '*.csv'.
+
+    Returns:
+        List[MemberRef]: les fichiers, dans l'ordre des archives
+    """
+    patterns = [patterns] if isinstance(patterns, str) else patterns
+    members = []
+    for path, parents in flatten_archives(archives):
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name[-3:] == 'csv' and any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                    members.append(MemberRef(archive=path, name=name, date=member_date(name), parents=parents))
+    return members
+
+
+def _deduplicate(df: pd.DataFrame, key: str, keep: str) -> pd.DataFrame:
+    # Les fichiers sans date dans leur nom ne gagnent jamais face à un fichier daté
+    df = df.sort_values([_DATE_COLUMN, _ORDER_COLUMN], kind='stable',
+                        na_position='first' if keep == 'latest' else 'last')
+    duplicated = df[key].notna() & df.duplicated(subset=key, keep='last' if keep == 'latest' else 'first')
+    if duplicated.any():
+        logger.info('Dropping %s buildings delivered more than once', duplicated.sum())
+    return df[~duplicated].sort_values(_ORDER_COLUMN, kind='stable')
+
+
+def read_ipe_archives(archives: Union[str, Path, Iterable[Union[str, Path]]],
+                      columns: List[str],
+                      patterns: Union[str, List[str]] = '*.csv',
+                      numeric_cols: Optional[List[str]] = None,
+                      cols_are_optional: bool = True,
+                      workers: Optional[int] = None,
+                      key: str = 'IdentifiantImmeuble',
+                      keep: Optional[str] = 'latest',
+                      typed: bool = True,
+                      ) -> pd.DataFrame:
+    """Lis les fichiers IPE de plusieurs archives, éventuellement imbriquées, et dédoublonne les immeubles.
+    ```
+        df = read_ipe_archives(['livraisons/*.zip'], columns, patterns='*/IPE_*_V30_*.csv', workers=4)
+    ```
+
+    Args:
+        archives (Union[str, Path, Iterable[Union[str, Path]]]): chemins ou motifs `glob` d'archives
+        columns (List[str]): Colonnes à extraire
+        patterns (Union[str, List[str]], optional): motifs `fnmatch` des fichiers à lire dans les archives.
+                Defaults to '*.csv'.
+        numeric_cols (Optional[List[str]], optional): Colonnes numériques hors du registre des schémas.
+                Defaults to None.
+        cols_are_optional (bool, optional): Si faux, ignore les fichiers où il manque des colonnes.
+                Defaults to True.
+        workers (Optional[int], optional): Nombre de processus de lecture. Defaults to None (lecture dans le
+                processus courant).
+        key (str, optional): Colonne identifiant un immeuble. Defaults to 'IdentifiantImmeuble'.
+        keep (Optional[str], optional): Immeuble gardé s'il est livré plusieurs fois : `latest` (fichier le plus
+                récent d'après son nom, puis dernière archive), `earliest`, ou None pour tout garder. Un fichier
+                sans date dans son nom n'est gardé que si aucun fichier daté ne livre l'immeuble.
+                Defaults to 'latest'.
+        typed (bool, optional): Type les colonnes standard selon le registre des schémas. Defaults to True.
+
+    Returns:
+        pd.DataFrame: les colonnes demandées, de tous les fichiers retenus
+    """
+    if keep is not None and keep not in KEEP_RULES:
+        raise ValueError(f'Unknown keep rule {keep}. Expected one of {KEEP_RULES} or None')
+    read_cols = columns if keep is None or key in columns else columns + [key]
+
+    # Un index par archive, construit (ou relu) une seule fois pour tous ses fichiers
+    candidates = resolve_members(archives, patterns)
+    indexes = {archive: build_index(archive) for archive in dict.fromkeys(member.archive for member in candidates)}
+    members = []
+    seps = {}
+    for member in candidates:
+        header = indexes[member.archive].members[member.name]
+        if any(column in header.columns for column in read_cols) and \
+                (cols_are_optional or all(column in header.columns for column in columns)):
+            members.append(member)
+            seps[(member.archive, member.name)] = header.separator
+    logger.info('Reading %s IPE files', len(members))
+
+    encodings = load_encoding_cache()
+    keys = {}
+    for archive in dict.fromkeys(member.archive for member in members):
+        with zipfile.ZipFile(archive) as z:
+            for member in members:
+                if member.archive == archive:
+                    keys[(archive, member.name)] = member_key(z.getinfo(member.name))
+
+    dfs = {}
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_read_member_as_arrow, member.archive, member.name, read_cols, None,
+                                       encodings.get(keys[(member.archive, member.name)]),
+                                       seps[(member.archive, member.name)], 'pandas', None, typed): i
+                       for i, member in enumerate(members)}
+            for future in misc.make_iterator(as_completed(futures), low_bound=1, size=len(futures),
+                                             desc='Reading IPE'):
+                i = futures[future]
+                _, buffer, encoding = future.result()
+                encodings[keys[(members[i].archive, members[i].name)]] = encoding
+                dfs[i] = pa.ipc.open_stream(buffer).read_all().to_pandas()
+    else:
+        for i, member in enumerate(misc.make_iterator(members, low_bound=1, desc='Reading IPE')):
+            dfs[i], encoding = _read_member(member.archive, member.name, read_cols,
+                                            encoding=encodings.get(keys[(member.archive, member.name)]),
+                                            sep=seps[(member.archive, member.name)], typed=typed)
+            encodings[keys[(member.archive, member.name)]] = encoding
+    save_encoding_cache(encodings)
+
+    if not dfs:
+        return pd.DataFrame(columns=columns)
+    for i, member in enumerate(members):
+        dfs[i][_DATE_COLUMN] = member.date if member.date is not None else pd.NaT
+        dfs[i][_ORDER_COLUMN] = i
+    frames = [dfs[i] for i in range(len(members))]
+    df_full = concat_typed(frames) if typed else pd.concat(frames, ignore_index=True)
+
+    if keep is not None:
+        df_full = _deduplicate(df_full, key, keep)
+    _type_df(df_full, numeric_cols=numeric_cols)
+    return df_full.reindex(columns=columns).reset_index(drop=True)
@@ -0,0 +1,232 @@
+"""
+Différence entre deux archives IPE (un trimestre et le suivant), par immeuble.
+
+Les deux archives sont parcourues par morceaux. Chaque ligne est hachée, puis rangée sur disque dans une
+partition choisie par le hachage de sa clef. Les partitions sont ensuite comparées une à une : la mémoire
+nécessaire est celle d'une partition des deux archives, pas celle des archives entières.
+
+Les fichiers identiques dans les deux archives (même CRC et même taille, quel que soit leur nom) ne sont pas lus.
+On suppose qu'une clef n'apparait que dans un seul fichier d'une archive.
+"""
+import logging
+import tempfile
+import zipfile
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from .. import pathtools as pth
+from .index import build_index
+from .rwp import CHUNKSIZE
+from .rwp import iter_ipe
+
+logger = logging.getLogger(__name__)
+
+ROW_HASH = '_row_hash'
+PARTITIONS = 64
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+CHANGED_COLUMNS = 'changed_columns'
+
+
+@dataclass
+class IpeDiff:
+    """
+    Différence entre deux archives IPE.
+    `added` et `removed` ont la clef et les colonnes comparées. `changed` a la clef, la liste des colonnes
+    modifiées (`changed_columns`), et pour chaque colonne comparée sa valeur avant (`<colonne>_old`) et après
+    (`<colonne>_new`).
+    """
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    changed: pd.DataFrame
+    skipped_members: int = 0
+
+
+def unchanged_members(old_zip: Union[str, Path], new_zip: Union[str, Path]) -> Tuple[List[str], List[str]]:
+    """Fichiers présents à l'identique (même CRC et même taille) dans les deux archives.
+
+    Args:
+        old_zip (Union[str, Path]): archive de référence
+        new_zip (Union[str, Path]): nouvelle archive
+
+    Returns:
+        Tuple[List[str], List[str]]: les noms de ces fichiers dans l'ancienne et dans la nouvelle archive
+    """
+    with zipfile.ZipFile(old_zip) as z:
+        old = {name: (z.getinfo(name).CRC, z.getinfo(name).file_size) for name in z.namelist() if name[-3:] == 'csv'}
+    with zipfile.ZipFile(new_zip) as z:
+        new = {name: (z.getinfo(name).CRC, z.getinfo(name).file_size) for name in z.namelist() if name[-3:] == 'csv'}
+
+    common = Counter(old.values()) & Counter(new.values())
+    old_kept, new_kept = Counter(common), Counter(common)
+    old_names, new_names = [], []
+    for names, signatures, kept in ((old_names, old, old_kept), (new_names, new, new_kept)):
+        for name, signature in signatures.items():
+            if kept[signature] > 0:
+                kept[signature] -= 1
+                names.append(name)
+    return old_names, new_names
+
+
+def _key_partition(keys: pd.Series, partitions: int) -> np.ndarray:
+    return (pd.util.hash_pandas_object(keys, index=False).to_numpy() % np.uint64(partitions)).astype(np.int64)
+
+
+def _spill(ipe_zip_path: Union[str, Path], folder: Path, key: str, columns: List[str], partitions: int,
+           skip: List[str], chunksize: int):
+    # Range les lignes de l'archive dans `folder/<partition>/<n>.fthr`, avec le hachage de chaque ligne
+    index = build_index(ipe_zip_path)
+    members = [name for name in index.members if name not in skip]
+    n = 0
+    for _, chunk in iter_ipe(ipe_zip_path, columns=[key] + columns, chunksize=chunksize, typed=False,
+                             members=members):
+        chunk = chunk[chunk[key].notna()]
+        chunk[ROW_HASH] = pd.util.hash_pandas_object(chunk[columns], index=False).to_numpy()
+        for partition, part in chunk.groupby(_key_partition(chunk[key], partitions), sort=False):
+            (folder / f'{partition:03d}').mkdir(parents=True, exist_ok=True)
+            feather.write_feather(pa.Table.from_pandas(part, preserve_index=False),
+                                  str(folder / f'{partition:03d}' / f'{n}.fthr'))
+            n += 1
+
+
+def _load_partition(folder: Path, key: str, columns: List[str]) -> pd.DataFrame:
+    files = sorted(folder.glob('*.fthr'), key=lambda file: int(file.stem))
+    if not files:
+        return pd.DataFrame(columns=[key] + columns + [ROW_HASH])
+    df = pd.concat([feather.read_feather(str(file)) for file in files], ignore_index=True)
+    duplicated = df[key].duplicated(keep='last')
+    if duplicated.any():
+        logger.debug('%s duplicated keys in %s. Keeping the last one.', duplicated.sum(), folder)
+    return df[~duplicated]
+
+
+def _compare_partition(old: pd.DataFrame, new: pd.DataFrame, key: str,
+                       columns: List[str]) -> Dict[str, pd.DataFrame]:
+    merged = old.merge(new, on=key, how='outer', suffixes=('_old', '_new'), indicator=True)
+    added = merged[merged['_merge'] == 'right_only']
+    removed = merged[merged['_merge'] == 'left_only']
+    both = merged[(merged['_merge'] == 'both') & (merged[f'{ROW_HASH}_old'] != merged[f'{ROW_HASH}_new'])]
+
+    old_values = both[[f'{column}_old' for column in columns]].to_numpy()
+    new_values = both[[f'{column}_new' for column in columns]].to_numpy()
+    differs = ~((old_values == new_values) | (pd.isna(old_values) & pd.isna(new_values)))
+    names = np.array(columns, dtype=object)
+    changed = both[[key]].copy()
+    changed[CHANGED_COLUMNS] = [list(names[row]) for row in differs]
+    for column in columns:
+        changed[f'{column}_old'] = both[f'{column}_old']
+        changed[f'{column}_new'] = both[f'{column}_new']
+
+    def _side(df: pd.DataFrame, suffix: str) -> pd.DataFrame:
+        return df[[key] + [f'{column}{suffix}' for column in columns]].set_axis([key] + columns, axis=1)
+
+    return {ADDED: _side(added, '_new'), REMOVED: _side(removed, '_old'), CHANGED: changed}
+
+
+def iter_diff_ipe(old_zip: Union[str, Path],
+                  new_zip: Union[str, Path],
+                  key: str = 'IdentifiantImmeuble',
+                  columns: Optional[List[str]] = None,
+                  partitions: int = PARTITIONS,
+                  chunksize: int = CHUNKSIZE,
+                  workdir: Optional[Union[str, Path]] = None,
+                  ) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """Compare deux archives IPE partition par partition, en mémoire bornée.
+
+    Args:
+        old_zip (Union[str, Path]): archive de référence
+        new_zip (Union[str, Path]): nouvelle archive
+        key (str, optional): Colonne identifiant un immeuble. Defaults to 'IdentifiantImmeuble'.
+        columns (Optional[List[str]], optional): Colonnes comparées. Defaults to None (toutes les colonnes des
+                deux archives).
+        partitions (int, optional): Nombre de partitions sur disque. Defaults to 64.
+        chunksize (int, optional): Nombre de lignes lues à la fois. Defaults to CHUNKSIZE.
+        workdir (Optional[Union[str, Path]], optional): Dossier des partitions. Defaults to None (dossier
+                temporaire dans le dossier tmp, supprimé à la fin).
+
+    Yields:
+        Tuple[str, pd.DataFrame]: `added`, `removed` ou `changed`, et les lignes correspondantes d'une partition
+    """
+    yield from _iter_diff(old_zip, new_zip, key, columns, partitions, chunksize, workdir,
+                          unchanged_members(old_zip, new_zip))
+
+
+def _iter_diff(old_zip: Union[str, Path], new_zip: Union[str, Path], key: str, columns: Optional[List[str]],
+               partitions: int, chunksize: int, workdir: Optional[Union[str, Path]],
+               unchanged: Tuple[List[str], List[str]]) -> Iterator[Tuple[str, pd.DataFrame]]:
+    if columns is None:
+        seen = {}
+        for path in (old_zip, new_zip):
+            for header in build_index(path).members.values():
+                seen.update(dict.fromkeys(header.columns))
+        columns = list(seen)
+    columns = [column for column in columns if column != key]
+
+    skip_old, skip_new = unchanged
+    logger.info('Skipping %s files identical in both archives', len(skip_old))
+
+    with tempfile.TemporaryDirectory(prefix='ipe_diff_', dir=workdir or pth.tmp_path()) as folder:
+        folder = Path(folder)
+        _spill(old_zip, folder / 'old', key, columns, partitions, skip_old, chunksize)
+        _spill(new_zip, folder / 'new', key, columns, partitions, skip_new, chunksize)
+
+        for partition in range(partitions):
+            old = _load_partition(folder / 'old' / f'{partition:03d}', key, columns)
+            new = _load_partition(folder / 'new' / f'{partition:03d}', key, columns)
+            if old.empty and new.empty:
+                continue
+            for kind, df in _compare_partition(old, new, key, columns).items():
+                if not df.empty:
+                    yield kind, df
+
+
+def diff_ipe(old_zip: Union[str, Path],
+             new_zip: Union[str, Path],
+             key: str = 'IdentifiantImmeuble',
+             columns: Optional[List[str]] = None,
+             partitions: int = PARTITIONS,
+             chunksize: int = CHUNKSIZE,
+             workdir: Optional[Union[str, Path]] = None,
+             ) -> IpeDiff:
+    """Immeubles ajoutés, supprimés et modifiés entre deux archives IPE. Voir `iter_diff_ipe` pour ne pas garder
+    toute la différence en mémoire.
+    ```
+        diff = diff_ipe('IPE_t1_2021.zip', 'IPE_t2_2021.zip', columns=['EtatImmeuble', 'CodeAdresseImmeuble'])
+        diff.changed[diff.changed['changed_columns'].map(lambda c: 'EtatImmeuble' in c)]
+    ```
+
+    Args:
+        old_zip (Union[str, Path]): archive de référence
+        new_zip (Union[str, Path]): nouvelle archive
+        key (str, optional): Colonne identifiant un immeuble. Defaults to 'IdentifiantImmeuble'.
+        columns (Optional[List[str]], optional): Colonnes comparées. Defaults to None (toutes).
+        partitions (int, optional): Nombre de partitions sur disque. Defaults to 64.
+        chunksize (int, optional): Nombre de lignes lues à la fois. Defaults to CHUNKSIZE.
+        workdir (Optional[Union[str, Path]], optional): Dossier des partitions. Defaults to None.
+
+    Returns:
+        IpeDiff: la différence
+    """
+    unchanged = unchanged_members(old_zip, new_zip)
+    parts: Dict[str, List[pd.DataFrame]] = {ADDED: [], REMOVED: [], CHANGED: []}
+    for kind, df in _iter_diff(old_zip, new_zip, key, columns, partitions, chunksize, workdir, unchanged):
+        parts[kind].append(df)
+
+    def _concat(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=[key])
+
+    return IpeDiff(added=_concat(parts[ADDED]), removed=_concat(parts[REMOVED]), changed=_concat(parts[CHANGED]),
+                   skipped_members=len(unchanged[0]))
@@ -0,0 +1,205 @@
+"""
+Détection de l'encodage des fichiers IPE, en une seule lecture des octets bruts.
+
+Les IPE sont en UTF-8, Windows-1252 ou Latin-1. Plutôt que d'essayer de lire tout le CSV avec chaque encodage,
+on parcourt une fois les octets :
+- Une BOM désigne directement l'encodage ;
+- Sinon, le flux est validé en UTF-8 par morceaux ;
+- En parallèle, on cherche les octets non définis en Windows-1252 (0x81, 0x8D, 0x8F, 0x90, 0x9D).
+Le résultat est le même que l'ancien essai successif UTF-8, Windows-1252 puis Latin-1.
+
+La décision est mise en cache par membre d'archive (nom et CRC).
+"""
+import codecs
+import logging
+import re
+import zipfile
+from pathlib import Path
+from typing import Dict
+from typing import IO
+from typing import Optional
+from typing import Tuple
+
+from .. import misc
+from .. import pathtools as pth
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ('UTF-8', 'Windows-1252', 'Latin-1')
+BOMS = (
+    (codecs.BOM_UTF8, 'UTF-8-SIG'),
+    (codecs.BOM_UTF16_LE, 'UTF-16'),
+    (codecs.BOM_UTF16_BE, 'UTF-16'),
+    )
+CHUNKSIZE = 1 << 20
+_CP1252_UNDEFINED = re.compile(b'[\x81\x8d\x8f\x90\x9d]')
+
+
+class IpeDecodeError(ValueError):
+    """
+    Erreur: un fichier IPE n'a pas pu être décodé avec l'encodage détecté.
+    """
+
+    def __init__(self,
+                 message: str,
+                 member: Optional[str],
+                 encoding: str,
+                 offset: Optional[int],
+                 ):
+        super().__init__(message)
+
+        self.member = member
+        self.encoding = encoding
+        self.offset = offset
+
+
+def detect_encoding(filelike: IO[bytes], chunksize: int = CHUNKSIZE) -> Tuple[str, Optional[int]]:
+    """Détecte l'encodage d'un fichier en lisant une seule fois ses octets. Rembobine le fichier.
+
+    Args:
+        filelike (IO[bytes]): fichier ouvert en binaire, au début
+        chunksize (int, optional): Taille des morceaux lus. Defaults to 1 Mo.
+
+    Returns:
+        Tuple[str, Optional[int]]: L'encodage et la position du premier octet invalide en UTF-8, s'il y en a un.
+    """
+    head = filelike.read(chunksize)
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            filelike.seek(0)
+            return encoding, None
+
+    decoder = codecs.getincrementaldecoder('UTF-8')()
+    utf8_error: Optional[int] = None
+    cp1252_ok = True
+    position = 0
+    chunk = head
+    while chunk:
+        if utf8_error is None:
+            pending = len(decoder.getstate()[0])
+            try:
+                decoder.decode(chunk, final=False)
+            except UnicodeDecodeError as e:
+                utf8_error = position - pending + e.start
+        if cp1252_ok and _CP1252_UNDEFINED.search(chunk):
+            cp1252_ok = False
+        if utf8_error is not None and not cp1252_ok:
+            break
+        position += len(chunk)
+        chunk = filelike.read(chunksize)
+
+    if utf8_error is None:
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            utf8_error = position - len(decoder.getstate()[0])
+    filelike.seek(0)
+
+    if utf8_error is None:
+        return 'UTF-8', None
+    return ('Windows-1252' if cp1252_ok else 'Latin-1'), utf8_error
+
+
+def decode_error_offset(filelike: IO[bytes], encoding: str, chunksize: int = CHUNKSIZE) -> Optional[int]:
+    """Position dans le fichier du premier octet que `encoding` ne sait pas décoder. Rembobine le fichier.
+
+    Args:
+        filelike (IO[bytes]): fichier ouvert en binaire, où l'on peut revenir au début
+        encoding (str): encodage utilisé pour la lecture
+        chunksize (int, optional): Taille des morceaux lus. Defaults to 1 Mo.
+
+    Returns:
+        Optional[int]: la position, ou None si tout le fichier se décode
+    """
+    filelike.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    position = 0
+    offset = None
+    chunk = filelike.read(chunksize)
+    while chunk:
+        pending = len(decoder.getstate()[0])
+        try:
+            decoder.decode(chunk, final=False)
+        except UnicodeDecodeError as e:
+            offset = position - pending + e.start
+            break
+        position += len(chunk)
+        chunk = filelike.read(chunksize)
+    if offset is None:
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            offset = position - len(decoder.getstate()[0])
+    filelike.seek(0)
+    return offset
+
+
+def _cache_path() -> Path:
+    return pth.tmp_path() / 'ipe_encodings.pkl'
+
+
+def load_encoding_cache() -> Dict[str, str]:
+    """Charge le cache des encodages détectés, indexé par `<nom du membre>:<CRC>`.
+
+    Returns:
+        Dict[str, str]: encodage par membre d'archive
+    """
+    path = _cache_path()
+    if not path.exists():
+        return {}
+    try:
+        return misc.load(filepath=path)
+    except (EOFError, OSError, ValueError):
+        logger.debug('Could not read the encoding cache %s. Starting anew.', path)
+        return {}
+
+
+def save_encoding_cache(cache: Dict[str, str]):
+    """Enregistre le cache des encodages détectés, en complétant celui sur disque.
+
+    Args:
+        cache (Dict[str, str]): encodage par membre d'archive
+    """
+    merged = {**load_encoding_cache(), **cache}
+    path = _cache_path()
+    building = path.with_suffix('.building')
+    misc.save(data=merged, filepath=building)
+    building.replace(path)
+
+
+def member_key(info: zipfile.ZipInfo) -> str:
+    """Clef d'un membre d'archive : son nom et son CRC.
+
+    Args:
+        info (zipfile.ZipInfo): membre d'archive
+
+    Returns:
+        str: la clef
+    """
+    return f'{info.filename}:{info.CRC:08x}'
+
+
+def member_encoding(z: zipfile.ZipFile, name: str, cache: Optional[Dict[str, str]] = None) -> str:
+    """Encodage d'un membre d'archive, lu dans le cache ou détecté.
+
+    Args:
+        z (zipfile.ZipFile): archive ouverte
+        name (str): nom du membre
+        cache (Optional[Dict[str, str]], optional): cache des encodages, complété en place. Defaults to None.
+
+    Returns:
+        str: l'encodage
+    """
+    info = z.getinfo(name)
+    key = member_key(info)
+    if cache is not None and key in cache:
+        return cache[key]
+
+    with z.open(info, 'r') as f:
+        encoding, offset = detect_encoding(f)
+    if offset is not None:
+        logger.info('%s is not valid UTF-8 from byte %s on. Reading it as %s.', name, offset, encoding)
+
+    if cache is not None:
+        cache[key] = encoding
+    return encoding
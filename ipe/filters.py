@@ -0,0 +1,237 @@
+"""
+Filtres appliqués pendant la lecture des IPE.
+
+Un filtre est un triplet `(colonne, opérateur, valeur)`, comme pour `pd.read_parquet` :
+```
+    filters = [('CodeInseeImmeuble', 'startswith', '71'), ('EtatImmeuble', 'in', ['DEPLOYE', 'RACCORDABLE'])]
+```
+Les filtres sont combinés par un ET. Opérateurs : `==`, `!=`, `in`, `not in` et `startswith` (un préfixe ou une
+liste de préfixes). Une valeur manquante ne passe jamais `==`, `in` ou `startswith`, et passe toujours `!=` et
+`not in`.
+
+Sur les colonnes typées du registre (nombres, dates, voir `ipe.schema`), la colonne et la valeur du filtre sont
+converties au type du registre avant d'être comparées, quel que soit le moteur : `('NombreLogementsAdresseIPE',
+'==', 3)`, `'3'` ou `'3.0'` retiennent les mêmes lignes. `startswith` n'y est pas accepté.
+
+La pseudo-colonne `operateur` porte sur le code opérateur lu dans le nom du fichier. Elle permet, comme les
+colonnes absentes de l'en-tête d'un fichier, d'écarter des fichiers entiers sans les lire. La pseudo-colonne
+`departement` n'existe que dans le jeu de données ingéré (voir `ipe.store`) : elle est refusée à la lecture de
+l'archive.
+"""
+from typing import Any
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pa_ds
+
+from .index import MemberHeader
+from .index import member_operator
+from .schema import DATE
+from .schema import FLOAT
+from .schema import INTEGER
+from .schema import apply_schema
+from .schema import column_types
+
+Filter = Tuple[str, str, Any]
+
+OPERATORS = ('==', '!=', 'in', 'not in', 'startswith')
+OPERATOR_COLUMN = 'operateur'
+DEPARTMENT_COLUMN = 'departement'
+EXCLUSIVE_OPERATORS = ('!=', 'not in')
+
+
+def check_filters(filters: Optional[Iterable[Filter]], store: bool = False) -> List[Filter]:
+    """Valide les filtres, et normalise les valeurs des listes.
+
+    Args:
+        filters (Optional[Iterable[Filter]]): filtres `(colonne, opérateur, valeur)`
+        store (bool, optional): Filtres appliqués au jeu de données ingéré, qui accepte la pseudo-colonne
+                `departement`. Defaults to False (lecture de l'archive).
+
+    Raises:
+        ValueError: si un opérateur est inconnu, si `startswith` porte sur une colonne typée, ou si
+                `departement` est filtré hors du jeu de données ingéré
+
+    Returns:
+        List[Filter]: les filtres, vide si `filters` vaut None
+    """
+    checked = []
+    for column, op, value in (filters or []):
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown filter operator {op}. Expected one of {OPERATORS}')
+        if op == 'startswith' and _is_typed(column):
+            raise ValueError(f'`startswith` cannot filter the typed column {column}')
+        if column == DEPARTMENT_COLUMN and not store:
+            raise ValueError(f'`{DEPARTMENT_COLUMN}` can only filter an ingested archive, see `ipe.store.ingest_ipe`')
+        if op in ('in', 'not in') or (op == 'startswith' and not isinstance(value, str)):
+            value = list(value)
+        checked.append((column, op, value))
+    return checked
+
+
+def filter_columns(filters: List[Filter]) -> List[str]:
+    """Colonnes à lire pour appliquer les filtres (hors pseudo-colonne `operateur`).
+
+    Args:
+        filters (List[Filter]): filtres validés
+
+    Returns:
+        List[str]: les colonnes, sans doublon
+    """
+    columns = []
+    for column, _, _ in filters:
+        if column != OPERATOR_COLUMN and column not in columns:
+            columns.append(column)
+    return columns
+
+
+def _is_typed(column: str) -> bool:
+    return column_types().get(column) in (INTEGER, FLOAT, DATE)
+
+
+def _to_registry_type(column: str, values: pd.Series) -> pd.Series:
+    # Une colonne déjà typée est rendue telle quelle par `apply_schema`
+    return apply_schema(pd.DataFrame({column: values}))[column]
+
+
+def _typed_value(column: str, op: str, value: Any) -> Any:
+    values = [value] if op in ('==', '!=') else value
+    raw = pd.Series([None if pd.isna(v) else str(v) for v in values], dtype=object)
+    converted = _to_registry_type(column, raw).tolist()
+    return converted[0] if op in ('==', '!=') else converted
+
+
+def _matches(values: pd.Series, op: str, value: Any, column: Optional[str] = None) -> pd.Series:
+    if column is not None and _is_typed(column):
+        values = _to_registry_type(column, values)
+        value = _typed_value(column, op, value)
+    if op == '==':
+        return (values == value).fillna(False).astype(bool)
+    if op == '!=':
+        return (values != value).fillna(True).astype(bool)
+    if op == 'in':
+        return values.isin(value)
+    if op == 'not in':
+        return ~values.isin(value)
+    prefixes = value if isinstance(value, str) else tuple(value)
+    return values.astype(object).str.startswith(prefixes).fillna(False).astype(bool)
+
+
+def member_can_match(header: MemberHeader, filters: List[Filter]) -> bool:
+    """Faux si le nom ou l'en-tête du fichier suffit à savoir qu'aucune ligne ne passe les filtres.
+
+    Args:
+        header (MemberHeader): en-tête du fichier, voir `ipe.index`
+        filters (List[Filter]): filtres validés
+
+    Returns:
+        bool: Vrai si le fichier doit être lu
+    """
+    for column, op, value in filters:
+        if column == OPERATOR_COLUMN:
+            if not _matches(pd.Series([member_operator(header.name)]), op, value).iloc[0]:
+                return False
+        elif column not in header.columns and op not in EXCLUSIVE_OPERATORS:
+            return False
+    return True
+
+
+def filter_frame(df: pd.DataFrame, filters: List[Filter]) -> pd.DataFrame:
+    """Garde les lignes d'un morceau de fichier qui passent les filtres. La pseudo-colonne `operateur` est ignorée :
+    elle a déjà servi à choisir les fichiers.
+
+    Args:
+        df (pd.DataFrame): morceau de fichier, avec les colonnes des filtres
+        filters (List[Filter]): filtres validés
+
+    Returns:
+        pd.DataFrame: les lignes retenues
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if column == OPERATOR_COLUMN:
+            continue
+        if column not in df.columns:
+            if op not in EXCLUSIVE_OPERATORS:
+                return df.iloc[:0]
+            continue
+        mask &= _matches(df[column], op, value, column=column)
+    return df if mask.all() else df[mask.to_numpy()]
+
+
+def filter_expression(filters: List[Filter], skip: Iterable[str] = (OPERATOR_COLUMN,)) -> Optional[pc.Expression]:
+    """Filtres sous forme d'expression Arrow, pour les tables lues en chaines ou les jeux de données Parquet.
+    Les valeurs sont comparées à leur représentation en chaine. Les filtres sur des colonnes typées du registre ne
+    sont pas traduits : `filter_table` les applique après conversion.
+
+    Args:
+        filters (List[Filter]): filtres validés
+        skip (Iterable[str], optional): colonnes à ignorer. Defaults to la pseudo-colonne `operateur`.
+
+    Returns:
+        Optional[pc.Expression]: l'expression, ou None s'il n'y a rien à filtrer
+    """
+    expression = None
+    for column, op, value in filters:
+        if column in skip or _is_typed(column):
+            continue
+        field = pa_ds.field(column)
+        if op in ('==', '!='):
+            condition = field == str(value)
+        elif op in ('in', 'not in'):
+            condition = field.isin([str(v) for v in value])
+        else:
+            prefixes = [value] if isinstance(value, str) else value
+            condition = None
+            for prefix in prefixes:
+                starts = pc.starts_with(field, pattern=prefix)
+                condition = starts if condition is None else condition | starts
+            if condition is None:
+                condition = pa_ds.scalar(False)
+        if op in EXCLUSIVE_OPERATORS:
+            condition = ~condition | field.is_null()
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def typed_filter_columns(filters: List[Filter]) -> List[str]:
+    """Colonnes typées du registre sur lesquelles portent des filtres, voir `filter_table`.
+
+    Args:
+        filters (List[Filter]): filtres validés
+
+    Returns:
+        List[str]: les colonnes, sans doublon
+    """
+    return [column for column in filter_columns(filters) if _is_typed(column)]
+
+
+def filter_table(table: pa.Table, filters: List[Filter], skip: Iterable[str] = (OPERATOR_COLUMN,)) -> pa.Table:
+    """Garde les lignes d'une table lue en chaines qui passent les filtres, avec les mêmes règles que
+    `filter_frame` : les filtres sur des colonnes typées du registre sont évalués en pandas sur ces seules
+    colonnes, converties au type du registre, les autres par `filter_expression`.
+
+    Args:
+        table (pa.Table): table, avec les colonnes des filtres
+        filters (List[Filter]): filtres validés
+        skip (Iterable[str], optional): colonnes à ignorer. Defaults to la pseudo-colonne `operateur`.
+
+    Returns:
+        pa.Table: les lignes retenues
+    """
+    expression = filter_expression(filters, skip=skip)
+    if expression is not None:
+        table = table.filter(expression)
+    typed = [(column, op, value) for column, op, value in filters if column not in skip and _is_typed(column)]
+    if typed and table.num_rows:
+        df = table.select(typed_filter_columns(typed)).to_pandas()
+        mask = pd.Series(True, index=df.index)
+        for column, op, value in typed:
+            mask &= _matches(df[column], op, value, column=column)
+        table = table.filter(pa.array(mask.to_numpy()))
+    return table
@@ -0,0 +1,129 @@
+"""
+Géométries des immeubles IPE, à partir de leurs coordonnées.
+
+Les coordonnées (`CoordonneeImmeubleX`, `CoordonneeImmeubleY`) sont exprimées dans la projection donnée par
+`TypeProjection` : Lambert 93 en métropole, UTM (RGAF09, RGFG95, RGR92...) dans les DROM, parfois WGS84.
+Les lignes sont groupées par projection et chaque groupe est reprojeté en un seul appel à pyproj, puis les points
+sont construits d'un coup par shapely. Le GeoDataFrame obtenu a un CRS de la forme `EPSG:<code>`, comme ceux de
+`dbtool.Tool.fetch_query`.
+"""
+import functools
+import logging
+import re
+from typing import Optional
+from typing import Union
+
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+logger = logging.getLogger(__name__)
+
+X_COLUMN = 'CoordonneeImmeubleX'
+Y_COLUMN = 'CoordonneeImmeubleY'
+PROJECTION_COLUMN = 'TypeProjection'
+GEO_COLUMNS = [X_COLUMN, Y_COLUMN, PROJECTION_COLUMN]
+DEFAULT_CRS = 'EPSG:2154'
+
+# Valeurs de TypeProjection rencontrées, normalisées (majuscules, sans séparateurs)
+PROJECTIONS = {
+    'L93': 2154,
+    'LAMBERT93': 2154,
+    'RGF93': 2154,
+    'RGF93L93': 2154,
+    'WGS84': 4326,
+    'RGAF09UTM20': 5490,
+    'UTM20': 5490,
+    'UTM20RGAF09': 5490,
+    'WGS84UTM20': 32620,
+    'RGFG95UTM22': 2972,
+    'UTM22': 2972,
+    'UTM22RGFG95': 2972,
+    'RGR92UTM40S': 2975,
+    'UTM40S': 2975,
+    'UTM40': 2975,
+    'RGM04UTM38S': 4471,
+    'UTM38S': 4471,
+    'RGSPM06U21': 4467,
+    'UTM21': 4467,
+    }
+
+
+def projection_epsg(projection: Optional[str]) -> Optional[int]:
+    """Code EPSG d'une valeur de `TypeProjection`.
+
+    Args:
+        projection (Optional[str]): valeur lue dans l'IPE, `L93` ou `RGAF09UTM20` par exemple
+
+    Returns:
+        Optional[int]: le code EPSG, ou None si la projection est inconnue
+    """
+    if projection is None or pd.isna(projection):
+        return None
+    return PROJECTIONS.get(re.sub(r'[^0-9A-Z]', '', str(projection).upper()))
+
+
+def _crs_string(crs: Union[int, str]) -> str:
+    return f'EPSG:{crs}' if isinstance(crs, int) else crs
+
+
+@functools.lru_cache(maxsize=None)
+def _transformer(source: str, target: str) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+def _coordinates(values: pd.Series) -> np.ndarray:
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values.astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    return values.astype('float64').to_numpy()
+
+
+def to_geodataframe(df: pd.DataFrame,
+                    target_crs: Union[int, str] = DEFAULT_CRS,
+                    default_epsg: Optional[int] = None,
+                    geometry: str = 'geometry',
+                    ) -> pdg.GeoDataFrame:
+    """Construis les points des immeubles et les reprojette dans `target_crs`.
+
+    Args:
+        df (pd.DataFrame): IPE avec les colonnes `CoordonneeImmeubleX`, `CoordonneeImmeubleY` et `TypeProjection`
+        target_crs (Union[int, str], optional): CRS du résultat. Defaults to 'EPSG:2154'.
+        default_epsg (Optional[int], optional): Projection des lignes dont `TypeProjection` est vide ou inconnu.
+                Defaults to None (pas de géométrie pour ces lignes).
+        geometry (str, optional): Nom de la colonne géométrie. Defaults to 'geometry'.
+
+    Returns:
+        pdg.GeoDataFrame: le même DF, avec les géométries
+    """
+    target = _crs_string(target_crs)
+    xs = _coordinates(df[X_COLUMN])
+    ys = _coordinates(df[Y_COLUMN])
+
+    # Une conversion par valeur distincte, puis une table de correspondance vectorisée
+    projections = df[PROJECTION_COLUMN].astype('category')
+    codes = [projection_epsg(value) for value in projections.cat.categories]
+    unknown = [value for value, code in zip(projections.cat.categories, codes) if code is None]
+    if unknown:
+        logger.warning('Unknown TypeProjection %s. Using %s for these rows.', unknown, default_epsg)
+    lookup = np.array([code if code is not None else (default_epsg or 0) for code in codes] + [default_epsg or 0])
+    epsgs = lookup[projections.cat.codes.to_numpy()]  # le code -1 (valeur vide) pointe sur la dernière case
+
+    out_x = np.full(len(df), np.nan)
+    out_y = np.full(len(df), np.nan)
+    for epsg in np.unique(epsgs):
+        if epsg == 0:
+            continue
+        rows = np.flatnonzero(epsgs == epsg)
+        source = f'EPSG:{epsg}'
+        if pyproj.CRS(source) == pyproj.CRS(target):
+            out_x[rows], out_y[rows] = xs[rows], ys[rows]
+        else:
+            out_x[rows], out_y[rows] = _transformer(source, target).transform(xs[rows], ys[rows])
+
+    valid = np.isfinite(out_x) & np.isfinite(out_y)
+    points = np.full(len(df), None, dtype=object)
+    points[valid] = shapely.points(out_x[valid], out_y[valid])
+    gdf = pdg.GeoDataFrame(df, geometry=pdg.GeoSeries(points, index=df.index, crs=target), crs=target)
+    return gdf.rename_geometry(geometry) if geometry != gdf.geometry.name else gdf
@@ -0,0 +1,197 @@
+"""
+Index des en-têtes d'une archive IPE.
+
+Seule la première ligne de chaque fichier est décompressée. L'index donne, pour chaque fichier, ses colonnes, son
+encodage, son séparateur et sa version du format Interop'Fibre, et permet de savoir quels fichiers contiennent une
+colonne sans les lire. Il est mis en cache par clef d'archive.
+"""
+import codecs
+import re
+import zipfile
+from collections import Counter
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import pandas as pd
+
+from .. import misc
+from .. import pathtools as pth
+from .encoding import load_encoding_cache
+from .encoding import member_key
+
+SEPARATORS = (';', ',', '\t', '|')
+_VERSION = re.compile(r'_V(\d)(\d)(?:_|$)')
+UNKNOWN = 'inconnu'
+
+
+@dataclass
+class MemberHeader:
+    """
+    En-tête d'un fichier IPE de l'archive.
+    `encoding` vient du cache des encodages s'il est connu, sinon il est déduit de la seule ligne d'en-tête.
+    """
+    name: str
+    crc: int
+    columns: List[str]
+    encoding: str
+    separator: str
+    version: Optional[str] = None
+
+
+@dataclass
+class IpeIndex:
+    """
+    Index des en-têtes d'une archive IPE.
+    """
+    archive: str
+    key: str
+    members: Dict[str, MemberHeader] = field(default_factory=dict)
+
+    def column_members(self) -> Dict[str, List[str]]:
+        """Fichiers contenant chaque colonne.
+
+        Returns:
+            Dict[str, List[str]]: noms des fichiers, par colonne
+        """
+        mapping: Dict[str, List[str]] = {}
+        for header in self.members.values():
+            for column in header.columns:
+                mapping.setdefault(column, []).append(header.name)
+        return mapping
+
+    def members_with(self, columns: List[str], all_columns: bool = False) -> List[str]:
+        """Fichiers contenant au moins une (ou toutes) des colonnes demandées, dans l'ordre de l'archive.
+
+        Args:
+            columns (List[str]): colonnes recherchées
+            all_columns (bool, optional): Exige toutes les colonnes. Defaults to False.
+
+        Returns:
+            List[str]: noms des fichiers
+        """
+        test = all if all_columns else any
+        return [name for name, header in self.members.items()
+                if test(column in header.columns for column in columns)]
+
+    def drift_report(self) -> pd.DataFrame:
+        """Écarts de schéma : pour chaque fichier, colonnes manquantes ou en trop par rapport au schéma le plus
+        courant de sa version du format.
+
+        Returns:
+            pd.DataFrame: une ligne par fichier qui dévie, avec `name`, `version`, `missing`, `extra`
+        """
+        reference: Dict[Optional[str], Counter] = {}
+        for header in self.members.values():
+            reference.setdefault(header.version, Counter())[tuple(header.columns)] += 1
+
+        rows = []
+        for header in self.members.values():
+            expected = reference[header.version].most_common(1)[0][0]
+            missing = [column for column in expected if column not in header.columns]
+            extra = [column for column in header.columns if column not in expected]
+            if missing or extra:
+                rows.append({'name': header.name, 'version': header.version, 'missing': missing, 'extra': extra})
+        return pd.DataFrame(rows, columns=['name', 'version', 'missing', 'extra'])
+
+
+def member_version(name: str) -> Optional[str]:
+    """Version du format IPE lue dans le nom du fichier (`..._V30_20210419.csv` donne `3.0`).
+
+    Args:
+        name (str): nom du fichier
+
+    Returns:
+        Optional[str]: la version, ou None si le nom ne la donne pas
+    """
+    match = _VERSION.search(Path(name).stem)
+    return f'{match.group(1)}.{match.group(2)}' if match else None
+
+
+def member_operator(name: str) -> str:
+    """Code de l'opérateur d'un fichier IPE, lu dans son nom (`IPE_<zone>_<opérateur>_..._<date>.csv`).
+
+    Args:
+        name (str): nom du fichier dans l'archive
+
+    Returns:
+        str: le code opérateur
+    """
+    parts = Path(name).stem.split('_')
+    return parts[2] if len(parts) > 2 else UNKNOWN
+
+
+def archive_key(z: zipfile.ZipFile) -> str:
+    """Clef de contenu d'une archive, calculée sur le répertoire central (noms, CRC et tailles des fichiers),
+    sans décompresser l'archive.
+
+    Args:
+        z (zipfile.ZipFile): archive ouverte
+
+    Returns:
+        str: la clef
+    """
+    return pth.hashname_from_data(sorted((info.filename, info.CRC, info.file_size) for info in z.infolist()))
+
+
+def _header_encoding(line: bytes) -> str:
+    if line.startswith(codecs.BOM_UTF8):
+        return 'UTF-8-SIG'
+    try:
+        line.decode('UTF-8')
+        return 'UTF-8'
+    except UnicodeDecodeError:
+        return 'Windows-1252'
+
+
+def read_header(z: zipfile.ZipFile, name: str, encodings: Optional[Dict[str, str]] = None) -> MemberHeader:
+    """Lis l'en-tête d'un fichier de l'archive, sans décompresser le reste du fichier.
+
+    Args:
+        z (zipfile.ZipFile): archive ouverte
+        name (str): nom du fichier
+        encodings (Optional[Dict[str, str]], optional): cache des encodages détectés. Defaults to None.
+
+    Returns:
+        MemberHeader: l'en-tête
+    """
+    info = z.getinfo(name)
+    with z.open(info, 'r') as f:
+        line = f.readline()
+
+    encoding = (encodings or {}).get(member_key(info), _header_encoding(line))
+    text = line.decode(encoding, errors='replace').lstrip('\ufeff').rstrip('\r\n')
+    separator = max(SEPARATORS, key=text.count)
+    columns = [column.strip().strip('"') for column in text.split(separator)] if text else []
+    return MemberHeader(name=name, crc=info.CRC, columns=columns, encoding=encoding, separator=separator,
+                        version=member_version(name))
+
+
+def build_index(ipe_zip_path: Union[str, Path], use_cache: bool = True) -> IpeIndex:
+    """Construis (ou charge depuis le cache) l'index des en-têtes d'une archive.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+        use_cache (bool, optional): Utilise l'index en cache s'il existe. Defaults to True.
+
+    Returns:
+        IpeIndex: l'index
+    """
+    encodings = load_encoding_cache()
+    with zipfile.ZipFile(ipe_zip_path) as z:
+        key = archive_key(z)
+        cache_path = pth.tmp_path() / f'ipe_index_{key}.pkl'
+        if use_cache and cache_path.exists():
+            return misc.load(filepath=cache_path)
+
+        index = IpeIndex(archive=str(ipe_zip_path), key=key)
+        for name in z.namelist():
+            if name[-3:] == 'csv':
+                index.members[name] = read_header(z, name, encodings=encodings)
+
+    misc.save(data=index, filepath=cache_path)
+    return index
@@ -0,0 +1,288 @@
+"""
+Chargement d'une archive IPE dans une table PostGIS.
+
+Chaque fichier de l'archive est lu par morceaux typés (voir `ipe.schema`), éventuellement avec la géométrie des
+immeubles (voir `ipe.geo`), et envoyé par `COPY ... FROM STDIN`. Chaque processus de chargement a sa propre
+connexion. Les lignes vont dans une table de préparation `<table>__staging`. Quand tous les fichiers sont chargés,
+les index sont construits sur `IdentifiantImmeuble` et la géométrie, puis la table de préparation remplace la
+table cible dans une seule transaction.
+
+Chaque fichier est chargé dans sa propre transaction, qui enregistre aussi son CRC dans `<table>__progress`. Si le
+chargement s'interrompt, le relancer ne recharge que les fichiers manquants ou modifiés, et retire les lignes des
+fichiers qui ne sont plus dans l'archive.
+"""
+import csv
+import io
+import logging
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import pandas as pd
+import shapely
+from sqlalchemy import create_engine
+
+from .. import misc
+from ..dbtool import Tool
+from ..dbtool import _quote_identifier
+from .encoding import load_encoding_cache
+from .encoding import member_encoding
+from .encoding import save_encoding_cache
+from .geo import GEO_COLUMNS
+from .geo import to_geodataframe
+from .index import build_index
+from .rwp import CHUNKSIZE
+from .rwp import _iter_single_ipe_file
+from .schema import CATEGORY
+from .schema import DATE
+from .schema import FLOAT
+from .schema import INTEGER
+from .schema import column_types
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMN = 'IdentifiantImmeuble'
+GEOMETRY_COLUMN = 'geom'
+MEMBER_COLUMN = '_member'
+PG_TYPES = {CATEGORY: 'TEXT', INTEGER: 'BIGINT', FLOAT: 'DOUBLE PRECISION', DATE: 'TIMESTAMP'}
+
+
+def _name(schema: str, table: str) -> str:
+    return f'{_quote_identifier(schema)}.{_quote_identifier(table)}'
+
+
+def staging_ddl(table: str, schema: str, columns: List[str], srid: Optional[int] = None) -> List[str]:
+    """Requêtes de création des tables de préparation et de suivi, si elles n'existent pas.
+
+    Args:
+        table (str): nom de la table cible
+        schema (str): schéma de la table cible
+        columns (List[str]): colonnes IPE chargées
+        srid (Optional[int], optional): SRID de la colonne `geom`. Defaults to None (pas de géométrie).
+
+    Returns:
+        List[str]: les requêtes
+    """
+    types = column_types()
+    definitions = [f'{_quote_identifier(column)} {PG_TYPES.get(types.get(column), "TEXT")}' for column in columns]
+    definitions.append(f'{_quote_identifier(MEMBER_COLUMN)} TEXT')
+    if srid is not None:
+        definitions.append(f'{_quote_identifier(GEOMETRY_COLUMN)} geometry(Point, {srid})')
+    return [
+        f'CREATE TABLE IF NOT EXISTS {_name(schema, f"{table}__staging")} ({", ".join(definitions)});',
+        f'CREATE TABLE IF NOT EXISTS {_name(schema, f"{table}__progress")} '
+        '(member TEXT PRIMARY KEY, crc BIGINT, rows BIGINT, loaded_at TIMESTAMP DEFAULT now());',
+        ]
+
+
+def prune_sql(table: str, schema: str) -> List[str]:
+    """Requêtes de suppression des lignes et du suivi des fichiers qui ne sont plus dans l'archive, quand une
+    reprise porte sur une archive modifiée. Paramètre `members` : la liste des fichiers de l'archive.
+
+    Args:
+        table (str): nom de la table cible
+        schema (str): schéma de la table cible
+
+    Returns:
+        List[str]: les requêtes
+    """
+    return [f'DELETE FROM {_name(schema, f"{table}__staging")} '
+            f'WHERE {_quote_identifier(MEMBER_COLUMN)} <> ALL(%(members)s);',
+            f'DELETE FROM {_name(schema, f"{table}__progress")} WHERE member <> ALL(%(members)s);']
+
+
+def index_sql(table: str, schema: str, srid: Optional[int] = None) -> List[str]:
+    """Requêtes de construction des index et des statistiques de la table de préparation.
+
+    Args:
+        table (str): nom de la table cible
+        schema (str): schéma de la table cible
+        srid (Optional[int], optional): SRID de la colonne `geom`. Defaults to None (pas de géométrie).
+
+    Returns:
+        List[str]: les requêtes
+    """
+    staging = _name(schema, f'{table}__staging')
+    queries = [f'CREATE INDEX IF NOT EXISTS {_quote_identifier(_index_name(table, KEY_COLUMN, True))} '
+               f'ON {staging} ({_quote_identifier(KEY_COLUMN)});']
+    if srid is not None:
+        queries.append(f'CREATE INDEX IF NOT EXISTS {_quote_identifier(_index_name(table, GEOMETRY_COLUMN, True))} '
+                       f'ON {staging} USING GIST ({_quote_identifier(GEOMETRY_COLUMN)});')
+    queries.append(f'ANALYZE {staging};')
+    return queries
+
+
+def _index_name(table: str, column: str, staging: bool) -> str:
+    return f'{table}{"__staging" if staging else ""}_{column.lower()}_idx'
+
+
+def swap_sql(table: str, schema: str, srid: Optional[int] = None) -> List[str]:
+    """Requêtes de remplacement de la table cible par la table de préparation, à exécuter dans une seule
+    transaction.
+
+    Args:
+        table (str): nom de la table cible
+        schema (str): schéma de la table cible
+        srid (Optional[int], optional): SRID de la colonne `geom`. Defaults to None (pas de géométrie).
+
+    Returns:
+        List[str]: les requêtes
+    """
+    queries = [f'DROP TABLE IF EXISTS {_name(schema, table)};',
+               f'ALTER TABLE {_name(schema, f"{table}__staging")} RENAME TO {_quote_identifier(table)};']
+    for column in [KEY_COLUMN] + ([GEOMETRY_COLUMN] if srid is not None else []):
+        queries.append(f'ALTER INDEX {_name(schema, _index_name(table, column, True))} '
+                       f'RENAME TO {_quote_identifier(_index_name(table, column, False))};')
+    queries.append(f'DROP TABLE {_name(schema, f"{table}__progress")};')
+    return queries
+
+
+def frame_to_csv(df: pd.DataFrame) -> io.StringIO:
+    """CSV d'un morceau, prêt pour `COPY ... WITH (FORMAT csv)` : sans en-tête, valeurs nulles vides.
+
+    Args:
+        df (pd.DataFrame): morceau typé, colonnes dans l'ordre de la table
+
+    Returns:
+        io.StringIO: le CSV, rembobiné
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='', date_format='%Y-%m-%d %H:%M:%S',
+              quoting=csv.QUOTE_MINIMAL)
+    buffer.seek(0)
+    return buffer
+
+
+def _with_geometry(chunk: pd.DataFrame, srid: int) -> pd.DataFrame:
+    gdf = to_geodataframe(chunk, target_crs=srid)
+    geometries = gdf.geometry.array
+    chunk[GEOMETRY_COLUMN] = shapely.to_wkb(shapely.set_srid(geometries, srid), hex=True, include_srid=True)
+    return chunk
+
+
+def _load_member(connection_string: str, ipe_zip_path: Union[str, Path], name: str, table: str, schema: str,
+                 columns: List[str], encoding: str, sep: str, version: Optional[str], crc: int,
+                 srid: Optional[int] = None, chunksize: int = CHUNKSIZE) -> Tuple[str, int]:
+    # Exécuté dans un processus de chargement, avec sa propre connexion. Une transaction par fichier : en cas
+    # d'erreur, rien n'est gardé du fichier, et il sera rechargé à la reprise.
+    read_cols = columns + [column for column in GEO_COLUMNS if srid is not None and column not in columns]
+    copy_cols = columns + [MEMBER_COLUMN] + ([GEOMETRY_COLUMN] if srid is not None else [])
+    staging = _name(schema, f'{table}__staging')
+    copy = (f'COPY {staging} ({", ".join(_quote_identifier(column) for column in copy_cols)}) '
+            "FROM STDIN WITH (FORMAT csv, NULL '')")
+
+    engine = create_engine(connection_string)
+    connection = engine.raw_connection()
+    rows = 0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {staging} WHERE {_quote_identifier(MEMBER_COLUMN)} = %s;', (name,))
+            with zipfile.ZipFile(ipe_zip_path) as z, z.open(name, 'r') as f:
+                for chunk in _iter_single_ipe_file(f, chunksize, cols=read_cols, encoding=encoding, name=name,
+                                                   sep=sep, typed=True, version=version):
+                    chunk = chunk.reindex(columns=read_cols)
+                    chunk[MEMBER_COLUMN] = name
+                    if srid is not None:
+                        chunk = _with_geometry(chunk, srid)
+                    cursor.copy_expert(copy, frame_to_csv(chunk[copy_cols]))
+                    rows += len(chunk)
+            cursor.execute(f'INSERT INTO {_name(schema, f"{table}__progress")} (member, crc, rows) '
+                           'VALUES (%s, %s, %s) ON CONFLICT (member) DO UPDATE '
+                           'SET crc = EXCLUDED.crc, rows = EXCLUDED.rows, loaded_at = now();',
+                           (name, crc, rows))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+        engine.dispose()
+    return name, rows
+
+
+def _loaded_members(tool: Tool, table: str, schema: str) -> Dict[str, int]:
+    result = tool.engine.execute(f'SELECT member, crc FROM {_name(schema, f"{table}__progress")};')
+    return {member: crc for member, crc in result}
+
+
+def load_ipe(ipe_zip_path: Union[str, Path],
+             tool: Tool,
+             table: str,
+             schema: str = 'public',
+             columns: Optional[List[str]] = None,
+             srid: Optional[int] = None,
+             workers: int = 4,
+             resume: bool = True,
+             chunksize: int = CHUNKSIZE,
+             ) -> Dict[str, int]:
+    """Charge une archive IPE dans `<schema>.<table>`, en parallèle, par `COPY`.
+    ```
+        load_ipe(path, Tool(secret_file), 'ipe_t1_2021', schema='ipe', srid=2154, workers=8)
+    ```
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+        tool (Tool): connexion à la base PostGIS cible
+        table (str): nom de la table cible, remplacée à la fin du chargement
+        schema (str, optional): schéma de la table cible. Defaults to 'public'.
+        columns (Optional[List[str]], optional): Colonnes chargées. Defaults to None (toutes celles de l'archive).
+        srid (Optional[int], optional): Ajoute une colonne `geom` de points dans ce SRID. Defaults to None.
+        workers (int, optional): Nombre de processus de chargement, chacun avec sa connexion. Defaults to 4.
+        resume (bool, optional): Reprend un chargement interrompu, sans recharger les fichiers déjà chargés.
+                Si faux, repart de zéro. Defaults to True.
+        chunksize (int, optional): Nombre de lignes par `COPY`. Defaults to CHUNKSIZE.
+
+    Returns:
+        Dict[str, int]: nombre de lignes chargées par fichier, lors de cet appel
+    """
+    index = build_index(ipe_zip_path)
+    if columns is None:
+        seen = {}
+        for header in index.members.values():
+            seen.update(dict.fromkeys(header.columns))
+        columns = list(seen)
+
+    if not resume:
+        tool.engine.execute(f'DROP TABLE IF EXISTS {_name(schema, f"{table}__staging")}, '
+                            f'{_name(schema, f"{table}__progress")};')
+    for query in staging_ddl(table, schema, columns, srid=srid):
+        tool.engine.execute(query)
+    with tool.engine.begin() as connection:
+        for query in prune_sql(table, schema):
+            connection.execute(query, {'members': list(index.members)})
+
+    loaded = _loaded_members(tool, table, schema)
+    names = [name for name, header in index.members.items()
+             if any(column in header.columns for column in columns) and loaded.get(name) != header.crc]
+    logger.info('Loading %s of %s files into %s.%s (%s already loaded)', len(names), len(index.members), schema,
+                table, len(loaded))
+
+    encodings = load_encoding_cache()
+    with zipfile.ZipFile(ipe_zip_path) as z:
+        member_encodings = {name: member_encoding(z, name, cache=encodings) for name in names}
+    save_encoding_cache(encodings)
+
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load_member, tool.connexion_string, ipe_zip_path, name, table, schema, columns,
+                                   member_encodings[name], index.members[name].separator,
+                                   index.members[name].version, index.members[name].crc, srid, chunksize)
+                   for name in names]
+        for future in misc.make_iterator(as_completed(futures), low_bound=1, size=len(futures),
+                                         desc='Loading IPE'):
+            name, count = future.result()
+            rows[name] = count
+
+    for query in index_sql(table, schema, srid=srid):
+        tool.engine.execute(query)
+    with tool.engine.begin() as connection:
+        for query in swap_sql(table, schema, srid=srid):
+            connection.execute(query)
+    logger.info('Loaded %s rows into %s.%s', sum(rows.values()), schema, table)
+    return rows
@@ -0,0 +1,205 @@
+"""
+Requêtes SQL sur les archives IPE, avec DuckDB.
+
+Chaque archive devient une table DuckDB. Si l'archive a été ingérée (voir `ipe.store`), la table lit le jeu de
+données Parquet : DuckDB n'en lit que les colonnes et les partitions utiles. Sinon, les fichiers de l'archive sont
+lus en flux par `iter_ipe`, avec la même détection des encodages que `parse_ipe`. La table ne peut alors être
+parcourue qu'une fois par connexion.
+
+Les colonnes du registre des schémas (voir `ipe.schema`) sont typées dans une vue : entiers, flottants (virgule
+décimale) et dates. Les agrégations, jointures et filtres sont exécutés par DuckDB, sur plusieurs threads, et
+débordent sur disque dans le dossier tmp si besoin.
+```
+    df = query('SELECT EtatImmeuble, count(*) AS n FROM ipe GROUP BY 1', archives=path)
+```
+"""
+import re
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Union
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from .. import pathtools as pth
+from .index import build_index
+from .rwp import CHUNKSIZE
+from .rwp import iter_ipe
+from .schema import DATE
+from .schema import FLOAT
+from .schema import INTEGER
+from .schema import column_types
+from .store import ingest_ipe
+from .store import is_ingested
+from .store import store_dataset
+
+DEFAULT_TABLE = 'ipe'
+BATCH_SIZE = 1000000
+_SQL_DATE_FORMATS = ('%Y%m%d', '%d/%m/%Y')
+
+Archives = Union[str, Path, Iterable[Union[str, Path]], Dict[str, Union[str, Path]]]
+
+
+def table_names(archives: Archives) -> Dict[str, Path]:
+    """Nom de table de chaque archive : `ipe` pour une archive seule, le nom du fichier sinon (caractères non
+    alphanumériques remplacés par `_`). Un dictionnaire donne directement les noms.
+
+    Args:
+        archives (Archives): archive, liste d'archives ou dictionnaire nom de table -> archive
+
+    Returns:
+        Dict[str, Path]: archive par nom de table
+    """
+    if isinstance(archives, dict):
+        return {name: Path(path) for name, path in archives.items()}
+    if isinstance(archives, (str, Path)):
+        return {DEFAULT_TABLE: Path(archives)}
+    return {re.sub(r'\W+', '_', Path(path).stem): Path(path) for path in archives}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _typed_select(columns: List[str], numeric_cols: List[str]) -> str:
+    types = column_types()
+    expressions = []
+    for column in columns:
+        quoted = _quote(column)
+        kind = FLOAT if column in numeric_cols else types.get(column)
+        if kind == INTEGER:
+            expression = f'TRY_CAST({quoted} AS BIGINT)'
+        elif kind == FLOAT:
+            expression = f"TRY_CAST(REPLACE({quoted}, ',', '.') AS DOUBLE)"
+        elif kind == DATE:
+            formats = ', '.join(f"TRY_STRPTIME({quoted}, '{date_format}')" for date_format in _SQL_DATE_FORMATS)
+            expression = f'COALESCE({formats})'
+        else:
+            expression = quoted
+        expressions.append(f'{expression} AS {quoted}')
+    return ', '.join(expressions)
+
+
+def archive_reader(ipe_zip_path: Union[str, Path], columns: Optional[List[str]] = None,
+                   chunksize: int = CHUNKSIZE) -> pa.RecordBatchReader:
+    """Flux Arrow des fichiers d'une archive, toutes colonnes en chaines. Les fichiers ne sont lus qu'au parcours.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+        columns (Optional[List[str]], optional): Colonnes du flux. Defaults to None (toutes celles de l'archive).
+        chunksize (int, optional): Nombre de lignes par lot. Defaults to CHUNKSIZE.
+
+    Returns:
+        pa.RecordBatchReader: le flux
+    """
+    if columns is None:
+        seen = {}
+        for header in build_index(ipe_zip_path).members.values():
+            seen.update(dict.fromkeys(header.columns))
+        columns = list(seen)
+    schema = pa.schema([(column, pa.string()) for column in columns])
+
+    def _batches() -> Iterator[pa.RecordBatch]:
+        for _, chunk in iter_ipe(ipe_zip_path, columns=columns, chunksize=chunksize, typed=False):
+            yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+    return pa.RecordBatchReader.from_batches(schema, _batches())
+
+
+def connect(archives: Archives,
+            columns: Optional[List[str]] = None,
+            numeric_cols: Optional[List[str]] = None,
+            use_store: bool = True,
+            ingest: bool = False,
+            threads: Optional[int] = None,
+            ) -> duckdb.DuckDBPyConnection:
+    """Connexion DuckDB où chaque archive est une table (vue typée).
+
+    Args:
+        archives (Archives): archive, liste d'archives ou dictionnaire nom de table -> archive
+        columns (Optional[List[str]], optional): Colonnes exposées. Defaults to None (toutes).
+        numeric_cols (Optional[List[str]], optional): Colonnes numériques hors du registre des schémas.
+                Defaults to None.
+        use_store (bool, optional): Lis les archives ingérées dans leur jeu de données Parquet. Defaults to True.
+        ingest (bool, optional): Ingère d'abord les archives qui ne le sont pas. Sinon, les archives non
+                ingérées sont copiées dans des tables temporaires DuckDB. Defaults to False.
+        threads (Optional[int], optional): Nombre de threads DuckDB. Defaults to None (tous les cœurs).
+
+    Returns:
+        duckdb.DuckDBPyConnection: la connexion
+    """
+    numeric_cols = [] if numeric_cols is None else numeric_cols
+    temp_directory = pth.tmp_path() / 'duckdb'
+    temp_directory.mkdir(parents=True, exist_ok=True)
+    config = {'temp_directory': str(temp_directory)}
+    if threads is not None:
+        config['threads'] = threads
+    con = duckdb.connect(config=config)
+
+    for name, path in table_names(archives).items():
+        if ingest:
+            ingest_ipe(path)
+        if (use_store or ingest) and is_ingested(path):
+            source = store_dataset(path)
+            available = [column for column in source.schema.names if columns is None or column in columns]
+            con.register(f'_raw_{name}', source)
+        else:
+            # Un flux Arrow ne se lit qu'une fois : il est copié dans une table temporaire DuckDB (qui déborde sur
+            # disque au besoin), pour que la table puisse servir à plusieurs requêtes ou à une auto-jointure.
+            source = archive_reader(path, columns=columns)
+            available = source.schema.names
+            con.register(f'_stream_{name}', source)
+            con.execute(f'CREATE TEMP TABLE {_quote(f"_raw_{name}")} AS SELECT * FROM {_quote(f"_stream_{name}")}')
+            con.unregister(f'_stream_{name}')
+        con.execute(f'CREATE VIEW {_quote(name)} AS SELECT {_typed_select(available, numeric_cols)} '
+                    f'FROM {_quote(f"_raw_{name}")}')
+    return con
+
+
+def query(sql: str,
+          archives: Archives,
+          columns: Optional[List[str]] = None,
+          numeric_cols: Optional[List[str]] = None,
+          use_store: bool = True,
+          ingest: bool = False,
+          as_arrow: bool = False,
+          batch_size: int = BATCH_SIZE,
+          ) -> Union[pd.DataFrame, pa.RecordBatchReader]:
+    """Exécute une requête SQL sur des archives IPE. Voir `connect` pour plusieurs requêtes sur les mêmes tables.
+    ```
+        query('SELECT substr(CodeInseeImmeuble, 1, 2) AS dpt, sum(NombreLogementsAdresseIPE) FROM ipe GROUP BY 1',
+              archives=path)
+    ```
+
+    Args:
+        sql (str): la requête. Les tables sont nommées comme dans `table_names`.
+        archives (Archives): archive, liste d'archives ou dictionnaire nom de table -> archive
+        columns (Optional[List[str]], optional): Colonnes exposées. Defaults to None (toutes).
+        numeric_cols (Optional[List[str]], optional): Colonnes numériques hors du registre des schémas.
+                Defaults to None.
+        use_store (bool, optional): Lis les archives ingérées dans leur jeu de données Parquet. Defaults to True.
+        ingest (bool, optional): Ingère d'abord les archives qui ne le sont pas. Defaults to False.
+        as_arrow (bool, optional): Renvoie un flux Arrow plutôt qu'un DF, pour les gros résultats. La connexion
+                DuckDB reste alors ouverte tant que le flux existe. Sinon, elle est fermée une fois le DF construit.
+                Defaults to False.
+        batch_size (int, optional): Nombre de lignes par lot du flux Arrow. Defaults to 1000000.
+
+    Returns:
+        Union[pd.DataFrame, pa.RecordBatchReader]: le résultat
+    """
+    con = connect(archives, columns=columns, numeric_cols=numeric_cols, use_store=use_store, ingest=ingest)
+    if as_arrow:
+        # Le flux lit la connexion au fil de l'eau : elle reste ouverte, avec ses tables temporaires, tant que le
+        # flux est référencé
+        result = con.execute(sql)
+        to_reader = getattr(result, 'to_arrow_reader', None)
+        return to_reader(batch_size) if to_reader is not None else result.fetch_record_batch(batch_size)
+    try:
+        return con.execute(sql).df()
+    finally:
+        con.close()
@@ -1,106 +1,473 @@
 """
 Outil de lecture des fichiers IPE
 """
+import fnmatch
 import logging
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 from pathlib import Path
+from typing import Any
+from typing import Dict
 from typing import IO
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import tqdm
 
 from .. import pathtools as pth
 from .. import misc
+from .encoding import IpeDecodeError
+from .encoding import decode_error_offset
+from .encoding import detect_encoding
+from .encoding import load_encoding_cache
+from .encoding import member_encoding
+from .encoding import member_key
+from .encoding import save_encoding_cache
+from .filters import Filter
+from .filters import check_filters
+from .filters import filter_columns
+from .filters import filter_frame
+from .filters import filter_table
+from .filters import member_can_match
+from .geo import DEFAULT_CRS
+from .geo import GEO_COLUMNS
+from .geo import to_geodataframe
+from .index import build_index
+from .index import member_version
+from .schema import CATEGORY
+from .schema import apply_schema
+from .schema import column_types
+from .schema import concat_typed
+from .schema import read_dtypes
 
 logger = logging.getLogger(__name__)
 
+ENGINES = ('pandas', 'arrow')
+CHUNKSIZE = 100000
+# Taille des blocs du lecteur Arrow quand le nombre de lignes est limité : le lecteur lit plusieurs dizaines de
+# blocs d'avance, de petits blocs évitent de lire tout le fichier pour quelques lignes.
+NROWS_BLOCK_SIZE = 1 << 16
 
-def _read_single_ipe_file(filelike: IO[bytes], cols: Optional[List[str]] = None,
-                          nrows: Optional[int] = None
-                          ) -> pd.DataFrame:
-    all_encodings = ['UTF-8', 'Windows-1252', 'Latin-1']
-
-    df = pd.DataFrame()
-    for encoding in all_encodings:
-        try:
-            df = pd.read_csv(filelike,
-                             sep=';',
-                             decimal=',',
-                             encoding=encoding,
-                             usecols=lambda c: c in cols,
-                             dtype=str,
-                             nrows=nrows)  # type: ignore
-
-            if df.shape[1] > 0:
-                break
 
-            logger.debug('Not enough columns with encoding %s. Trying with some other.', encoding)
+def _csv_options(cols: Optional[List[str]], encoding: str, sep: str = ';', typed: bool = False,
+                 version: Optional[str] = None) -> Dict[str, Any]:
+    return dict(sep=sep,
+                decimal=',',
+                encoding=encoding,
+                usecols=(lambda c: c in cols) if cols is not None else None,
+                dtype=read_dtypes(cols, version) if typed and cols is not None else str)
 
-        except UnicodeDecodeError:
-            logger.debug('Encoding %s did not work. Trying anew', encoding)
-        filelike.seek(0)
-    return df
+
+def _decode_error(e: UnicodeDecodeError, name: Optional[str], encoding: str,
+                  filelike: IO[bytes]) -> IpeDecodeError:
+    # La position de `e` est relative au bloc décodé par le lecteur CSV : on relit le fichier pour la retrouver
+    try:
+        offset = decode_error_offset(filelike, encoding)
+    except (OSError, ValueError):  # flux qui ne revient pas au début
+        offset = None
+    where = f'at byte {offset}' if offset is not None else 'at an unknown position'
+    return IpeDecodeError(f'Could not decode {name} as {encoding} {where}', member=name, encoding=encoding,
+                          offset=offset)
+
+
+def _detect(filelike: IO[bytes], name: Optional[str]) -> str:
+    encoding, offset = detect_encoding(filelike)
+    if offset is not None:
+        logger.debug('%s is not valid UTF-8 from byte %s on. Reading it as %s.', name, offset, encoding)
+    return encoding
+
+
+def _read_single_ipe_file(filelike: IO[bytes], cols: Optional[List[str]] = None,
+                          nrows: Optional[int] = None, encoding: Optional[str] = None, name: Optional[str] = None,
+                          sep: str = ';', typed: bool = False, version: Optional[str] = None) -> pd.DataFrame:
+    encoding = encoding if encoding is not None else _detect(filelike, name)
+    try:
+        df = pd.read_csv(filelike, nrows=nrows,
+                         **_csv_options(cols, encoding, sep=sep, typed=typed, version=version))  # type: ignore
+    except UnicodeDecodeError as e:
+        raise _decode_error(e, name, encoding, filelike) from e
+    return apply_schema(df, version) if typed else df
+
+
+def _iter_single_ipe_file(filelike: IO[bytes], chunksize: int, cols: Optional[List[str]] = None,
+                          encoding: Optional[str] = None, name: Optional[str] = None, sep: str = ';',
+                          typed: bool = False, version: Optional[str] = None, nrows: Optional[int] = None
+                          ) -> Iterator[pd.DataFrame]:
+    encoding = encoding if encoding is not None else _detect(filelike, name)
+    options = _csv_options(cols, encoding, sep=sep, typed=typed, version=version)
+    try:
+        with pd.read_csv(filelike, chunksize=chunksize, nrows=nrows, **options) as reader:  # type: ignore
+            for chunk in reader:
+                yield apply_schema(chunk, version) if typed else chunk
+    except UnicodeDecodeError as e:
+        raise _decode_error(e, name, encoding, filelike) from e
+
+
+def _read_filtered_ipe_file(filelike: IO[bytes], cols: List[str], filters: List[Filter],
+                            nrows: Optional[int] = None, encoding: Optional[str] = None, name: Optional[str] = None,
+                            sep: str = ';', typed: bool = False, version: Optional[str] = None) -> pd.DataFrame:
+    # Lis le fichier par morceaux et ne garde que les lignes filtrées : la mémoire suit la taille du résultat
+    read_cols = cols + [col for col in filter_columns(filters) if col not in cols]
+    kept = [filter_frame(chunk, filters)
+            for chunk in _iter_single_ipe_file(filelike, CHUNKSIZE, cols=read_cols, encoding=encoding, name=name,
+                                               sep=sep, typed=typed, version=version, nrows=nrows)]
+    df = concat_typed(kept) if typed and kept else pd.concat(kept, ignore_index=True) if kept else pd.DataFrame()
+    return df[[col for col in cols if col in df.columns]]
+
+
+def _read_single_ipe_table(filelike: IO[bytes], cols: List[str], nrows: Optional[int] = None,
+                           encoding: Optional[str] = None, name: Optional[str] = None, sep: str = ';',
+                           numeric_cols: Optional[List[str]] = None, typed: bool = False,
+                           version: Optional[str] = None, filters: Optional[List[Filter]] = None) -> pa.Table:
+    # Lecteur CSV multi-thread d'Arrow. Les colonnes absentes du fichier sont créées vides, pour que toutes les
+    # tables aient le même schéma. Les colonnes de texte sont encodées en dictionnaire. Les colonnes typées du
+    # registre (nombres, dates) restent des chaines, converties par `apply_schema` une fois en pandas.
+    # Avec des filtres ou une limite de lignes, le fichier est lu par blocs : chaque bloc est filtré avant d'être
+    # gardé, et la lecture s'arrête une fois `nrows` lignes lues.
+    encoding = encoding if encoding is not None else _detect(filelike, name)
+    numeric_cols = [] if numeric_cols is None else numeric_cols
+    filters = [] if filters is None else filters
+    registry = column_types(version) if typed else {}
+    filter_cols = filter_columns(filters)
+    read_cols = cols + [col for col in filter_cols if col not in cols]
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    types = {col: pa.string() if col in numeric_cols or col in filter_cols or registry.get(col, CATEGORY) != CATEGORY
+             else dictionary
+             for col in read_cols}
+    read_options = pa_csv.ReadOptions(encoding=encoding, use_threads=True)
+    if nrows is not None:
+        read_options.block_size = NROWS_BLOCK_SIZE
+    parse_options = pa_csv.ParseOptions(delimiter=sep)
+    convert_options = pa_csv.ConvertOptions(include_columns=read_cols,
+                                            include_missing_columns=True,
+                                            column_types=types,
+                                            strings_can_be_null=True,
+                                            decimal_point=',')
+    try:
+        if not filters and nrows is None:
+            return pa_csv.read_csv(filelike, read_options=read_options, parse_options=parse_options,
+                                   convert_options=convert_options)
+
+        batches = []
+        read = 0
+        for batch in pa_csv.open_csv(filelike, read_options=read_options, parse_options=parse_options,
+                                     convert_options=convert_options):
+            if nrows is not None:
+                batch = batch.slice(0, nrows - read)
+            read += batch.num_rows
+            batch = pa.Table.from_batches([batch])
+            batches.append(filter_table(batch, filters))
+            if nrows is not None and read >= nrows:
+                break
+    except UnicodeDecodeError as e:
+        raise _decode_error(e, name, encoding, filelike) from e
+    schema = pa.schema([(col, types[col]) for col in read_cols])
+    return pa.concat_tables(batches).select(cols) if batches else schema.empty_table().select(cols)
 
 
 def _type_df(df: pd.DataFrame, numeric_cols: List[str] = None):
     if numeric_cols is not None:
         for col in numeric_cols:
-            df.loc[:, col] = pd.to_numeric(df[col], errors='coerce')
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+
+
+def _ipe_members(z: zipfile.ZipFile) -> List[str]:
+    return [name for name in z.namelist() if name[-3:] == 'csv']
+
+
+def _resolve_member(z: zipfile.ZipFile, ipe_name: str) -> str:
+    # Chemin complet, motif `fnmatch` ou simple nom de fichier, quel que soit le dossier dans l'archive
+    names = _ipe_members(z)
+    if ipe_name in names:
+        return ipe_name
+    matches = [name for name in names if Path(name).name == ipe_name or fnmatch.fnmatch(name, ipe_name)]
+    if not matches:
+        raise KeyError(f'No IPE file matches {ipe_name} in {z.filename}')
+    if len(matches) > 1:
+        logger.warning('%s files match %s. Reading %s', len(matches), ipe_name, matches[0])
+    return matches[0]
+
+
+def _read_member(ipe_zip_path: Union[str, Path], name: str, columns: List[str], nrows: Optional[int] = None,
+                 encoding: Optional[str] = None, sep: str = ';', engine: str = 'pandas',
+                 numeric_cols: Optional[List[str]] = None, typed: bool = False,
+                 filters: Optional[List[Filter]] = None) -> Tuple[Union[pd.DataFrame, pa.Table], str]:
+    version = member_version(name)
+    with zipfile.ZipFile(ipe_zip_path) as z:
+        if encoding is None:
+            encoding = member_encoding(z, name)
+        with z.open(name, 'r') as f:
+            if engine == 'arrow':
+                df = _read_single_ipe_table(f, cols=columns, nrows=nrows, encoding=encoding, name=name, sep=sep,
+                                            numeric_cols=numeric_cols, typed=typed, version=version, filters=filters)
+            elif filters:
+                df = _read_filtered_ipe_file(f, cols=columns, filters=filters, nrows=nrows, encoding=encoding,
+                                             name=name, sep=sep, typed=typed, version=version)
+            else:
+                df = _read_single_ipe_file(f, cols=columns, nrows=nrows, encoding=encoding, name=name, sep=sep,
+                                           typed=typed, version=version)
+    return df, encoding
+
+
+def _read_member_as_arrow(ipe_zip_path: Union[str, Path], name: str, columns: List[str], nrows: Optional[int] = None,
+                          encoding: Optional[str] = None, sep: str = ';', engine: str = 'pandas',
+                          numeric_cols: Optional[List[str]] = None, typed: bool = False,
+                          filters: Optional[List[Filter]] = None) -> Tuple[str, pa.Buffer, str]:
+    # Exécuté dans un processus fils : seul le flux Arrow des lignes et colonnes retenues repasse au parent
+    df, encoding = _read_member(ipe_zip_path, name, columns, nrows=nrows, encoding=encoding, sep=sep, engine=engine,
+                                numeric_cols=numeric_cols, typed=typed, filters=filters)
+    table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return name, sink.getvalue(), encoding
+
+
+def _read_members_in_pool(ipe_zip_path: Union[str, Path], names: List[str], columns: List[str],
+                          encodings: Dict[str, str], keys: Dict[str, str], workers: int,
+                          nrows: Optional[int] = None, seps: Optional[Dict[str, str]] = None,
+                          engine: str = 'pandas', numeric_cols: Optional[List[str]] = None, typed: bool = False,
+                          filters: Optional[List[Filter]] = None) -> Dict[str, Union[pd.DataFrame, pa.Table]]:
+    seps = {} if seps is None else seps
+    dfs = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_read_member_as_arrow, ipe_zip_path, name, columns, nrows,
+                                   encodings.get(keys[name]), seps.get(name, ';'), engine, numeric_cols, typed,
+                                   filters)
+                   for name in names]
+        for future in misc.make_iterator(as_completed(futures), low_bound=1, size=len(futures),
+                                         desc='Reading IPE'):
+            name, buffer, encoding = future.result()
+            encodings[keys[name]] = encoding
+            table = pa.ipc.open_stream(buffer).read_all()
+            dfs[name] = table if engine == 'arrow' else table.to_pandas()
+    return dfs
+
+
+def _empty_frame(columns: List[str], numeric_cols: List[str], typed: bool) -> pd.DataFrame:
+    df = pd.DataFrame({col: pd.Series(dtype=object) for col in columns})
+    if typed:
+        apply_schema(df)
+    _type_df(df, numeric_cols=numeric_cols)
+    return df
 
 
 def parse_ipe(ipe_zip_path: Union[str, Path],
               columns: List[str],
               numeric_cols: List[str] = None,
               cols_are_optional: bool = True,
-              _test_nrows: int = None
+              _test_nrows: int = None,
+              workers: Optional[int] = None,
+              use_store: bool = True,
+              engine: str = 'pandas',
+              typed: bool = True,
+              filters: Optional[List[Filter]] = None,
+              as_geo: bool = False,
+              target_crs: Union[int, str] = DEFAULT_CRS,
               ) -> pd.DataFrame:
     """
-    Lis tous les fichiers IPE dans l'archive pointée et extrait les colonnes spécifiées, en les convertissant
-    éventuellement en nombre.
+    Lis tous les fichiers IPE dans l'archive pointée et extrait les colonnes spécifiées, typées selon le registre
+    des schémas IPE (voir `ipe.schema`).
 
     Args:
         ipe_zip_path: Chemin vers l'archive
         columns: Colonnes à extraire
-        numeric_cols: Colonnes numériques dans les colonnes à extraire
+        numeric_cols: Colonnes numériques hors du registre des schémas
         cols_are_optional: Ne plante pas si la colonne demandée n'existe pas dans l'IPE
         _test_nrows:
+        workers: Nombre de processus de lecture. Chaque processus ouvre l'archive et renvoie les colonnes
+            demandées au format Arrow. Par défaut, lis les fichiers un à un dans le processus courant.
+        use_store: Si l'archive a été ingérée (voir `ipe.store.ingest_ipe`) et n'a pas changé depuis, lis les
+            colonnes dans le jeu de données Parquet plutôt que dans l'archive.
+        engine: `pandas` (par défaut) ou `arrow`. Le moteur `arrow` lit chaque fichier avec le lecteur CSV
+            multi-thread de pyarrow, encode les colonnes de texte en dictionnaire (catégories pandas) et ne
+            convertit en DataFrame qu'une fois toutes les tables concaténées.
+        typed: Type les colonnes standard dès la lecture (catégories, entiers, flottants, dates), selon la
+            version du format de chaque fichier. Si faux, toutes les colonnes sont des chaines.
+        filters: Filtres `(colonne, opérateur, valeur)` appliqués pendant la lecture, voir `ipe.filters`.
+            Les fichiers écartés par leur nom ou leur en-tête ne sont pas lus, les autres sont lus par morceaux.
+            La pseudo-colonne `departement` n'est acceptée que si l'archive est lue depuis le jeu de données
+            ingéré (`use_store` et archive ingérée sans modification depuis) : sinon, `ValueError`.
+            ```
+                parse_ipe(path, columns, filters=[('CodeInseeImmeuble', 'startswith', '71'),
+                                                  ('EtatImmeuble', '==', 'DEPLOYE')])
+            ```
+        as_geo: Renvoie un GeoDataFrame des immeubles. Les points sont construits à partir de
+            `CoordonneeImmeubleX/Y`, et chaque `TypeProjection` est reprojeté en un seul appel (voir `ipe.geo`).
+        target_crs: CRS des géométries si `as_geo`, code EPSG ou `EPSG:<code>` comme dans `dbtool`.
 
     Returns:
-        Un DF avec les colonnes demandées.
+        Un DF avec les colonnes demandées, ou un GeoDataFrame avec en plus la colonne `geometry` si `as_geo`.
 
     """
+    if as_geo:
+        extra = [col for col in GEO_COLUMNS if col not in columns]
+        df_full = parse_ipe(ipe_zip_path, columns + extra, numeric_cols=numeric_cols,
+                            cols_are_optional=cols_are_optional, _test_nrows=_test_nrows, workers=workers,
+                            use_store=use_store, engine=engine, typed=typed, filters=filters)
+        return to_geodataframe(df_full, target_crs=target_crs).drop(columns=extra)
+
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine}. Expected one of {ENGINES}')
+    numeric_cols = [] if numeric_cols is None else numeric_cols
+    filters = check_filters(filters, store=True)
+
+    if use_store and _test_nrows is None:
+        from .store import is_ingested, read_store  # Import local : store dépend de ce module
+
+        if is_ingested(ipe_zip_path):
+            df_full = read_store(ipe_zip_path, columns, cols_are_optional=cols_are_optional, filters=filters)
+            if typed:
+                apply_schema(df_full)
+            _type_df(df_full, numeric_cols=numeric_cols)
+            return df_full
+    check_filters(filters)
+
+    index = build_index(ipe_zip_path)
+    names = [name for name in index.members_with(columns, all_columns=not cols_are_optional)
+             if member_can_match(index.members[name], filters)]
+    if not names:
+        # Aucun fichier ne peut passer les filtres, ou n'a les colonnes demandées
+        return _empty_frame(columns, numeric_cols, typed)
+    seps = {name: index.members[name].separator for name in names}
+    file_issues = [name for name in index.members if name not in seps]
+
+    encodings = load_encoding_cache()
     with zipfile.ZipFile(ipe_zip_path) as z:
-        file_issues = []
-        dfs = []
-
-        for name in misc.make_iterator(z.namelist(), low_bound=1, desc='Reading IPE'):
-            extension = name[-3:]
-            if extension == 'csv':
+        keys = {name: member_key(z.getinfo(name)) for name in names}
+
+        if workers is not None and workers > 1:
+            member_dfs = _read_members_in_pool(ipe_zip_path, names, columns, encodings, keys, workers,
+                                               nrows=_test_nrows, seps=seps, engine=engine,
+                                               numeric_cols=numeric_cols, typed=typed, filters=filters)
+        else:
+            member_dfs = {}
+            for name in misc.make_iterator(names, low_bound=1, desc='Reading IPE'):
+                encoding = member_encoding(z, name, cache=encodings)
+                version = index.members[name].version
                 with z.open(name, 'r') as f:
-                    df = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows)
-
-                    has_all_cols = df.shape[1] == len(columns)
-                    if not has_all_cols and not cols_are_optional:
-                        file_issues.append(name)
-
-                    if has_all_cols or cols_are_optional:
-                        dfs.append(df)
+                    if engine == 'arrow':
+                        member_dfs[name] = _read_single_ipe_table(f, cols=columns, nrows=_test_nrows,
+                                                                  encoding=encoding, name=name, sep=seps[name],
+                                                                  numeric_cols=numeric_cols, typed=typed,
+                                                                  version=version, filters=filters)
+                    elif filters:
+                        member_dfs[name] = _read_filtered_ipe_file(f, cols=columns, filters=filters,
+                                                                   nrows=_test_nrows, encoding=encoding, name=name,
+                                                                   sep=seps[name], typed=typed, version=version)
+                    else:
+                        member_dfs[name] = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows,
+                                                                 encoding=encoding, name=name, sep=seps[name],
+                                                                 typed=typed, version=version)
+    save_encoding_cache(encodings)
+
+    if engine == 'arrow':
         if len(file_issues) > 0:
             logger.debug('Done reading. Had %s issues. Could not read files : %s', len(file_issues), file_issues)
-
-    df_full = pd.concat(dfs)  # type: ignore
+        # Concaténation sans copie : chaque table devient un bloc de la table complète
+        table = pa.concat_tables([member_dfs[name] for name in names])
+        df_full = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
+        if typed:
+            apply_schema(df_full)
+        _type_df(df_full, numeric_cols=numeric_cols)
+        return df_full
+
+    dfs = []
+    for name in names:
+        df = member_dfs[name]
+        has_all_cols = df.shape[1] == len(columns)
+        if not has_all_cols and not cols_are_optional:
+            file_issues.append(name)
+
+        if has_all_cols or cols_are_optional:
+            dfs.append(df)
+    if len(file_issues) > 0:
+        logger.debug('Done reading. Had %s issues. Could not read files : %s', len(file_issues), file_issues)
+    if not dfs:
+        return _empty_frame(columns, numeric_cols, typed)
+
+    df_full = concat_typed(dfs) if typed else pd.concat(dfs, ignore_index=True)  # type: ignore
     df_full: pd.DataFrame
 
-    numeric_cols = [] if numeric_cols is None else numeric_cols
     _type_df(df_full, numeric_cols=numeric_cols)
-    df_full = df_full.reset_index()[columns]
+    df_full = df_full[columns]
 
     return df_full
 
 
+def iter_ipe(ipe_zip_path: Union[str, Path],
+             columns: List[str],
+             chunksize: int = CHUNKSIZE,
+             numeric_cols: List[str] = None,
+             cols_are_optional: bool = True,
+             typed: bool = True,
+             filters: Optional[List[Filter]] = None,
+             members: Optional[List[str]] = None,
+             ) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Parcours les fichiers IPE de l'archive par morceaux d'au plus `chunksize` lignes, pour agréger en mémoire
+    constante.
+    ```
+        counts = collections.Counter()
+        for member, chunk in iter_ipe(path, columns=['EtatImmeuble']):
+            counts.update(chunk['EtatImmeuble'].value_counts().to_dict())
+    ```
+
+    Args:
+        ipe_zip_path: Chemin vers l'archive
+        columns: Colonnes à extraire. Chaque morceau a toutes ces colonnes, éventuellement vides.
+        chunksize: Nombre maximal de lignes par morceau
+        numeric_cols: Colonnes numériques hors du registre des schémas
+        cols_are_optional: Si faux, ignore les fichiers où il manque des colonnes.
+        typed: Type les colonnes standard selon le registre des schémas (voir `ipe.schema`).
+        filters: Filtres `(colonne, opérateur, valeur)`, voir `ipe.filters`. Les morceaux vides après filtrage
+            ne sont pas renvoyés.
+        members: Ne parcours que ces fichiers de l'archive. Par défaut, tous les fichiers IPE.
+
+    Yields:
+        Le nom du fichier dans l'archive et un morceau de ce fichier.
+    """
+    numeric_cols = [] if numeric_cols is None else numeric_cols
+    filters = check_filters(filters)
+    read_cols = columns + [col for col in filter_columns(filters) if col not in columns]
+    index = build_index(ipe_zip_path)
+    names = [name for name in index.members_with(columns, all_columns=not cols_are_optional)
+             if member_can_match(index.members[name], filters) and (members is None or name in members)]
+    file_issues = [name for name in index.members if name not in names and (members is None or name in members)]
+
+    encodings = load_encoding_cache()
+    try:
+        with zipfile.ZipFile(ipe_zip_path) as z:
+            for name in misc.make_iterator(names, low_bound=1, desc='Reading IPE'):
+                encoding = member_encoding(z, name, cache=encodings)
+                with z.open(name, 'r') as f:
+                    header = index.members[name]
+                    for chunk in _iter_single_ipe_file(f, chunksize, cols=read_cols, encoding=encoding, name=name,
+                                                       sep=header.separator, typed=typed, version=header.version):
+                        if not all(col in chunk.columns for col in columns) and not cols_are_optional:
+                            file_issues.append(name)
+                            break
+                        chunk = filter_frame(chunk, filters)
+                        if filters and chunk.empty:
+                            continue
+                        chunk = chunk.reindex(columns=columns)
+                        _type_df(chunk, numeric_cols=numeric_cols)
+                        yield name, chunk
+    finally:
+        save_encoding_cache(encodings)
+        if len(file_issues) > 0:
+            logger.debug('Done reading. Had %s issues. Could not read files : %s', len(file_issues), file_issues)
+
+
 def _read_all_ipe(columns: List[str], numeric_cols: List[str] = None, cols_are_optional: bool = True,
                   _test_nrows: int = None
                   ):
@@ -118,6 +485,7 @@ def _read_all_ipe(columns: List[str], numeric_cols: List[str] = None, cols_are_o
     - Les cas où il n'a pas réussi a trouver le formattage
     """
     logging.basicConfig(level=logging.INFO)
+    encodings = load_encoding_cache()
     with zipfile.ZipFile(pth.specific_datapath('ipe') / 'IPE_t1_2021_corrige.zip') as z:
         file_issues = []
         dfs = []
@@ -126,8 +494,9 @@ def _read_all_ipe(columns: List[str], numeric_cols: List[str] = None, cols_are_o
             # for name in z.namelist():
             ext = name[-3:]
             if ext == 'csv':
+                encoding = member_encoding(z, name, cache=encodings)
                 with z.open(name, 'r') as f:
-                    df = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows)
+                    df = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows, encoding=encoding, name=name)
                     # dfs[-1] = dfs[-1].drop_duplicates(subset='ReferencePM')
                     has_all_cols = df.shape[1] == len(columns)
                     if not has_all_cols:
@@ -135,6 +504,7 @@ def _read_all_ipe(columns: List[str], numeric_cols: List[str] = None, cols_are_o
                     if has_all_cols or cols_are_optional:
                         dfs.append(df)
         logging.info('Done reading. Had %s issues. Could not read files : %s', len(file_issues), file_issues)
+    save_encoding_cache(encodings)
 
     df_full = pd.concat(dfs)  # type: ignore
     df_full: pd.DataFrame
@@ -147,17 +517,19 @@ def _read_all_ipe(columns: List[str], numeric_cols: List[str] = None, cols_are_o
 
 
 def read_single_ipe(ipe_name: str, columns: List[str], numeric_cols: List[str] = None,
-                    zipfilepath: Optional[Union[str, Path]] = None, _test_nrows: int = None
+                    zipfilepath: Optional[Union[str, Path]] = None, _test_nrows: int = None, typed: bool = True
                     ):
     """Lis un IPE spécifique dans l'archive IPE_t1_2021_corrige.zip si aucune autre n'est spécifiée.
 
     Args:
-        ipe_name (str): nom du fichier à lire
+        ipe_name (str): nom du fichier à lire, quel que soit son dossier dans l'archive, ou motif `fnmatch`
         columns (List[str]): Colonnes à garder
-        numeric_cols (List[str], optional): Colonnes contenant des nombres. Defaults to None.
+        numeric_cols (List[str], optional): Colonnes contenant des nombres, hors du registre des schémas.
+            Defaults to None.
         zipfilepath (Optional[Union[str, Path]], optional): chemin vers une archive autre que
         'IPE_t1_2021_corrige.zip. Defaults to None.
         _test_nrows (int, optional): Valeur de test. Limite la lecture de l'IPE à _test_nrows lignes. Defaults to None.
+        typed (bool, optional): Type les colonnes standard selon le registre des schémas. Defaults to True.
 
     Returns:
         [type]: [description]
@@ -166,9 +538,14 @@ def read_single_ipe(ipe_name: str, columns: List[str], numeric_cols: List[str] =
         zipfilepath = pth.specific_datapath('ipe') / 'IPE_t1_2021_corrige.zip'
     zipfilepath = Path(zipfilepath)
 
+    encodings = load_encoding_cache()
     with zipfile.ZipFile(zipfilepath) as z:
-        with z.open(f'IPE_t1_2021/{ipe_name}', 'r') as f:
-            df = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows)
+        name = _resolve_member(z, ipe_name)
+        encoding = member_encoding(z, name, cache=encodings)
+        with z.open(name, 'r') as f:
+            df = _read_single_ipe_file(f, cols=columns, nrows=_test_nrows, encoding=encoding, name=name,
+                                       typed=typed, version=member_version(name))
+    save_encoding_cache(encodings)
 
     numeric_cols = [] if numeric_cols is None else numeric_cols
     _type_df(df, numeric_cols=numeric_cols)
@@ -0,0 +1,164 @@
+"""
+Registre des types des colonnes standard des IPE, par version du format Interop'Fibre.
+
+Les colonnes sont typées dès la lecture de chaque fichier : énumérations en catégories, effectifs en entiers,
+coordonnées en flottants et dates en `datetime64`. Les colonnes hors registre restent des chaines.
+"""
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+CATEGORY = 'category'
+INTEGER = 'Int64'
+FLOAT = 'float64'
+DATE = 'datetime64[ns]'
+STRING = 'str'
+
+DATE_FORMAT = '%Y%m%d'
+DEFAULT_VERSION = '3.0'
+
+_COMMON = {
+    'EtatImmeuble': CATEGORY,
+    'TypeImmeuble': CATEGORY,
+    'TypeProjection': CATEGORY,
+    'TypeZone': CATEGORY,
+    'EtatPM': CATEGORY,
+    'TypeEmplacementPM': CATEGORY,
+    'CodeL331': CATEGORY,
+    'CommuneImmeuble': CATEGORY,
+    'CodeInseeImmeuble': CATEGORY,
+    'CodePostalImmeuble': CATEGORY,
+    'TypeVoieImmeuble': CATEGORY,
+    'NombreLogementsAdresseIPE': INTEGER,
+    'NombreLogementsImmeuble': INTEGER,
+    'CoordonneeImmeubleX': FLOAT,
+    'CoordonneeImmeubleY': FLOAT,
+    'CoordonneePMX': FLOAT,
+    'CoordonneePMY': FLOAT,
+    'DateDebutAcceptationCmdAcces': DATE,
+    'DateMiseEnServiceCommercialeImmeuble': DATE,
+    'DateInstallationPM': DATE,
+    'DateRaccordabiliteImmeuble': DATE,
+    }
+
+SCHEMAS: Dict[str, Dict[str, str]] = {
+    '2.2': dict(_COMMON),
+    '3.0': {**_COMMON, 'DateCompletudeHabitation': DATE, 'CategorieImmeuble': CATEGORY},
+    }
+
+
+def register_schema(version: str, types: Dict[str, str], base: Optional[str] = DEFAULT_VERSION):
+    """Ajoute (ou complète) le schéma d'une version du format.
+
+    Args:
+        version (str): version du format, `3.0` par exemple
+        types (Dict[str, str]): type par colonne (`category`, `Int64`, `float64`, `datetime64[ns]` ou `str`)
+        base (Optional[str], optional): version dont on part. Defaults to DEFAULT_VERSION.
+    """
+    SCHEMAS[version] = {**SCHEMAS.get(base, {}), **SCHEMAS.get(version, {}), **types}
+
+
+def column_types(version: Optional[str] = None) -> Dict[str, str]:
+    """Types des colonnes standard d'une version du format.
+
+    Args:
+        version (Optional[str], optional): version du format. Defaults to None (dernière version).
+
+    Returns:
+        Dict[str, str]: type par colonne
+    """
+    return SCHEMAS.get(version if version is not None else DEFAULT_VERSION, SCHEMAS[DEFAULT_VERSION])
+
+
+def read_dtypes(columns: Optional[List[str]], version: Optional[str] = None) -> Dict[str, str]:
+    """Types à donner à `pd.read_csv` : les catégories sont construites à la lecture, le reste est lu en chaine
+    puis converti par `apply_schema`.
+
+    Args:
+        columns (Optional[List[str]]): colonnes lues
+        version (Optional[str], optional): version du format. Defaults to None.
+
+    Returns:
+        Dict[str, str]: type par colonne
+    """
+    types = column_types(version)
+    columns = list(types) if columns is None else columns
+    return {column: CATEGORY if types.get(column) == CATEGORY else STRING for column in columns}
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    retry = dates.isna() & values.notna()
+    if retry.any():
+        dates[retry] = pd.to_datetime(values[retry], dayfirst=True, errors='coerce', format='mixed')
+    return dates
+
+
+def apply_schema(df: pd.DataFrame, version: Optional[str] = None,
+                 numeric_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Type les colonnes d'un fichier IPE selon le registre. Les valeurs non convertibles deviennent nulles.
+
+    Args:
+        df (pd.DataFrame): fichier lu en chaines
+        version (Optional[str], optional): version du format. Defaults to None.
+        numeric_cols (Optional[List[str]], optional): colonnes hors registre à convertir en nombre.
+                Defaults to None.
+
+    Returns:
+        pd.DataFrame: le même DF, typé
+    """
+    types = column_types(version)
+    for column in df.columns:
+        kind = types.get(column)
+        if numeric_cols is not None and column in numeric_cols and kind not in (INTEGER, FLOAT):
+            kind = FLOAT
+        if kind is None or str(df[column].dtype) == kind:
+            continue
+
+        if kind == CATEGORY:
+            df[column] = df[column].astype(CATEGORY)
+        elif kind == DATE:
+            df[column] = _to_datetime(df[column])
+        else:
+            values = df[column]
+            if kind == FLOAT and values.dtype == object:
+                values = values.str.replace(',', '.', regex=False)
+            numbers = pd.to_numeric(values, errors='coerce')
+            if kind == INTEGER:
+                # `astype('Int64')` refuse les décimales : une valeur non entière devient nulle, comme une valeur
+                # non convertible
+                numbers = numbers.where(numbers.isna() | (numbers % 1 == 0))
+            df[column] = numbers.astype(kind)
+    return df
+
+
+def concat_typed(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatène des fichiers typés en gardant les catégories (pandas repasse en `object` les catégories qui
+    diffèrent d'un fichier à l'autre).
+
+    Args:
+        dfs (List[pd.DataFrame]): fichiers typés par `apply_schema`
+
+    Returns:
+        pd.DataFrame: la concaténation
+    """
+    columns = {column for df in dfs for column in df.columns}
+    for column in columns:
+        parts = [df[column] for df in dfs if column in df.columns]
+        dtype = parts[0].dtype
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            dtype = pd.CategoricalDtype(union_categoricals([part.values for part in parts],
+                                                           ignore_order=True).categories)
+            for df in dfs:
+                if column in df.columns:
+                    df[column] = df[column].cat.set_categories(dtype.categories)
+        elif any(part.dtype != dtype for part in parts):
+            continue
+
+        for df in dfs:
+            if column not in df.columns:
+                df[column] = pd.Series(index=df.index, dtype=dtype)
+    return pd.concat(dfs, ignore_index=True)
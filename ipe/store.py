@@ -0,0 +1,235 @@
+"""
+Ingestion des archives IPE en jeu de données Parquet partitionné.
+
+L'archive est décompressée et lue une seule fois. Toutes les colonnes sont écrites dans
+`{data}/ipe/store/<archive>-<haché>/operateur=<code>/departement=<code>/<fichier>-<crc>-<i>.parquet`, où le haché
+est celui du chemin complet de l'archive.
+Un manifeste garde la clef de l'archive et le CRC de chaque fichier : une nouvelle ingestion de l'archive mise à
+jour ne relis que les fichiers dont le CRC a changé.
+
+`parse_ipe` lis ensuite directement les colonnes demandées dans le jeu de données, s'il est à jour.
+"""
+import logging
+import os
+import zipfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+
+from .. import misc
+from .. import pathtools as pth
+from .encoding import load_encoding_cache
+from .encoding import member_encoding
+from .encoding import save_encoding_cache
+from .filters import DEPARTMENT_COLUMN
+from .filters import EXCLUSIVE_OPERATORS
+from .filters import OPERATOR_COLUMN
+from .filters import Filter
+from .filters import check_filters
+from .filters import filter_expression
+from .filters import filter_table
+from .filters import typed_filter_columns
+from .index import UNKNOWN
+from .index import archive_key
+from .index import member_operator
+from .rwp import _ipe_members
+from .rwp import _read_member
+
+logger = logging.getLogger(__name__)
+
+MEMBER_COLUMN = '_member'
+PARTITIONING = pa_ds.partitioning(pa.schema([('operateur', pa.string()), ('departement', pa.string())]),
+                                  flavor='hive')
+
+
+def store_path(ipe_zip_path: Union[str, Path]) -> Path:
+    """Dossier du jeu de données ingéré pour une archive.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+
+    Returns:
+        Path: le dossier, qu'il existe ou non
+    """
+    # Deux archives de même nom dans des dossiers différents (une par trimestre...) ont chacune leur jeu de données
+    path = Path(ipe_zip_path)
+    return pth.specific_datapath('ipe') / 'store' / f'{path.stem}-{pth.hash_data(os.path.realpath(path))[:8]}'
+
+
+def _departements(df: pd.DataFrame) -> pd.Series:
+    if 'CodeInseeImmeuble' in df.columns:
+        insee = df['CodeInseeImmeuble']
+    elif 'CodeAdresseImmeuble' in df.columns:
+        insee = df['CodeAdresseImmeuble'].str[:5]
+    else:
+        return pd.Series(UNKNOWN, index=df.index)
+
+    dpt = insee.str[:2].where(~insee.str[:2].isin(['97', '98']), insee.str[:3])
+    return dpt.fillna(UNKNOWN)
+
+
+def _load_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    manifest_path = path / 'manifest.pkl'
+    return misc.load(filepath=manifest_path) if manifest_path.exists() else None
+
+
+def _remove_member_files(path: Path, files: List[str]):
+    for file in files:
+        (path / file).unlink(missing_ok=True)
+
+
+def ingest_ipe(ipe_zip_path: Union[str, Path], force: bool = False) -> Path:
+    """Ingère une archive IPE en jeu de données Parquet, partitionné par opérateur et département.
+    Seuls les fichiers nouveaux ou dont le CRC a changé depuis la dernière ingestion sont lus.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+        force (bool, optional): Ré-ingère toute l'archive. Defaults to False.
+
+    Returns:
+        Path: Le dossier du jeu de données
+    """
+    path = store_path(ipe_zip_path)
+    manifest = None if force else _load_manifest(path)
+    if manifest is None:
+        manifest = {'archive_key': None, 'members': {}}
+    previous = manifest['members']
+
+    encodings = load_encoding_cache()
+    with zipfile.ZipFile(ipe_zip_path) as z:
+        key = archive_key(z)
+        if manifest['archive_key'] == key:
+            logger.debug('%s is already ingested in %s', ipe_zip_path, path)
+            return path
+
+        names = _ipe_members(z)
+        for name in set(previous) - set(names):
+            _remove_member_files(path, previous.pop(name)['files'])
+
+        to_read = [name for name in names if name not in previous or previous[name]['crc'] != z.getinfo(name).CRC]
+        logger.info('Ingesting %s of %s files from %s', len(to_read), len(names), ipe_zip_path)
+        for name in misc.make_iterator(to_read, low_bound=1, desc='Ingesting IPE'):
+            info = z.getinfo(name)
+            if name in previous:
+                _remove_member_files(path, previous.pop(name)['files'])
+
+            encoding = member_encoding(z, name, cache=encodings)
+            df, _ = _read_member(ipe_zip_path, name, columns=None, encoding=encoding)
+            columns = list(df.columns)
+            df[MEMBER_COLUMN] = name
+            df['operateur'] = member_operator(name)
+            df['departement'] = _departements(df)
+
+            stem = Path(name).stem
+            pq.write_to_dataset(pa.Table.from_pandas(df, preserve_index=False),
+                                root_path=str(path),
+                                partition_cols=['operateur', 'departement'],
+                                basename_template=f'{stem}-{info.CRC:08x}-{{i}}.parquet',
+                                existing_data_behavior='overwrite_or_ignore')
+            files = [str(file.relative_to(path)) for file in path.glob(f'*/*/{stem}-{info.CRC:08x}-*.parquet')]
+            previous[name] = {'crc': info.CRC, 'columns': columns, 'encoding': encoding, 'files': files}
+    save_encoding_cache(encodings)
+
+    manifest['archive_key'] = key
+    manifest['members'] = {name: previous[name] for name in names}
+    misc.save(data=manifest, filepath=path / 'manifest.pkl')
+    return path
+
+
+def is_ingested(ipe_zip_path: Union[str, Path]) -> bool:
+    """Vrai ssi l'archive a été ingérée, et n'a pas changé depuis.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive
+
+    Returns:
+        bool: Vrai ssi le jeu de données est à jour
+    """
+    manifest = _load_manifest(store_path(ipe_zip_path))
+    if manifest is None:
+        return False
+    with zipfile.ZipFile(ipe_zip_path) as z:
+        return manifest['archive_key'] == archive_key(z)
+
+
+def _manifest_or_raise(ipe_zip_path: Union[str, Path]) -> Dict[str, Any]:
+    manifest = _load_manifest(store_path(ipe_zip_path))
+    if manifest is None:
+        raise FileNotFoundError(f'{ipe_zip_path} has not been ingested. Run ingest_ipe first.')
+    return manifest
+
+
+def store_dataset(ipe_zip_path: Union[str, Path], members: Optional[List[str]] = None) -> pa_ds.Dataset:
+    """Jeu de données Arrow de l'archive ingérée : toutes les colonnes en chaines, plus `_member`, `operateur` et
+    `departement`. Rien n'est lu avant le parcours du jeu de données.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive ingérée
+        members (Optional[List[str]], optional): Fichiers IPE à inclure. Defaults to None (tous).
+
+    Returns:
+        pa_ds.Dataset: le jeu de données
+    """
+    path = store_path(ipe_zip_path)
+    manifest = _manifest_or_raise(ipe_zip_path)
+    ingested = manifest['members']
+    all_columns = sorted({column for member in ingested.values() for column in member['columns']})
+    schema = pa.schema([(column, pa.string()) for column in all_columns] + [(MEMBER_COLUMN, pa.string())]
+                       + list(PARTITIONING.schema))
+
+    names = ingested if members is None else members
+    files = [str(path / file) for name in names for file in ingested[name]['files']]
+    return pa_ds.dataset(files, format='parquet', schema=schema, partitioning=PARTITIONING,
+                         partition_base_dir=str(path))
+
+
+def read_store(ipe_zip_path: Union[str, Path],
+               columns: List[str],
+               cols_are_optional: bool = True,
+               filters: Optional[List[Filter]] = None,
+               ) -> pd.DataFrame:
+    """Lis les colonnes demandées dans le jeu de données ingéré. Seuls les fichiers Parquet des fichiers IPE
+    retenus sont ouverts. Dans un même fichier IPE, les lignes sont groupées par partition.
+    Les filtres sont passés au lecteur Parquet : les partitions `operateur` et `departement` écartées ne sont pas
+    lues, et les statistiques des groupes de lignes évitent de décompresser ceux qui ne passent pas.
+
+    Args:
+        ipe_zip_path (Union[str, Path]): chemin vers l'archive ingérée
+        columns (List[str]): Colonnes à extraire
+        cols_are_optional (bool, optional): Si faux, ignore les fichiers où il manque des colonnes.
+                Defaults to True.
+        filters (Optional[List[Filter]], optional): Filtres `(colonne, opérateur, valeur)`, voir `ipe.filters`.
+                Defaults to None.
+
+    Returns:
+        pd.DataFrame: Les colonnes demandées
+    """
+    manifest = _manifest_or_raise(ipe_zip_path)
+    members = manifest['members']
+    all_columns = {column for member in members.values() for column in member['columns']}
+
+    filters = check_filters(filters, store=True)
+    known = all_columns | {OPERATOR_COLUMN, DEPARTMENT_COLUMN}
+    if any(column not in known and op not in EXCLUSIVE_OPERATORS for column, op, _ in filters):
+        return pd.DataFrame(columns=columns)
+    filters = [(column, op, value) for column, op, value in filters if column in known]
+
+    kept = [name for name, member in members.items()
+            if cols_are_optional or all(column in member['columns'] for column in columns)]
+    available = [column for column in columns if column in all_columns]
+    dataset = store_dataset(ipe_zip_path, members=kept)
+    # Les filtres sur des colonnes typées sont appliqués après lecture, une fois ces colonnes converties
+    typed_cols = [column for column in typed_filter_columns(filters) if column in all_columns]
+    table = dataset.to_table(columns=available + [column for column in typed_cols if column not in available],
+                             filter=filter_expression(filters, skip=()))
+    typed = [(column, op, value) for column, op, value in filters if column in typed_cols]
+    table = filter_table(table, typed, skip=()).select(available)
+    return table.to_pandas().reindex(columns=columns)
@@ -1,21 +1,46 @@
 """
 Collection d'outils généraux.
 """
+import functools
+import hashlib
+import inspect
+import logging
 import os
-import pickle
-import random
+import reprlib
 import shutil
 import sys
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
 from typing import Any
+from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Sized
+from typing import Tuple
 from typing import Union
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 import tqdm
 
 from .import pathtools
+from . import filescan
+from . import insee
+from . import serialization
+
+logger = logging.getLogger(__name__)
 
 CuPath = Optional[Union[str, Path]]
 
@@ -35,8 +60,11 @@ def save(
         filename: Optional[str] = None,
         basepath: Optional[Union[str, Path]] = None,
         filepath: Union[str, Path] = None,
+        format: Optional[str] = None,
+        compression: Optional[str] = None,
         ):
-    """Raccourcis pour sauvegarder des données en utilisant pickle.
+    """Raccourcis pour sauvegarder des données. Par défaut, les tableaux numpy sont écrits en `.npy`, et le reste
+    en pickle protocole 5 (voir `serialization`). `format='parquet'` écrit un DataFrame en Parquet.
 
     Args:
         data (Any): Donnée à sauvegarder. 
@@ -45,14 +73,16 @@ def save(
                 alors que filename est spécifié, utilisera {pathtools.data()}. Defaults to None.
         filepath (Union[str, Path], optional): Chemin complet du fichier de sauvegarde. Defaults
                 to None.
+        format (Optional[str], optional): `pickle`, `parquet` ou `npy`. Defaults to None (selon la donnée).
+        compression (Optional[str], optional): `zstd` ou `lz4`. Defaults to None.
     """
     path = _clean_path(filepath, basepath, filename)
-    with open(str(path), "wb") as f:
-        pickle.dump(data, f)
+    serialization.save(data, path, format=format, compression=compression)
 
 
-def load(filepath: CuPath = None, filename: CuPath = None, base_path: CuPath = None):
-    """Raccourcis pour charger des données en utilisant pickle.
+def load(filepath: CuPath = None, filename: CuPath = None, base_path: CuPath = None, mmap: bool = False):
+    """Raccourcis pour charger des données sauvegardées par `save`, ou en pickle. Le format est reconnu
+    automatiquement.
 
     Args:
         filename (Optional[str], optional): Nom de fichier. Defaults to None.
@@ -60,10 +90,152 @@ def load(filepath: CuPath = None, filename: CuPath = None, base_path: CuPath = N
                 alors que filename est spécifié, utilisera {pathtools.data()}. Defaults to None.
         filepath (Union[str, Path], optional): Chemin complet du fichier de sauvegarde. Defaults
                 to None.
+        mmap (bool, optional): Projette en mémoire les tableaux des fichiers non compressés au lieu de les
+                lire. Ils sont alors en lecture seule. Defaults to False.
     """
     path = _clean_path(filepath, base_path, filename)
-    with open(str(path), "rb") as f:
-        return pickle.load(f)
+    return serialization.load(path, mmap=mmap)
+
+
+def _source_key(func: Callable, version: Optional[str]) -> str:
+    if version is not None:
+        return f'v{version}'
+    try:
+        source = inspect.getsource(func).encode('UTF8')
+    except (OSError, TypeError):  # fonction définie dans un interpréteur
+        source = func.__code__.co_code
+    return hashlib.md5(source).hexdigest()[:12]
+
+
+def _arguments_key(arguments: dict) -> str:
+    return pathtools.hash_data(arguments)
+
+
+def _evict(folder: Path, max_size: int):
+    # Supprime les résultats les moins récemment utilisés. Un autre processus peut supprimer les mêmes fichiers.
+    entries = []
+    for entry in os.scandir(folder):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.is_file() and not entry.name.endswith('.building'):
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def memoize(func: Optional[Callable] = None,
+            version: Optional[str] = None,
+            ignore: Sequence[str] = (),
+            max_size_mb: Optional[float] = None,
+            folder: CuPath = None,
+            format: str = 'pickle',
+            compression: Optional[str] = None,
+            ) -> Callable:
+    """Met en cache sur disque les résultats d'une fonction, dans `data/tmp/memoize/<module>.<fonction>/`.
+    ```
+        @misc.memoize
+        def coverage(df: pd.DataFrame, year: int) -> pd.DataFrame: ...
+
+        @misc.memoize(version='2', ignore=['tool'], max_size_mb=2048, compression='zstd')
+        def fetch_buildings(tool: Tool, department: str) -> pd.DataFrame: ...
+
+        coverage(df, 2021)          # calcule, puis lit le cache
+        coverage.refresh(df, 2021)  # recalcule et remplace le cache
+        coverage.bypass(df, 2021)   # calcule sans lire ni écrire le cache
+    ```
+    La clef d'un résultat est le nom qualifié de la fonction, son code source (ou `version` si renseignée), et un
+    haché des arguments, valeurs par défaut comprises. Les résultats sont écrits par `save`, dans un fichier
+    temporaire renommé à la fin de l'écriture : plusieurs processus peuvent utiliser le même cache, au pire ils
+    calculent tous les deux un résultat manquant. Les fichiers n'ont pas d'extension : `load` reconnait le format
+    à la lecture.
+
+    Args:
+        func (Optional[Callable], optional): Fonction à mettre en cache. Defaults to None (décorateur avec
+                paramètres).
+        version (Optional[str], optional): Version de la fonction. Si renseignée, remplace le code source dans la
+                clef : modifier la fonction sans changer la version garde le cache. Defaults to None.
+        ignore (Sequence[str], optional): Arguments exclus de la clef (connexions, niveau de log...). Defaults
+                to ().
+        max_size_mb (Optional[float], optional): Taille maximale du cache de la fonction. Au-delà, les résultats
+                les moins récemment utilisés sont supprimés. Defaults to None (pas de limite).
+        folder (CuPath, optional): Dossier du cache. Defaults to None (`pathtools.tmp_path() / 'memoize'`).
+        format (str, optional): Format d'écriture, voir `save`. Defaults to 'pickle', qui garde tous les types
+                pandas.
+        compression (Optional[str], optional): Compression, voir `save`. Defaults to None.
+
+    Returns:
+        Callable: la fonction décorée
+    """
+    if func is None:
+        return functools.partial(memoize, version=version, ignore=ignore, max_size_mb=max_size_mb, folder=folder,
+                                 format=format, compression=compression)
+
+    signature = inspect.signature(func)
+    name = f'{func.__module__}.{func.__qualname__}'.replace('<', '').replace('>', '')
+    source_key = _source_key(func, version)
+
+    def _folder() -> Path:
+        return (Path(folder) if folder is not None else pathtools.tmp_path() / 'memoize') / name
+
+    def cache_path(*args, **kwargs) -> Path:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {key: value for key, value in bound.arguments.items() if key not in ignore}
+        return _folder() / f'{source_key}_{_arguments_key(arguments)}'
+
+    def _store(path: Path, result: Any):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        building = path.with_name(f'{path.name}.{uuid.uuid4().hex}.building')
+        try:
+            save(data=result, filepath=building, format=format, compression=compression)
+            os.replace(building, path)
+        except OSError as e:  # Windows : le fichier est ouvert par un autre processus
+            logger.debug('Could not write the cached result %s: %s', path, e)
+            building.unlink(missing_ok=True)
+            return
+        if max_size_mb is not None:
+            _evict(path.parent, int(max_size_mb * 1024 ** 2))
+
+    def refresh(*args, **kwargs) -> Any:
+        result = func(*args, **kwargs)
+        _store(cache_path(*args, **kwargs), result)
+        return result
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> Any:
+        path = cache_path(*args, **kwargs)
+        try:
+            result = load(filepath=path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:  # Fichier tronqué, ou écrit par une version incompatible
+            logger.warning('Could not read the cached result %s, computing it again: %s', path, e)
+        else:
+            try:
+                os.utime(path)  # Récemment utilisé, pour l'éviction
+            except OSError:
+                pass
+            logger.debug('Loaded %s from %s', name, path)
+            return result
+        return refresh(*args, **kwargs)
+
+    def clear():
+        shutil.rmtree(_folder(), ignore_errors=True)
+
+    wrapper.cache_path = cache_path
+    wrapper.refresh = refresh
+    wrapper.bypass = func
+    wrapper.clear = clear
+    return wrapper
 
 
 def make_iterator(
@@ -97,6 +269,221 @@ def make_iterator(
         return iterator
 
 
+BACKENDS = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+
+
+@dataclass
+class ItemError:
+    """Erreur levée par `func` sur un élément de `parallel_map`."""
+    index: int
+    item: str
+    error: str
+    traceback: str
+
+
+class ParallelMapError(Exception):
+    """Des éléments de `parallel_map` ont échoué. `results` contient None à la place de leurs résultats."""
+
+    def __init__(self, errors: List[ItemError], results: Optional[List[Any]] = None):
+        self.errors = errors
+        self.results = results
+        super().__init__(_error_report(errors))
+
+
+def _error_report(errors: List[ItemError], limit: int = 5) -> str:
+    lines = [f'{len(errors)} item(s) failed:']
+    lines += [f'  #{error.index} {error.item}: {error.error}' for error in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f'  ... and {len(errors) - limit} more')
+    if errors:
+        lines.append(f'First traceback:\n{errors[0].traceback}')
+    return '\n'.join(lines)
+
+
+def _run_chunk(func: Callable, start: int, chunk: List[Any]) -> List[Tuple[bool, Any]]:
+    # Exécuté dans un processus ou un fil de travail : une erreur ne fait échouer que son élément
+    outcomes = []
+    for offset, item in enumerate(chunk):
+        try:
+            outcomes.append((True, func(item)))
+        except Exception as e:
+            outcomes.append((False, ItemError(start + offset, reprlib.repr(item), repr(e), traceback.format_exc())))
+    return outcomes
+
+
+def _result_size(value: Any) -> int:
+    # Estimation rapide, sans parcourir les objets Python
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pa.Table, pa.RecordBatch, pa.Array, pa.ChunkedArray)):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def iter_parallel_map(
+        func: Callable,
+        items: Iterable,
+        backend: str = 'process',
+        workers: Optional[int] = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+        errors: str = 'raise',
+        max_memory_mb: Optional[float] = None,
+        low_bound: int = 100,
+        size: Optional[int] = None,
+        desc: str = "",
+        ) -> Iterator[Any]:
+    """Comme `parallel_map`, mais donne les résultats au fur et à mesure. `items` est consommé au fil de l'eau :
+    ce peut être un générateur.
+
+    Voir `parallel_map` pour les arguments.
+
+    Yields:
+        Iterator[Any]: les résultats, None pour les éléments en erreur
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend!r}, expected one of {list(BACKENDS)}')
+    if errors not in ('raise', 'ignore'):
+        raise ValueError(f"Unknown errors mode {errors!r}, expected 'raise' or 'ignore'")
+    if size is None and isinstance(items, Sized):
+        size = len(items)
+    workers = workers or os.cpu_count() or 1
+    max_tasks = 2 * workers
+    max_memory = None if max_memory_mb is None else max_memory_mb * 1024 ** 2
+
+    iterator = iter(items)
+    progress = tqdm.tqdm(total=size, desc=desc, leave=False) if size is not None and size > low_bound else None
+    failures: List[ItemError] = []
+    pending = {}
+    done = {}  # résultats arrivés avant ceux des éléments précédents, si ordered
+    buffered = 0
+    submitted = 0
+    next_start = 0
+    exhausted = False
+
+    with BACKENDS[backend](max_workers=workers) as executor:
+        try:
+            while True:
+                # Limite de mémoire : plus de nouvelle tâche tant que les résultats en attente sont trop gros
+                while not exhausted and len(pending) < max_tasks and (max_memory is None or buffered < max_memory):
+                    chunk = list(islice(iterator, chunksize))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    pending[executor.submit(_run_chunk, func, submitted, chunk)] = submitted
+                    submitted += len(chunk)
+                if not pending:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    start = pending.pop(future)
+                    values = []
+                    for ok, value in future.result():
+                        if not ok:
+                            failures.append(value)
+                        values.append(value if ok else None)
+                    if progress is not None:
+                        progress.update(len(values))
+                    if not ordered:
+                        yield from values
+                        continue
+                    chunk_size = sum(_result_size(value) for value in values)
+                    done[start] = (values, chunk_size)
+                    buffered += chunk_size
+
+                while next_start in done:
+                    values, chunk_size = done.pop(next_start)
+                    buffered -= chunk_size
+                    next_start += len(values)
+                    yield from values
+        finally:
+            for future in pending:
+                future.cancel()
+            if progress is not None:
+                progress.close()
+
+    if failures:
+        failures.sort(key=lambda error: error.index)
+        if errors == 'raise':
+            raise ParallelMapError(failures)
+        logger.warning(_error_report(failures))
+
+
+def parallel_map(
+        func: Callable,
+        items: Iterable,
+        backend: str = 'process',
+        workers: Optional[int] = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+        errors: str = 'raise',
+        max_memory_mb: Optional[float] = None,
+        low_bound: int = 100,
+        size: Optional[int] = None,
+        desc: str = "",
+        ) -> List[Any]:
+    """Applique `func` à chaque élément de `items`, en parallèle.
+    ```
+        departments = parallel_map(analyse_department, codes, workers=8, desc='Départements')
+        communes = parallel_map(fetch_commune, insee_codes, backend='thread', chunksize=50)
+    ```
+    Avec le backend `process`, `func` et les éléments doivent pouvoir être envoyés aux processus (fonction
+    définie au niveau d'un module, pas dans un notebook ni une lambda). Le backend `thread` convient aux
+    fonctions qui attendent (requêtes en base, lecture de fichiers) ou qui libèrent le GIL (numpy, Arrow).
+
+    Une erreur sur un élément n'interrompt pas les autres. À la fin, les erreurs sont rapportées ensemble.
+
+    Args:
+        func (Callable): Fonction appliquée à chaque élément
+        items (Iterable): Éléments
+        backend (str, optional): `process` ou `thread`. Defaults to 'process'.
+        workers (Optional[int], optional): Nombre de processus ou de fils. Defaults to None (nombre de coeurs).
+        chunksize (int, optional): Nombre d'éléments envoyés ensemble à un processus. À augmenter quand `func`
+                est rapide. Defaults to 1.
+        ordered (bool, optional): Résultats dans l'ordre des éléments. Sinon, dans l'ordre où ils sont
+                calculés. Defaults to True.
+        errors (str, optional): `raise` lève `ParallelMapError` à la fin, avec le rapport d'erreurs et les
+                autres résultats. `ignore` écrit le rapport dans le journal. Le résultat d'un élément en erreur est
+                None. Defaults to 'raise'.
+        max_memory_mb (Optional[float], optional): Taille maximale des résultats calculés mais pas encore rendus
+                (en attente de ceux des éléments précédents). Au-delà, aucune nouvelle tâche n'est lancée.
+                Utile avec `iter_parallel_map`. Defaults to None.
+        low_bound (int, optional): Nombre minimal d'éléments pour afficher la progression, comme
+                `make_iterator`. Defaults to 100.
+        size (Optional[int], optional): Nombre d'éléments, si `items` n'est pas un Sized. Defaults to None.
+        desc (str, optional): Description TQDM. Defaults to "".
+
+    Returns:
+        List[Any]: les résultats
+    """
+    results = []
+    try:
+        for result in iter_parallel_map(func, items, backend=backend, workers=workers, chunksize=chunksize,
+                                        ordered=ordered, errors=errors, max_memory_mb=max_memory_mb,
+                                        low_bound=low_bound, size=size, desc=desc):
+            results.append(result)
+    except ParallelMapError as e:
+        e.results = results
+        raise
+    return results
+
+
+_FILE_INDEXES: Dict[str, filescan.FileIndex] = {}
+
+
+def _file_index(rootpath: Union[str, Path], refresh: bool) -> filescan.FileIndex:
+    # Un index par racine et par processus, gardé en mémoire. Le rafraichir ne relis que les dossiers modifiés.
+    key = str(Path(rootpath))
+    if key not in _FILE_INDEXES:
+        _FILE_INDEXES[key] = filescan.FileIndex(rootpath)
+    elif refresh:
+        _FILE_INDEXES[key].refresh()
+    return _FILE_INDEXES[key]
+
+
 def first_file(rootpath: Union[str, Path]) -> Path:
     """Donne le premier fichier d'une arborescence, en descendant en profondeur d'abord.
 
@@ -106,46 +493,42 @@ def first_file(rootpath: Union[str, Path]) -> Path:
     Returns:
         Path: Un chemin vers le fichier
     """
-    iterator = os.walk(rootpath)
-    e = next(iterator)
-    while not e[2]:  # == []:
-        e = next(iterator)
-    return Path(e[0]) / e[2][0]
+    path = next(filescan.iter_files(rootpath), None)
+    if path is None:
+        raise FileNotFoundError(f'No file under {rootpath}')
+    return path
 
 
-def nth_file(rootpath: Union[str, Path], n: int) -> Path:
-    """Donne le n-ieme fichier d'une arborescence, en descendant en profondeur d'abord.
+def nth_file(rootpath: Union[str, Path], n: int, refresh: bool = True) -> Path:
+    """Donne le n-ieme fichier d'une arborescence, en descendant en profondeur d'abord. Utilise l'index de
+    `filescan.FileIndex` : seul le premier appel parcourt toute l'arborescence, les suivants ne relisent que les
+    dossiers modifiés.
 
     Args:
         rootpath (Union[str, Path]): chemin racine de recherche
         n (int): Numéro du fichier à prendre
+        refresh (bool, optional): Relis les dossiers modifiés depuis l'appel précédent. Sinon, l'index en mémoire
+                est utilisé tel quel. Defaults to True.
 
     Returns:
         Path: Un chemin vers le fichier
     """
-    iterator = os.walk(rootpath)
-    e = next(iterator)
-    while not e[2]:  # == []:
-        e = next(iterator)
+    return _file_index(rootpath, refresh)[n]
 
-    return Path(e[0]) / e[2][n]
 
-
-def random_first_file(rootpath: Union[str, Path]) -> Path:
-    """Donne un fichier aléatoire d'une arborescence, en descendant en profondeur d'abord.
+def random_first_file(rootpath: Union[str, Path], refresh: bool = True) -> Path:
+    """Donne un fichier aléatoire d'une arborescence. Utilise l'index de `filescan.FileIndex` : seul le premier
+    appel parcourt toute l'arborescence, les suivants ne relisent que les dossiers modifiés.
 
     Args:
         rootpath (Union[str, Path]): chemin racine de recherche 
+        refresh (bool, optional): Relis les dossiers modifiés depuis l'appel précédent. Sinon, l'index en mémoire
+                est utilisé tel quel. Defaults to True.
 
     Returns:
         Path: Un chemin vers le fichier
     """
-    iterator = os.walk(rootpath)
-    e = next(iterator)
-    while e[2]:  # == []:
-        e = next(iterator)
-
-    return Path(e[0]) / e[2][random.randint(0, len(e[2]))]
+    return _file_index(rootpath, refresh).sample()
 
 
 def iterate_files(rootpath: Union[str, Path]) -> Iterable[Path]:
@@ -160,23 +543,14 @@ def iterate_files(rootpath: Union[str, Path]) -> Iterable[Path]:
     Yields:
         Iterator[Iterable[Path]]: un chemin de fichier
     """
-    iterator = os.walk(rootpath)
-
-    e = next(iterator, None)
-    while e is not None:
-        while e[2]:  # == []:
-            e = next(iterator)
-
-        i = 0
-        while i < len(e[2]):
-            yield Path(e[0]) / e[2][i]
-            i += 1
-        e = next(iterator, None)
+    yield from filescan.iter_files(rootpath)
 
 
 def insee_department_from_city(insee_city: str) -> str:
     """Donne le code INSEE du département à partir du code INSEE d'une ville.
 
+    Pour une colonne entière, voir `insee.department_from_city`.
+
     Args:
         insee_city (str): code insee d'une ville
 
@@ -192,6 +566,7 @@ def insee_department_from_city(insee_city: str) -> str:
 def is_drom(insee_city: Optional[str] = None, insee_region: Optional[str] = None) -> bool:
     """
     Est-ce que le code INSEE de la ville ou de la région correspond à un DROM ?
+    Pour une colonne entière, voir `insee.is_drom`.
 
     Args:
         insee_city: Code INSEE de la ville
@@ -210,6 +585,8 @@ def is_drom(insee_city: Optional[str] = None, insee_region: Optional[str] = None
 def convert_insee_drom_region_to_department(insee_region: str) -> str:
     """
     Convertis le code region des DROM au préfixe de département associé.
+    Pour une colonne entière, voir `insee.convert_drom_region_to_department`.
+
     Args:
         insee_region: Code INSEE de région
 
@@ -217,8 +594,7 @@ def convert_insee_drom_region_to_department(insee_region: str) -> str:
         le préfixe département du code INSEE.
 
     """
-    mapping = {'01': '971', '02': '972', '03': '973', '06': '976'}
-    return mapping[insee_region]
+    return insee.DROM_REGIONS[insee_region]
 
 
 def clear_cache(base_path: Optional[Path] = None):
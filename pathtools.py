@@ -2,13 +2,30 @@
 Outils de manipulation et de gestion de chemin.
 """
 
+import dataclasses
+import datetime
+import decimal
+import enum
 import hashlib
 import os
+import pickle
+import struct
 from pathlib import Path
+from pathlib import PurePath
 from typing import Any
 from typing import Optional
 from typing import Union
 
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
+
 
 def get_tool_path() -> Path:
     """
@@ -91,7 +108,7 @@ def outer_path() -> Path:
 def hashname_from_data(data: Any) -> str:
     """
     Donne le haché des données en string python. Mauvais pour une utilisation classique du haché, mais utile pour des
-    noms de fichier.
+    noms de fichier. La représentation textuelle d'un DataFrame est tronquée : utiliser `hash_data`.
 
     Args:
         data: Données à hacher
@@ -103,6 +120,149 @@ def hashname_from_data(data: Any) -> str:
     return str(hashlib.md5(str(data).encode("UTF8")).hexdigest())
 
 
+def _hasher():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+
+def _frame(hasher, tag: bytes, payload: Union[bytes, memoryview] = b''):
+    # Chaque valeur est préfixée par son type et sa taille : ('ab', 'c') et ('a', 'bc') n'ont pas le même haché
+    hasher.update(tag)
+    hasher.update(struct.pack('<Q', memoryview(payload).nbytes))
+    hasher.update(payload)
+
+
+def _digest(data: Any) -> bytes:
+    hasher = _hasher()
+    _update(hasher, data)
+    return hasher.digest()
+
+
+def _update_arrow(hasher, array: Union[pa.Array, pa.ChunkedArray]):
+    chunks = array.chunks if isinstance(array, pa.ChunkedArray) else [array]
+    _frame(hasher, b'arrow', str(array.type).encode('UTF8'))
+    for chunk in chunks:
+        _frame(hasher, b'chunk', struct.pack('<qq', chunk.offset, len(chunk)))
+        for buffer in chunk.buffers():
+            _frame(hasher, b'buffer', b'' if buffer is None else memoryview(buffer))
+
+
+def _update_pandas(hasher, data: Union[pd.Series, pd.Index]):
+    _frame(hasher, b'dtype', str(data.dtype).encode('UTF8'))
+    if isinstance(data, pdg.GeoSeries):
+        # La projection ne fait pas partie des valeurs
+        _update(hasher, data.crs.to_wkt() if data.crs is not None else None)
+    # pandas hache une colonne d'objets de types mélangés par leur str() : 1 et '1' auraient le même haché
+    hashed = None
+    if data.dtype != object or pd.api.types.infer_dtype(data, skipna=True) in ('string', 'empty'):
+        try:
+            hashed = pd.util.hash_pandas_object(data, index=False).to_numpy()
+        except TypeError:  # objets non hachables par pandas (listes, dictionnaires...)
+            pass
+    if hashed is None:
+        _update(hasher, list(data))
+    else:
+        _frame(hasher, b'values', np.ascontiguousarray(hashed, dtype='<u8').data)
+
+
+def _update(hasher, data: Any):
+    if data is None:
+        _frame(hasher, b'none')
+    elif isinstance(data, (bool, np.bool_)):
+        _frame(hasher, b'bool', b'\x01' if data else b'\x00')
+    elif isinstance(data, enum.Enum):
+        _frame(hasher, b'enum', f'{type(data).__qualname__}.{data.name}'.encode('UTF8'))
+    elif isinstance(data, (int, np.integer)):
+        _frame(hasher, b'int', str(int(data)).encode('ascii'))
+    elif isinstance(data, (float, np.floating)):
+        _frame(hasher, b'float', struct.pack('<d', float(data)))
+    elif isinstance(data, str):
+        _frame(hasher, b'str', data.encode('UTF8', 'surrogatepass'))
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        _frame(hasher, b'bytes', memoryview(data).cast('B'))
+    elif isinstance(data, (decimal.Decimal, complex, datetime.date, datetime.time, datetime.timedelta)):
+        _frame(hasher, type(data).__name__.encode('ascii'), str(data).encode('ascii'))
+    elif isinstance(data, PurePath):
+        _frame(hasher, b'path', data.as_posix().encode('UTF8', 'surrogatepass'))
+    elif isinstance(data, np.ndarray):
+        _frame(hasher, b'ndarray', f'{data.dtype.str}{data.shape}'.encode('ascii'))
+        if data.dtype.hasobject:
+            _update(hasher, data.ravel().tolist())
+        else:
+            _frame(hasher, b'values', np.ascontiguousarray(data).view('u1').data)
+    elif isinstance(data, pd.DataFrame):
+        _frame(hasher, type(data).__name__.encode('ascii'))
+        _update(hasher, list(data.columns))
+        if isinstance(data, pdg.GeoDataFrame):
+            _update(hasher, data._geometry_column_name)
+        _update_pandas(hasher, data.index)
+        for _, column in data.items():
+            _update_pandas(hasher, column)
+    elif isinstance(data, pd.Series):
+        _frame(hasher, b'series')
+        _update(hasher, data.name)
+        _update_pandas(hasher, data.index)
+        _update_pandas(hasher, data)
+    elif isinstance(data, pd.Index):
+        _frame(hasher, b'index')
+        _update_pandas(hasher, data)
+    elif isinstance(data, (pa.Table, pa.RecordBatch)):
+        _frame(hasher, b'table', struct.pack('<Q', data.num_rows))
+        _update(hasher, data.schema.names)
+        for column in data.columns:
+            _update_arrow(hasher, column)
+    elif isinstance(data, (pa.Array, pa.ChunkedArray)):
+        _update_arrow(hasher, data)
+    elif isinstance(data, dict):
+        # Ordre des clefs indifférent
+        items = sorted((_digest(key), _digest(value)) for key, value in data.items())
+        _frame(hasher, b'dict', struct.pack('<Q', len(items)))
+        for key, value in items:
+            hasher.update(key)
+            hasher.update(value)
+    elif isinstance(data, (set, frozenset)):
+        digests = sorted(_digest(item) for item in data)
+        _frame(hasher, b'set', struct.pack('<Q', len(digests)))
+        for digest in digests:
+            hasher.update(digest)
+    elif isinstance(data, (list, tuple)):
+        _frame(hasher, type(data).__name__.encode('ascii'), struct.pack('<Q', len(data)))
+        for item in data:
+            _update(hasher, item)
+    elif dataclasses.is_dataclass(data) and not isinstance(data, type):
+        _frame(hasher, b'dataclass', type(data).__qualname__.encode('UTF8'))
+        for field in dataclasses.fields(data):
+            _update(hasher, field.name)
+            _update(hasher, getattr(data, field.name))
+    else:
+        # Dernier recours : le pickle de l'objet, stable pour une même version des bibliothèques
+        _frame(hasher, b'pickle', pickle.dumps(data, protocol=4))
+
+
+def hash_data(data: Any) -> str:
+    """Haché structurel des données, calculé au fil de l'eau, sans construire de représentation textuelle.
+    ```
+        hash_data({'df': df, 'geo_info': GeoInfo(column='geom', table_path='public.t')})
+    ```
+    - DataFrame, Series, Index : `pd.util.hash_pandas_object`, colonne par colonne, avec les noms et les types ;
+    - tableaux numpy, tableaux et tables Arrow : octets bruts des tampons ;
+    - dict, set (sans ordre), list, tuple et dataclass (comme `GeoInfo`) : récursivement ;
+    - scalaires et chemins : selon leur type et leur valeur.
+
+    Le haché (xxh3 128 bits, ou blake2b si `xxhash` n'est pas installé) ne dépend pas du processus ni de la
+    version de Python : il peut servir de clef de cache. Deux données égales mais représentées différemment (un
+    tableau Arrow découpé autrement, par exemple) peuvent avoir des hachés différents.
+
+    Args:
+        data: Données à hacher
+
+    Returns:
+        str: le haché, en hexadécimal
+    """
+    hasher = _hasher()
+    _update(hasher, data)
+    return hasher.hexdigest()
+
+
 def outer_out_path() -> Path:
     """Chemin vers le dossier {ce fichier}/../../out/. Crée le dossier si nécessaire.
 
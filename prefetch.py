@@ -0,0 +1,234 @@
+"""
+Pré-chargement du cache de `Tool.fetch_query` à partir d'un fichier de tâches.
+
+Utilisation : `python -m utils.prefetch <fichier de tâches> [--now] [--workers N]`
+
+Le fichier de tâches est lu par `ConfigManager`, qui n'accepte les commentaires que sur leur propre ligne. La
+section `[prefetch]` décrit la connexion et l'exécution, chaque section `[job <nom>]` décrit une requête :
+```
+    [prefetch]
+    secret_file = /chemin/vers/db.cfg
+    ; optionnel. Sinon, utilise conn_string du fichier de secrets
+    millesime = 2021
+    workers = 2
+    ; en heures. Un cache plus récent n'est pas rafraîchi
+    max_age = 24
+    ; plage horaire d'exécution, de 20h à 7h
+    off_hours = 20, 7
+
+    [job immeubles_71378]
+    priority = 1
+    query = SELECT * FROM base_infra.immeuble WHERE code_insee = %(code)s
+    geo_column = geom
+    geo_table = base_infra.immeuble
+    geo_condition = code_insee = '71378'
+    param_code = 71378
+```
+"""
+import argparse
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .argstruct.geo_table_info import GeoInfo
+from .argstruct.prefetch_job import PrefetchJob
+from .argstruct.prefetch_job import PrefetchReport
+from .config.reader import ConfigManager
+from .dbtool import Tool
+
+logger = logging.getLogger(__name__)
+
+SECTION = 'prefetch'
+JOB_PREFIX = 'job '
+PARAM_PREFIX = 'param_'
+
+
+def read_jobs(cfg: ConfigManager) -> List[PrefetchJob]:
+    """Lis les requêtes à pré-charger, triées par priorité.
+
+    Args:
+        cfg (ConfigManager): fichier de tâches
+
+    Returns:
+        List[PrefetchJob]: Les requêtes, les plus prioritaires en premier.
+    """
+    jobs = []
+    for section in cfg.sections():
+        if not section.startswith(JOB_PREFIX):
+            continue
+
+        geo_info = None
+        if cfg.has_option(section, 'geo_column'):
+            geo_info = GeoInfo(column=cfg.get(section, 'geo_column'),
+                               table_path=cfg.get(section, 'geo_table'),
+                               condition=cfg.get(section, 'geo_condition', fallback=None))
+        params = {key[len(PARAM_PREFIX):]: value
+                  for key, value in cfg.items(section) if key.startswith(PARAM_PREFIX)}
+        force_epsg = cfg.getint(section, 'force_epsg', fallback=None)
+
+        jobs.append(PrefetchJob(name=section[len(JOB_PREFIX):].strip(),
+                                query=cfg.get(section, 'query'),
+                                geo_info=geo_info,
+                                params=params,
+                                priority=cfg.getint(section, 'priority', fallback=0),
+                                force_epsg=force_epsg))
+    return sorted(jobs, key=lambda job: job.priority)
+
+
+def read_off_hours(cfg: ConfigManager) -> Optional[Tuple[int, int]]:
+    """Lis la plage horaire d'exécution `off_hours = <début>, <fin>`.
+
+    Args:
+        cfg (ConfigManager): fichier de tâches
+
+    Returns:
+        Optional[Tuple[int, int]]: heures de début et de fin, ou None si aucune plage n'est imposée.
+    """
+    if not cfg.has_option(SECTION, 'off_hours'):
+        return None
+    hours = cfg.getlist(SECTION, 'off_hours')  # type: ignore
+    if len(hours) != 2 or not all(hour.isdigit() and int(hour) < 24 for hour in hours):
+        ConfigManager.invalid_value(SECTION, 'off_hours', cfg.get(SECTION, 'off_hours'))
+    return int(hours[0]), int(hours[1])
+
+
+def seconds_until_off_hours(start: int, end: int, now: Optional[datetime.datetime] = None) -> float:
+    """Temps à attendre avant d'entrer dans la plage horaire [start, end[. La plage peut passer minuit.
+
+    Args:
+        start (int): heure de début
+        end (int): heure de fin
+        now (Optional[datetime.datetime], optional): Heure courante. Defaults to None (maintenant).
+
+    Returns:
+        float: Nombre de secondes à attendre. 0 si on est déjà dans la plage.
+    """
+    now = now if now is not None else datetime.datetime.now()
+    inside = start <= now.hour < end if start <= end else (now.hour >= start or now.hour < end)
+    if inside:
+        return 0.
+
+    next_start = now.replace(hour=start, minute=0, second=0, microsecond=0)
+    if next_start <= now:
+        next_start += datetime.timedelta(days=1)
+    return (next_start - now).total_seconds()
+
+
+def _is_fresh(tool: Tool, job: PrefetchJob, max_age: Optional[float]) -> bool:
+    save_path = tool.cache_path(job.query, geo_info=job.geo_info, params=job.params or None,
+                                force_epsg=job.force_epsg)
+    cached = [path for path in (save_path, save_path.with_suffix('.spill')) if path.exists()]
+    if not cached:
+        return False
+    if max_age is None:
+        return True
+    age = time.time() - max(path.stat().st_mtime for path in cached)
+    return age < max_age * 3600
+
+
+def _run_job(tool: Tool, job: PrefetchJob, max_age: Optional[float], force: bool) -> PrefetchReport:
+    start = time.perf_counter()
+    try:
+        if not force and _is_fresh(tool, job, max_age):
+            status = 'skipped'
+        else:
+            tool.fetch_query(job.query, geo_info=job.geo_info, force_refetch=True, params=job.params or None,
+                             force_epsg=job.force_epsg)
+            status = 'refreshed'
+        report = PrefetchReport(name=job.name, status=status, duration=time.perf_counter() - start)
+    except Exception as e:  # pylint: disable=broad-except
+        report = PrefetchReport(name=job.name, status='failed', duration=time.perf_counter() - start,
+                                error=repr(e))
+    logger.info('%s: %s in %.2fs%s', report.name, report.status, report.duration,
+                f' ({report.error})' if report.error else '')
+    return report
+
+
+def run_prefetch(tool: Tool,
+                 jobs: List[PrefetchJob],
+                 workers: int = 2,
+                 max_age: Optional[float] = None,
+                 force: bool = False,
+                 ) -> List[PrefetchReport]:
+    """Exécute les requêtes de pré-chargement, au plus `workers` à la fois, par ordre de priorité.
+
+    Args:
+        tool (Tool): Outil de requête dont le cache est à remplir
+        jobs (List[PrefetchJob]): Requêtes à pré-charger
+        workers (int, optional): Nombre de requêtes simultanées. Defaults to 2.
+        max_age (Optional[float], optional): Âge maximal, en heures, d'un cache considéré frais. Defaults to None
+                (un cache existant est toujours frais).
+        force (bool, optional): Rafraîchi toutes les requêtes, même fraîches. Defaults to False.
+
+    Returns:
+        List[PrefetchReport]: Un compte-rendu par requête, dans l'ordre des requêtes.
+    """
+    jobs = sorted(jobs, key=lambda job: job.priority)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(lambda job: _run_job(tool, job, max_age, force), jobs))
+
+
+def format_reports(reports: List[PrefetchReport]) -> str:
+    """Résumé textuel des comptes-rendus.
+
+    Args:
+        reports (List[PrefetchReport]): comptes-rendus de `run_prefetch`
+
+    Returns:
+        str: Une ligne par requête, puis le décompte par statut.
+    """
+    width = max([len(report.name) for report in reports] + [4])
+    lines = [f'{report.name:<{width}}  {report.status:<9}  {report.duration:8.2f}s  {report.error or ""}'.rstrip()
+             for report in reports]
+    counts = {status: sum(report.status == status for report in reports)
+              for status in ('refreshed', 'skipped', 'failed')}
+    lines.append(', '.join(f'{count} {status}' for status, count in counts.items()))
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Point d'entrée de `python -m utils.prefetch`.
+
+    Args:
+        argv (Optional[List[str]], optional): Arguments de ligne de commande. Defaults to None.
+
+    Returns:
+        int: Code de sortie. 1 si une requête a échoué.
+    """
+    parser = argparse.ArgumentParser(description='Pré-charge le cache de fetch_query.')
+    parser.add_argument('jobfile', type=Path, help='Fichier de tâches')
+    parser.add_argument('--now', action='store_true', help="N'attends pas la plage horaire off_hours")
+    parser.add_argument('--force', action='store_true', help='Rafraîchi même les caches encore frais')
+    parser.add_argument('--workers', type=int, default=None, help='Nombre de requêtes simultanées')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    cfg = ConfigManager(filepath=args.jobfile)
+    secret_file = cfg.get(SECTION, 'secret_file')
+    if cfg.has_option(SECTION, 'millesime'):
+        tool = Tool(connection_string=ConfigManager.create_connection_string(secret_file,
+                                                                             cfg.get(SECTION, 'millesime')))
+    else:
+        tool = Tool(secret_path_file=secret_file)
+
+    off_hours = read_off_hours(cfg)
+    if off_hours is not None and not args.now:
+        wait = seconds_until_off_hours(*off_hours)
+        if wait > 0:
+            logger.info('Waiting %.0f minutes for the off-hours window %sh-%sh', wait / 60, *off_hours)
+            time.sleep(wait)
+
+    workers = args.workers if args.workers is not None else cfg.getint(SECTION, 'workers', fallback=2)
+    max_age = cfg.getfloat(SECTION, 'max_age', fallback=None)
+    reports = run_prefetch(tool, read_jobs(cfg), workers=workers, max_age=max_age, force=args.force)
+    print(format_reports(reports))
+    return int(any(report.status == 'failed' for report in reports))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
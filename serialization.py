@@ -0,0 +1,274 @@
+"""
+Sérialisation rapide des données intermédiaires, utilisée par `misc.save` et `misc.load`.
+
+Formats :
+- `pickle` : pickle protocole 5, avec les gros tampons (tableaux numpy, colonnes pandas) écrits hors du flux
+  pickle, sans copie, et compressés par blocs avec zstd ou lz4 si demandé ;
+- `parquet` : Parquet pour les DataFrame (et GeoDataFrame), sur demande : plus compact, mais les types pandas
+  ne sont pas tous conservés ;
+- `npy` : `.npy` numpy pour les tableaux, qui peut être relu en mémoire partagée (`mmap`).
+
+Le format est reconnu à la lecture à partir des premiers octets du fichier. Les fichiers écrits avec l'ancien
+`pickle.dump` se relisent toujours.
+"""
+import mmap as mmap_module
+import pickle
+import struct
+from pathlib import Path
+from typing import Any
+from typing import BinaryIO
+from typing import List
+from typing import Optional
+from typing import Union
+
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+FORMATS = ('pickle', 'parquet', 'npy')
+COMPRESSIONS = (None, 'zstd', 'lz4')
+
+PICKLE_MAGIC = b'UTLSPK5\x00'
+PARQUET_MAGIC = b'PAR1'
+NPY_MAGIC = b'\x93NUMPY'
+
+_CODECS = {None: 0, 'zstd': 1, 'lz4': 2}
+_HEADER = struct.Struct('<8sBI')  # magic, codec, nombre de segments
+_SEGMENT = struct.Struct('<Q')  # taille du segment décompressé
+_BLOCK = struct.Struct('<II')  # taille décompressée, taille stockée
+BLOCK_SIZE = 1 << 24
+
+
+def _codec(compression: Optional[str]):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression!r}, expected one of {COMPRESSIONS}')
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression requires the `zstandard` package')
+    if compression == 'lz4' and lz4_frame is None:
+        raise ImportError('lz4 compression requires the `lz4` package')
+    return compression
+
+
+def _compress(block: memoryview, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(block)
+    return lz4_frame.compress(block)
+
+
+def _decompress(block: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(block)
+    return lz4_frame.decompress(block)
+
+
+def infer_format(data: Any) -> str:
+    """Choisit le format d'écriture : `.npy` pour les tableaux numpy sans objets Python, pickle sinon. Les
+    DataFrame restent en pickle : Parquet ne garde pas tout (colonnes de listes, catégories entières, `attrs`,
+    fréquence d'un DatetimeIndex...). Parquet n'est utilisé que si demandé.
+
+    Args:
+        data (Any): donnée à sauvegarder
+
+    Returns:
+        str: un des FORMATS
+    """
+    if type(data) is np.ndarray and not data.dtype.hasobject:
+        return 'npy'
+    return 'pickle'
+
+
+def detect_format(f: BinaryIO) -> str:
+    """Reconnait le format d'un fichier à ses premiers octets, sans avancer dans le fichier.
+
+    Args:
+        f (BinaryIO): fichier ouvert en lecture binaire
+
+    Returns:
+        str: un des FORMATS, ou `legacy` pour un pickle écrit par `pickle.dump`
+    """
+    position = f.tell()
+    head = f.read(len(PICKLE_MAGIC))
+    f.seek(position)
+    if head == PICKLE_MAGIC:
+        return 'pickle'
+    if head.startswith(PARQUET_MAGIC):
+        return 'parquet'
+    if head.startswith(NPY_MAGIC):
+        return 'npy'
+    return 'legacy'
+
+
+def dump_pickle(data: Any, f: BinaryIO, compression: Optional[str] = None):
+    """Écris `data` en pickle protocole 5. Les tampons hors flux sont écrits tels quels, sans copie, ou par blocs
+    compressés.
+
+    Args:
+        data (Any): donnée à sauvegarder
+        f (BinaryIO): fichier ouvert en écriture binaire
+        compression (Optional[str], optional): `zstd`, `lz4` ou None. Defaults to None.
+    """
+    compression = _codec(compression)
+    buffers: List[pickle.PickleBuffer] = []
+    stream = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    segments = [memoryview(stream)] + [buffer.raw() for buffer in buffers]
+
+    f.write(_HEADER.pack(PICKLE_MAGIC, _CODECS[compression], len(segments)))
+    for segment in segments:
+        f.write(_SEGMENT.pack(segment.nbytes))
+        if compression is None:
+            f.write(segment)
+            continue
+        for start in range(0, segment.nbytes, BLOCK_SIZE):
+            block = segment[start:start + BLOCK_SIZE]
+            stored = _compress(block, compression)
+            f.write(_BLOCK.pack(block.nbytes, len(stored)))
+            f.write(stored)
+
+
+def _read_segment(f: BinaryIO, compression: Optional[str]) -> bytearray:
+    size, = _SEGMENT.unpack(f.read(_SEGMENT.size))
+    segment = bytearray(size)
+    view = memoryview(segment)
+    if compression is None:
+        f.readinto(view)
+        return segment
+    position = 0
+    while position < size:
+        raw, stored = _BLOCK.unpack(f.read(_BLOCK.size))
+        view[position:position + raw] = _decompress(f.read(stored), compression)
+        position += raw
+    return segment
+
+
+def load_pickle(f: BinaryIO, mmap: bool = False) -> Any:
+    """Relis un fichier écrit par `dump_pickle`.
+
+    Args:
+        f (BinaryIO): fichier ouvert en lecture binaire
+        mmap (bool, optional): Si le fichier n'est pas compressé, les tampons pointent directement dans le
+                fichier projeté en mémoire, en lecture seule. Defaults to False.
+
+    Returns:
+        Any: la donnée
+    """
+    magic, codec, count = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != PICKLE_MAGIC:
+        raise ValueError('Not a pickle 5 file written by `dump_pickle`')
+    compression = {value: key for key, value in _CODECS.items()}[codec]
+
+    if mmap and compression is None:
+        mapped = memoryview(mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
+        position = _HEADER.size
+        segments = []
+        for _ in range(count):
+            size, = _SEGMENT.unpack(mapped[position:position + _SEGMENT.size])
+            position += _SEGMENT.size
+            segments.append(mapped[position:position + size])
+            position += size
+    else:
+        segments = [_read_segment(f, compression) for _ in range(count)]
+    return pickle.loads(segments[0], buffers=segments[1:])
+
+
+def dump_parquet(df: pd.DataFrame, f: BinaryIO, compression: Optional[str] = None):
+    """Écris un DataFrame en Parquet. Une GeoDataFrame garde sa géométrie et sa projection.
+
+    Args:
+        df (pd.DataFrame): DataFrame à sauvegarder
+        f (BinaryIO): fichier ouvert en écriture binaire
+        compression (Optional[str], optional): `zstd`, `lz4` ou None. Defaults to None.
+    """
+    compression = _codec(compression) or 'none'
+    if isinstance(df, pdg.GeoDataFrame):
+        df.to_parquet(f, compression=compression)
+    else:
+        pq.write_table(pa.Table.from_pandas(df), f, compression=compression)
+
+
+def load_parquet(f: BinaryIO) -> pd.DataFrame:
+    """Relis un fichier écrit par `dump_parquet`.
+
+    Args:
+        f (BinaryIO): fichier ouvert en lecture binaire
+
+    Returns:
+        pd.DataFrame: le DataFrame, ou la GeoDataFrame
+    """
+    position = f.tell()
+    metadata = pq.read_schema(f).metadata or {}
+    f.seek(position)
+    if b'geo' in metadata:
+        return pdg.read_parquet(f)
+    return pq.read_table(f).to_pandas()
+
+
+def save(data: Any, path: Union[str, Path], format: Optional[str] = None, compression: Optional[str] = None):
+    """Sauvegarde `data` dans `path`.
+
+    Args:
+        data (Any): donnée à sauvegarder
+        path (Union[str, Path]): chemin du fichier
+        format (Optional[str], optional): un des FORMATS. Defaults to None (voir `infer_format`).
+        compression (Optional[str], optional): `zstd`, `lz4` ou None. Un tableau compressé est écrit en pickle,
+                un `.npy` ne se compresse pas. Defaults to None.
+    """
+    _codec(compression)
+    if format is None:
+        format = infer_format(data)
+        if format == 'npy' and compression is not None:
+            format = 'pickle'
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format!r}, expected one of {FORMATS}')
+
+    with open(str(path), 'wb') as f:
+        if format == 'parquet':
+            try:
+                dump_parquet(data, f, compression=compression)
+                return
+            except (pa.ArrowException, TypeError, ValueError):
+                # Colonnes d'objets Python hétérogènes : Arrow ne sait pas les typer
+                f.seek(0)
+                f.truncate()
+                format = 'pickle'
+        if format == 'npy':
+            if compression is not None:
+                raise ValueError('`.npy` files cannot be compressed')
+            np.save(f, data, allow_pickle=False)
+        else:
+            dump_pickle(data, f, compression=compression)
+
+
+def load(path: Union[str, Path], mmap: bool = False) -> Any:
+    """Relis un fichier écrit par `save`, ou par `pickle.dump`. Le format est reconnu automatiquement.
+
+    Args:
+        path (Union[str, Path]): chemin du fichier
+        mmap (bool, optional): Projette le fichier en mémoire au lieu de le lire, pour les `.npy` et les pickle
+                non compressés. Les tableaux obtenus sont en lecture seule. Defaults to False.
+
+    Returns:
+        Any: la donnée
+    """
+    with open(str(path), 'rb') as f:
+        format = detect_format(f)
+        if format == 'parquet':
+            return load_parquet(f)
+        if format == 'npy':
+            if mmap:
+                return np.load(str(path), mmap_mode='r', allow_pickle=False)
+            return np.load(f, allow_pickle=False)
+        if format == 'pickle':
+            return load_pickle(f, mmap=mmap)
+        return pickle.load(f)
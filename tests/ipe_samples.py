@@ -0,0 +1,28 @@
+"""
+Petites archives IPE synthétiques pour les tests
+"""
+import zipfile
+from pathlib import Path
+from typing import Dict
+from typing import Tuple
+
+import pandas as pd
+
+COLUMNS = ['IdentifiantImmeuble', 'CodeAdresseImmeuble', 'EtatImmeuble', 'NombreLogementsAdresseIPE']
+
+
+def ipe_frame(prefix: str, nrows: int = 3) -> pd.DataFrame:
+    return pd.DataFrame({
+        'IdentifiantImmeuble': [f'{prefix}{i}' for i in range(nrows)],
+        'CodeAdresseImmeuble': [f'71378{i:05d}' for i in range(nrows)],
+        'EtatImmeuble': ['DEPLOYE'] * nrows,
+        'NombreLogementsAdresseIPE': [str(i + 1) for i in range(nrows)],
+        })
+
+
+def make_ipe_zip(path: Path, members: Dict[str, Tuple[pd.DataFrame, str]]) -> Path:
+    """Écris une archive dont chaque membre est un CSV IPE, encodé comme demandé."""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        for name, (df, encoding) in members.items():
+            z.writestr(name, df.to_csv(sep=';', index=False).encode(encoding))
+    return path
@@ -0,0 +1,89 @@
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import archives
+from ..ipe.archives import member_date
+from ..ipe.archives import read_ipe_archives
+from ..ipe.archives import resolve_members
+from ..ipe.rwp import read_single_ipe
+from .ipe_samples import COLUMNS
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.fixture
+def deliveries(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.archives.pth.tmp_path', return_value=tmp_path)
+    folder = tmp_path / 'livraisons'
+    folder.mkdir()
+
+    newer = ipe_frame('a', nrows=2).assign(EtatImmeuble='RACCORDABLE')
+    make_ipe_zip(folder / 'opa.zip', {
+        'OPA/IPE_Z_OPA_V30_20210401.csv': (newer, 'UTF-8'),
+        'OPA/README.csv.txt': (ipe_frame('x'), 'UTF-8'),
+        })
+    inner = make_ipe_zip(tmp_path / 'inner.zip', {'IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'Windows-1252')})
+    with zipfile.ZipFile(folder / 'opb.zip', 'w') as z:
+        z.writestr('OPB/IPE_Z_OPB_V22_20210301.csv', ipe_frame('b').to_csv(sep=';', index=False))
+        z.write(inner, 'OPB/anciens/inner.zip')
+    return folder
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('IPE_t1_2021/IPE_Forbach_FIBA_PM_IPEZMD_V30_20210419.csv', pd.Timestamp('2021-04-19')),
+    ('IPE_X_V30.csv', None),
+    ])
+def test_member_date(name, expected):
+    assert member_date(name) == expected
+
+
+def test_resolve_members(deliveries: Path):
+    members = resolve_members(deliveries / '*.zip')
+    assert [member.name for member in members] == [
+        'OPA/IPE_Z_OPA_V30_20210401.csv', 'OPB/IPE_Z_OPB_V22_20210301.csv', 'IPE_Z_OPA_V30_20210101.csv']
+    assert members[-1].parents[0].endswith('opb.zip:OPB/anciens/inner.zip')
+    assert len(resolve_members(deliveries / '*.zip', patterns='OPB/*')) == 1
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_read_ipe_archives(deliveries: Path, workers):
+    df = read_ipe_archives(deliveries / '*.zip', columns=COLUMNS, workers=workers)
+    assert len(df) == 6
+    states = df.set_index('IdentifiantImmeuble')['EtatImmeuble']
+    assert states[['a0', 'a1']].tolist() == ['RACCORDABLE', 'RACCORDABLE']
+    assert states['a2'] == 'DEPLOYE'
+
+    earliest = read_ipe_archives(deliveries / '*.zip', columns=COLUMNS, keep='earliest', workers=workers)
+    assert (earliest.set_index('IdentifiantImmeuble').loc[['a0', 'a1'], 'EtatImmeuble'] == 'DEPLOYE').all()
+    assert len(read_ipe_archives(deliveries / '*.zip', columns=COLUMNS, keep=None)) == 8
+
+
+@pytest.mark.parametrize('keep', ['latest', 'earliest'])
+def test_read_ipe_archives__undated_member_loses(deliveries: Path, keep: str):
+    archive = make_ipe_zip(deliveries.parent / 'undated.zip', {
+        'IPE_Z_OPA_V30.csv': (ipe_frame('a', nrows=1).assign(EtatImmeuble='SIGNE'), 'UTF-8'),
+        'IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a', nrows=1), 'UTF-8'),
+        })
+    df = read_ipe_archives(archive, columns=COLUMNS, keep=keep)
+    assert df['EtatImmeuble'].tolist() == ['DEPLOYE']
+
+
+def test_read_ipe_archives__one_index_per_archive(deliveries: Path, mocker: MockerFixture):
+    archive = make_ipe_zip(deliveries.parent / 'two.zip', {
+        'IPE_Z_OPC_V30_20210101.csv': (ipe_frame('c'), 'UTF-8'),
+        'IPE_Z_OPD_V30_20210101.csv': (ipe_frame('d'), 'UTF-8'),
+        })
+    build_index = mocker.spy(archives, 'build_index')
+    assert len(read_ipe_archives(archive, columns=COLUMNS)) == 6
+    assert build_index.call_count == 1
+
+
+def test_read_single_ipe__any_folder(deliveries: Path):
+    df = read_single_ipe('IPE_Z_OPB_V22_20210301.csv', columns=COLUMNS, zipfilepath=deliveries / 'opb.zip')
+    assert df['IdentifiantImmeuble'].tolist() == ['b0', 'b1', 'b2']
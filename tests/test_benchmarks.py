@@ -0,0 +1,47 @@
+import json
+import zipfile
+from pathlib import Path
+
+from ..benchmarks.bench_dbtool import main as bench_dbtool_main
+from ..benchmarks.bench_dbtool import parse_srid_mix
+from ..benchmarks.bench_ipe import ENGINES
+from ..benchmarks.bench_ipe import main as bench_ipe_main
+from ..benchmarks.synthetic_ipe import make_synthetic_archive
+from ..ipe.encoding import detect_encoding
+
+
+def test_parse_srid_mix():
+    assert parse_srid_mix('2154:3,5490:1') == {2154: 0.75, 5490: 0.25}
+
+
+def test_bench_dbtool__standin(tmp_path: Path):
+    output = tmp_path / 'bench.json'
+    bench_dbtool_main(['--rows', '50', '--repeat', '1', '--srid-mix', '2154:1,4326:1', '--output', str(output)])
+    results = json.loads(output.read_text())
+    assert results['backend'] == 'sqlite-standin'
+    assert [result['rows'] for result in results['results']] == [25, 25]
+
+
+def test_make_synthetic_archive(tmp_path: Path):
+    manifest = make_synthetic_archive(tmp_path / 'ipe.zip', members=12, rows=30, bad_bytes_share=0.5,
+                                      missing_share=0.5, seed=1)
+    with zipfile.ZipFile(tmp_path / 'ipe.zip') as z:
+        for name, member in manifest.items():
+            data = z.read(name)
+            with z.open(name) as f:
+                encoding, _ = detect_encoding(f)
+            # Sans octet 0x81, un fichier Latin-1 se lit aussi en Windows-1252
+            assert encoding in ((member['encoding'], 'Windows-1252') if b'\x81' not in data else ('Latin-1',))
+            header = data.split(b'\n', 1)[0].decode('ascii').split(';')
+            assert not set(member['missing']) & set(header)
+            assert ('DateCompletudeHabitation' in header) == (member['version'] == '3.0')
+    assert {member['version'] for member in manifest.values()} == {'2.2', '3.0'}
+
+
+def test_bench_ipe(tmp_path: Path):
+    output = tmp_path / 'bench.json'
+    bench_ipe_main(['--members', '3', '--rows', '50', '--repeat', '1', '--workers', '2', '--output', str(output)])
+    results = json.loads(output.read_text())
+    assert [result['engine'] for result in results['results']] == list(ENGINES)
+    assert all(result['mb_per_s'] > 0 for result in results['results'])
+    assert len(results['read_single_ipe']['members']) == 3
@@ -8,12 +8,17 @@ import pandas as pd
 import pytest
 from pytest_mock import MockerFixture
 
-import ..pathtools as pth
+from .. import pathtools as pth
 from ..argstruct.database_secret import ExtendedDatabaseSecret
 from ..argstruct.geo_table_info import GeoInfo
+from ..argstruct.geo_table_info import GeoReduction
+from ..dbtool import MillesimeTool
+from ..dbtool import SpilledResult
 from ..dbtool import Tool
 from ..dbtool import _connection_string_from_db_secret
 from ..dbtool import _connection_string_from_secret_file
+from ..dbtool import _reduced_geometry_expression
+from ..dbtool import _reduced_query
 from ..dbtool import _rm_string_marker
 
 
@@ -49,6 +54,30 @@ def test__rm_string_marker(string, expected):
     assert _rm_string_marker(string) == expected
 
 
+@pytest.mark.parametrize('reduction,expected', [
+    (GeoReduction(), '"geom"'),
+    (GeoReduction(mode='centroid'), 'ST_Centroid("geom")'),
+    (GeoReduction(mode='bbox', precision=3), 'ST_QuantizeCoordinates(ST_Envelope("geom"), 3)'),
+    (GeoReduction(tolerance=10), 'ST_SimplifyPreserveTopology("geom", 10.0)'),
+    ])
+def test__reduced_geometry_expression(reduction, expected):
+    assert _reduced_geometry_expression('geom', reduction) == expected
+
+
+def test__reduced_query():
+    geo_info = GeoInfo(column='geom', table_path='base_infra.zpm', reduction=GeoReduction(mode='centroid'))
+    query = _reduced_query('SELECT * FROM base_infra.zpm;', ['id', 'geom'], geo_info)
+    assert query == 'SELECT _q."id", ST_Centroid("geom") AS "geom" FROM (SELECT * FROM base_infra.zpm) AS _q'
+
+    with pytest.raises(ValueError):
+        _reduced_query('SELECT id FROM base_infra.zpm', ['id'], geo_info)
+
+
+def test_geo_reduction__unknown_mode():
+    with pytest.raises(ValueError):
+        GeoReduction(mode='convex_hull')
+
+
 @pytest.mark.usefixtures('mocker')
 @pytest.mark.parametrize('connstring,dbsecret,secretfile,expected', [
     ('Connection String', None, None, 'Connection String'),
@@ -171,3 +200,92 @@ def test_drop_table__integration():
     assert tool.has_table(table='_test_to_delete', schema='loic')
     tool.drop_table('_test_to_delete', schema='loic')
     assert not tool.has_table(table='_test_to_delete', schema='loic')
+
+
+def test_fetch_query__memory_budget_spills(mocker: MockerFixture, local_tmp_path: Path):
+    mocker.patch('utils.dbtool.pth.tmp_path', return_value=local_tmp_path)
+    tool = Tool(connection_string=f"sqlite:///{local_tmp_path / 'db.sqlite'}", memory_budget=1000)
+    pd.DataFrame(data={'a': range(50), 'b': ['x'] * 50}).to_sql('t', tool.engine, index=False)
+    mocker.patch('utils.dbtool.Tool._estimate_result_size', return_value=(50, 100))
+
+    result = tool.fetch_query(query='SELECT * FROM t')
+    assert isinstance(result, SpilledResult)
+    assert len(result.parts) > 1
+    assert len(result) == 50
+    assert result.to_frame(columns=['a'])['a'].tolist() == list(range(50))
+
+    # Servi depuis le cache, sans budget : chargé entièrement
+    tool._memory_budget = None
+    assert tool.fetch_query(query='SELECT * FROM t').shape == (50, 2)
+
+
+def test_fetch_query__refetch_replaces_other_cache(mocker: MockerFixture, local_tmp_path: Path):
+    mocker.patch('utils.dbtool.pth.tmp_path', return_value=local_tmp_path)
+    tool = Tool(connection_string=f"sqlite:///{local_tmp_path / 'db.sqlite'}", memory_budget=1000)
+    pd.DataFrame(data={'a': range(50)}).to_sql('t', tool.engine, index=False)
+    estimate = mocker.patch('utils.dbtool.Tool._estimate_result_size', return_value=(50, 100))
+    assert isinstance(tool.fetch_query(query='SELECT * FROM t'), SpilledResult)
+
+    # Le résultat en mémoire remplace le dossier déversé
+    pd.DataFrame(data={'a': [-1]}).to_sql('t', tool.engine, index=False, if_exists='append')
+    estimate.return_value = (1, 8)
+    assert len(tool.fetch_query(query='SELECT * FROM t', force_refetch=True)) == 51
+    assert not list(local_tmp_path.glob('*.spill'))
+    assert len(tool.fetch_query(query='SELECT * FROM t')) == 51
+
+    # Et inversement
+    estimate.return_value = (50, 100)
+    assert isinstance(tool.fetch_query(query='SELECT * FROM t', force_refetch=True), SpilledResult)
+    assert not list(local_tmp_path.glob('*.fthr'))
+
+
+def test_fetch_query__memory_budget_under_estimate(mocker: MockerFixture, local_tmp_path: Path, caplog):
+    caplog.set_level(logging.INFO)
+    mocker.patch('utils.dbtool.pth.tmp_path', return_value=local_tmp_path)
+    tool = Tool(connection_string=f"sqlite:///{local_tmp_path / 'db.sqlite'}", memory_budget=10 ** 9)
+    pd.DataFrame(data={'a': range(50)}).to_sql('t', tool.engine, index=False)
+    mocker.patch('utils.dbtool.Tool._estimate_result_size', return_value=(50, 8))
+
+    df = tool.fetch_query(query='SELECT * FROM t')
+    assert isinstance(df, pd.DataFrame)
+    assert 'Memory estimate: 50 rows x 8 bytes, actual: 50 rows' in caplog.text
+
+
+def test_resolve_crs__frozen(mocker: MockerFixture, local_tmp_path: Path):
+    get_crs = mocker.patch('utils.dbtool.Tool._get_crs', return_value='2154')
+    geo_info = GeoInfo(table_path='base_infra.immeuble', column='geom', condition="code_insee = '71378'")
+    connection_string = f"sqlite:///{local_tmp_path / 'db.sqlite'}"
+
+    tool = Tool(connection_string=connection_string, cache_namespace='a2020', tmp=local_tmp_path, frozen=True)
+    assert tool._resolve_crs(geo_info) == tool._resolve_crs(geo_info) == 'EPSG:2154'
+    assert get_crs.call_count == 1
+    # Gardé sur disque pour les prochains processus, par espace de cache
+    for namespace, calls in [('a2020', 1), ('a2019', 2)]:
+        tool = Tool(connection_string=connection_string, cache_namespace=namespace, tmp=local_tmp_path, frozen=True)
+        tool._resolve_crs(geo_info)
+        assert get_crs.call_count == calls
+
+    tool = Tool(connection_string=connection_string, cache_namespace='a2021', tmp=local_tmp_path)
+    tool._resolve_crs(geo_info)
+    tool._resolve_crs(geo_info)
+    assert get_crs.call_count == 4
+
+
+def test_millesime_tool__fetch_query(mocker: MockerFixture, local_tmp_path: Path):
+    mocker.patch('utils.dbtool.pth.tmp_path', return_value=local_tmp_path)
+    mocker.patch('utils.dbtool.ConfigManager.create_connection_string',
+                 new=lambda secret, millesime: f"sqlite:///{local_tmp_path / f'{millesime}.sqlite'}")
+    tool = MillesimeTool(secret_file_path='secret', millesimes=[2020, 2021])
+    for i, millesime in enumerate(tool.millesimes):
+        pd.DataFrame(data={'a': [i] * (i + 1)}).to_sql('t', tool.tools[millesime].engine, index=False)
+
+    df = tool.fetch_query(query='SELECT * FROM t')
+    assert df['millesime'].tolist() == ['2020', '2021', '2021']
+    assert df['a'].tolist() == [0, 1, 1]
+
+    assert tool.is_frozen('2020')
+    assert not tool.is_frozen('2021')
+    assert tool.tools['2020']._frozen and not tool.tools['2021']._frozen
+    read_sql = mocker.spy(pd, 'read_sql')
+    tool.fetch_query(query='SELECT * FROM t', force_refetch=True)
+    assert read_sql.call_count == 1
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import diff as diff_module
+from ..ipe import rwp
+from ..ipe.diff import diff_ipe
+from ..ipe.diff import unchanged_members
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.fixture
+def archives(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.diff.pth.tmp_path', return_value=tmp_path)
+    same = ipe_frame('s')
+    old = make_ipe_zip(tmp_path / 'old.zip', {
+        'T1/IPE_Z_OPA_V30_20210101.csv': (same, 'UTF-8'),
+        'T1/IPE_Z_OPB_V30_20210101.csv': (ipe_frame('b'), 'UTF-8'),
+        })
+    changed = ipe_frame('b').iloc[1:].reset_index(drop=True)
+    changed.loc[0, 'EtatImmeuble'] = 'ABANDONNE'
+    changed.loc[1, 'NombreLogementsAdresseIPE'] = None
+    new = make_ipe_zip(tmp_path / 'new.zip', {
+        'T2/IPE_Z_OPA_V30_20210401.csv': (same, 'UTF-8'),
+        'T2/IPE_Z_OPB_V30_20210401.csv': (changed, 'Windows-1252'),
+        'T2/IPE_Z_OPC_V30_20210401.csv': (ipe_frame('c', nrows=2), 'UTF-8'),
+        })
+    return old, new
+
+
+def test_unchanged_members(archives):
+    assert unchanged_members(*archives) == (['T1/IPE_Z_OPA_V30_20210101.csv'], ['T2/IPE_Z_OPA_V30_20210401.csv'])
+
+
+def test_diff_ipe(archives, mocker: MockerFixture):
+    read = mocker.spy(rwp, '_iter_single_ipe_file')
+    unchanged = mocker.spy(diff_module, 'unchanged_members')
+    diff = diff_ipe(*archives, columns=['EtatImmeuble', 'NombreLogementsAdresseIPE'], partitions=4)
+
+    assert read.call_count == 3
+    assert unchanged.call_count == 1
+    assert diff.skipped_members == 1
+    assert sorted(diff.added['IdentifiantImmeuble']) == ['c0', 'c1']
+    assert diff.removed['IdentifiantImmeuble'].tolist() == ['b0']
+    changed = diff.changed.set_index('IdentifiantImmeuble')['changed_columns'].to_dict()
+    assert changed == {'b1': ['EtatImmeuble'], 'b2': ['NombreLogementsAdresseIPE']}
+    assert diff.changed.set_index('IdentifiantImmeuble').loc['b1', 'EtatImmeuble_old'] == 'DEPLOYE'
+
+
+def test_diff_ipe__identical(archives):
+    old, _ = archives
+    diff = diff_ipe(old, old)
+    assert diff.added.empty and diff.removed.empty and diff.changed.empty
+    assert diff.skipped_members == 2
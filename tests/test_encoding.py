@@ -0,0 +1,59 @@
+import io
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import rwp
+from ..ipe.encoding import IpeDecodeError
+from ..ipe.encoding import decode_error_offset
+from ..ipe.encoding import detect_encoding
+from ..ipe.encoding import load_encoding_cache
+from ..ipe.rwp import parse_ipe
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.mark.parametrize('content,expected', [
+    (b'abc;def\n', ('UTF-8', None)),
+    ('Étoile;ça\n'.encode('UTF-8'), ('UTF-8', None)),
+    (b'\xef\xbb\xbfabc', ('UTF-8-SIG', None)),
+    (b'abc;d\xe9f\n', ('Windows-1252', 5)),
+    (b'abc;\x80;d\xe9f\n', ('Windows-1252', 4)),
+    (b'abc;\x81;d\xe9f\n', ('Latin-1', 4)),
+    ])
+def test_detect_encoding(content, expected):
+    assert detect_encoding(io.BytesIO(content)) == expected
+
+
+def test_detect_encoding__late_bad_byte_across_chunks():
+    content = 'é'.encode('UTF-8') * 1000 + b'\xe9'
+    assert detect_encoding(io.BytesIO(content), chunksize=7) == ('Windows-1252', 2000)
+
+
+def test_decode_error_offset():
+    content = 'é'.encode('UTF-8') * 1000 + b'\xe9;x'
+    assert decode_error_offset(io.BytesIO(content), 'UTF-8', chunksize=7) == 2000
+    assert decode_error_offset(io.BytesIO(content), 'Latin-1') is None
+    assert decode_error_offset(io.BytesIO(b'abc\xc3'), 'UTF-8') == 3
+
+
+def test_read_single_ipe_file__decode_error_offset():
+    # Octet invalide bien après le premier bloc décodé par pandas
+    content = ipe_frame('a', nrows=20000).to_csv(sep=';', index=False).encode('UTF-8')
+    bad = len(content) - 10
+    content = content[:bad] + b'\xe9' + content[bad + 1:]
+    with pytest.raises(IpeDecodeError) as error:
+        rwp._read_single_ipe_file(io.BytesIO(content), encoding='UTF-8', name='a.csv')
+    assert error.value.offset == bad
+
+
+def test_parse_ipe__mixed_encodings(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/a.csv': (ipe_frame('é'), 'UTF-8'),
+        'IPE/b.csv': (ipe_frame('è'), 'Windows-1252'),
+        })
+    df = parse_ipe(archive, columns=['IdentifiantImmeuble', 'EtatImmeuble'])
+    assert df['IdentifiantImmeuble'].tolist() == ['é0', 'é1', 'é2', 'è0', 'è1', 'è2']
+    assert sorted(load_encoding_cache().values()) == ['UTF-8', 'Windows-1252']
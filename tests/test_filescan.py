@@ -0,0 +1,60 @@
+import os
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from .. import filescan
+from ..filescan import FileIndex
+from ..filescan import iter_files
+from ..filescan import scan_tree
+
+
+@pytest.fixture
+def tree(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.filescan.pth.tmp_path', return_value=tmp_path)
+    mocker.patch.object(filescan, 'RACY_SECONDS', 0)
+    root = tmp_path / 'tree'
+    for relative, size in [('b.CSV', 10), ('a/x.zip', 2000), ('a/y.csv', 30), ('a/aa/w.csv', 5), ('c/d/z.csv', 40)]:
+        (root / relative).parent.mkdir(parents=True, exist_ok=True)
+        (root / relative).write_bytes(b'x' * size)
+    return root
+
+
+def test_iter_files__filters(tree: Path):
+    relative = lambda paths: [path.relative_to(tree).as_posix() for path in paths]  # noqa: E731
+    assert relative(iter_files(tree)) == ['b.CSV', 'a/x.zip', 'a/y.csv', 'a/aa/w.csv', 'c/d/z.csv']
+    assert relative(iter_files(tree, extensions=['csv'])) == ['b.CSV', 'a/y.csv', 'a/aa/w.csv', 'c/d/z.csv']
+    assert relative(iter_files(tree, pattern='a/*.csv')) == ['a/y.csv', 'a/aa/w.csv']
+    assert relative(iter_files(tree, pattern='[wz].csv', max_size=10)) == ['a/aa/w.csv']
+    assert relative(iter_files(tree, min_size=1000)) == ['a/x.zip']
+
+
+def test_file_index(tree: Path):
+    index = FileIndex(tree, extensions=['csv'], workers=4)
+    assert [path.relative_to(tree).as_posix() for path in index] == ['b.CSV', 'a/y.csv', 'a/aa/w.csv',
+                                                                      'c/d/z.csv']
+    assert index[-1] == tree / 'c/d/z.csv'
+    assert index.size(1) == 30
+    assert index.total_size() == 85
+    assert len(index.sample(3, seed=0)) == 3
+    assert index.cache_path.exists()
+
+
+def test_file_index__incremental(mocker: MockerFixture, tree: Path):
+    FileIndex(tree)
+    (tree / 'c/d/new.csv').write_bytes(b'')
+    os.remove(tree / 'a/y.csv')
+
+    scan = mocker.spy(filescan, '_scan_directory')
+    index = FileIndex(tree)
+    assert {call.args[0] for call in scan.call_args_list} == {tree / 'a', tree / 'c/d'}
+    assert tree / 'c/d/new.csv' in list(index)
+    assert tree / 'a/y.csv' not in list(index)
+
+
+def test_scan_tree__removed_directory(tree: Path):
+    records = scan_tree(tree)
+    (tree / 'a/aa/w.csv').unlink()
+    (tree / 'a/aa').rmdir()
+    assert 'a/aa' not in scan_tree(tree, previous=records)
@@ -0,0 +1,130 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import rwp
+from ..ipe.filters import check_filters
+from ..ipe.filters import filter_frame
+from ..ipe.filters import member_can_match
+from ..ipe.index import MemberHeader
+from ..ipe.rwp import iter_ipe
+from ..ipe.rwp import parse_ipe
+from ..ipe.store import ingest_ipe
+from .ipe_samples import COLUMNS
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.fixture
+def archive(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.store.pth.specific_datapath', return_value=tmp_path)
+    mixed = ipe_frame('b', nrows=4).assign(CodeInseeImmeuble=['71378', '21231', '71001', None],
+                                           EtatImmeuble=['DEPLOYE', 'DEPLOYE', 'CIBLE', 'DEPLOYE'])
+    return make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a').assign(CodeInseeImmeuble='71378'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V30_20210101.csv': (mixed, 'Windows-1252'),
+        'IPE/IPE_Z_OPC_V30_20210101.csv': (ipe_frame('c'), 'UTF-8'),
+        })
+
+
+def test_check_filters():
+    assert check_filters(None) == []
+    assert check_filters([('a', 'in', ('x', 'y'))]) == [('a', 'in', ['x', 'y'])]
+    with pytest.raises(ValueError):
+        check_filters([('a', '>', 1)])
+    with pytest.raises(ValueError):
+        check_filters([('NombreLogementsAdresseIPE', 'startswith', '1')])
+    with pytest.raises(ValueError):
+        check_filters([('departement', '==', '71')])
+    assert check_filters([('departement', '==', '71')], store=True) == [('departement', '==', '71')]
+
+
+def test_member_can_match():
+    header = MemberHeader(name='IPE/IPE_Z_OPA_V30_20210101.csv', crc=0, columns=['EtatImmeuble'], encoding='UTF-8',
+                          separator=';')
+    assert member_can_match(header, [('operateur', 'in', ['OPA', 'OPB'])])
+    assert not member_can_match(header, [('operateur', '==', 'OPB')])
+    assert not member_can_match(header, [('CodeInseeImmeuble', 'startswith', '71')])
+    assert member_can_match(header, [('CodeInseeImmeuble', '!=', '71378')])
+
+
+def test_filter_frame():
+    df = pd.DataFrame({'a': ['710', '211', None], 'b': pd.Categorical(['x', 'y', 'x'])})
+    assert filter_frame(df, [('a', 'startswith', ['71', '21'])]).index.tolist() == [0, 1]
+    assert filter_frame(df, [('b', '==', 'x'), ('a', '!=', '710')]).index.tolist() == [2]
+    assert filter_frame(df, [('c', '==', 'x')]).empty
+
+
+@pytest.mark.parametrize('engine,workers', [('pandas', None), ('arrow', None), ('pandas', 2)])
+def test_parse_ipe__filters(archive: Path, mocker: MockerFixture, engine: str, workers):
+    filters = [('CodeInseeImmeuble', 'startswith', '71'), ('EtatImmeuble', '==', 'DEPLOYE')]
+    read = mocker.spy(rwp, '_iter_single_ipe_file')
+    df = parse_ipe(archive, columns=COLUMNS, use_store=False, engine=engine, workers=workers, filters=filters)
+
+    assert sorted(df['IdentifiantImmeuble']) == ['a0', 'a1', 'a2', 'b0']
+    assert list(df.columns) == COLUMNS
+    if engine == 'pandas' and workers is None:
+        assert read.call_count == 2  # OPC n'a pas de CodeInseeImmeuble
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+@pytest.mark.parametrize('filters', [[('operateur', '==', 'SFR0')], [('ColonneAbsente', '==', 'x')]])
+def test_parse_ipe__filters_prune_every_member(archive: Path, engine: str, filters):
+    df = parse_ipe(archive, columns=COLUMNS, use_store=False, engine=engine, filters=filters)
+    assert df.empty
+    assert list(df.columns) == COLUMNS
+    assert str(df['NombreLogementsAdresseIPE'].dtype) == 'Int64'
+
+
+def test_parse_ipe__filters_store(archive: Path):
+    ingest_ipe(archive)
+    filters = [('operateur', '==', 'OPB'), ('CodeInseeImmeuble', 'in', ['21231', '71001'])]
+    df = parse_ipe(archive, columns=COLUMNS, filters=filters)
+    assert sorted(df['IdentifiantImmeuble']) == ['b1', 'b2']
+
+
+@pytest.mark.parametrize('value', [3, '3', ['3.0']])
+def test_parse_ipe__typed_filters_every_engine(mocker: MockerFixture, tmp_path: Path, value):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.store.pth.specific_datapath', return_value=tmp_path)
+    written = ipe_frame('c', nrows=4).assign(NombreLogementsAdresseIPE=['03', '3.0', None, '13'])
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'UTF-8'),
+        'IPE/IPE_Z_OPC_V30_20210101.csv': (written, 'UTF-8'),
+        })
+    op = '==' if not isinstance(value, list) else 'in'
+    filters = [('NombreLogementsAdresseIPE', op, value)]
+    expected = ['a2', 'c0', 'c1']
+
+    for engine in ('pandas', 'arrow'):
+        for typed in (True, False):
+            df = parse_ipe(archive, columns=COLUMNS, use_store=False, engine=engine, typed=typed, filters=filters)
+            assert sorted(df['IdentifiantImmeuble']) == expected, (engine, typed)
+    ingest_ipe(archive)
+    df = parse_ipe(archive, columns=COLUMNS, filters=filters)
+    assert sorted(df['IdentifiantImmeuble']) == expected
+
+    excluded = parse_ipe(archive, columns=COLUMNS, filters=[('NombreLogementsAdresseIPE', '!=', 3)])
+    assert sorted(excluded['IdentifiantImmeuble']) == ['a0', 'a1', 'c2', 'c3']
+
+
+def test_parse_ipe__departement_filter(archive: Path):
+    filters = [('departement', '==', '71')]
+    with pytest.raises(ValueError):
+        parse_ipe(archive, columns=COLUMNS, filters=filters)
+    ingest_ipe(archive)
+    df = parse_ipe(archive, columns=COLUMNS, filters=filters)
+    assert sorted(df['IdentifiantImmeuble']) == ['a0', 'a1', 'a2', 'b0', 'b2', 'c0', 'c1', 'c2']
+    with pytest.raises(ValueError):
+        parse_ipe(archive, columns=COLUMNS, filters=filters, use_store=False)
+
+
+def test_iter_ipe__filters(archive: Path):
+    chunks = list(iter_ipe(archive, columns=['IdentifiantImmeuble'], filters=[('operateur', '==', 'OPC')]))
+    assert [name for name, _ in chunks] == ['IPE/IPE_Z_OPC_V30_20210101.csv']
+    assert list(chunks[0][1].columns) == ['IdentifiantImmeuble']
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import geopandas as pdg
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe.geo import projection_epsg
+from ..ipe.geo import to_geodataframe
+from ..ipe.rwp import parse_ipe
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.mark.parametrize('projection,expected', [
+    ('L93', 2154), ('rgaf09-utm20', 5490), ('UTM40S', 2975), ('Mercator', None), (None, None)])
+def test_projection_epsg(projection, expected):
+    assert projection_epsg(projection) == expected
+
+
+def test_to_geodataframe():
+    df = pd.DataFrame({
+        'CoordonneeImmeubleX': [652000., 2.35, '700000,5', None],
+        'CoordonneeImmeubleY': [6862000., 48.85, '1800000', 1.],
+        'TypeProjection': ['L93', 'WGS84', 'RGAF09UTM20', 'L93'],
+        })
+    gdf = to_geodataframe(df, target_crs=2154)
+
+    assert gdf.crs == 'EPSG:2154'
+    assert gdf.geometry.iloc[0].x == 652000.
+    assert gdf.geometry.iloc[1].distance(gdf.geometry.iloc[0]) < 1000
+    assert gdf.geometry.iloc[2] is not None
+    assert gdf.geometry.iloc[3] is None
+
+
+def test_parse_ipe__as_geo(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    df = ipe_frame('a', nrows=2).assign(CoordonneeImmeubleX=['652000', '700000,5'],
+                                        CoordonneeImmeubleY=['6862000', '1800000'],
+                                        TypeProjection=['L93', 'RGAF09UTM20'])
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {'IPE/IPE_Z_OPA_V30_20210101.csv': (df, 'UTF-8')})
+
+    gdf = parse_ipe(archive, columns=['IdentifiantImmeuble'], use_store=False, as_geo=True, target_crs=4326)
+    assert isinstance(gdf, pdg.GeoDataFrame)
+    assert list(gdf.columns) == ['IdentifiantImmeuble', 'geometry']
+    assert gdf.crs == 'EPSG:4326'
+    assert -62 < gdf.geometry.iloc[1].x < -60  # Antilles
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import rwp
+from ..ipe.index import build_index
+from ..ipe.index import member_version
+from ..ipe.rwp import parse_ipe
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.fixture
+def archive(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    return make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V30_20210101.csv': (ipe_frame('b').drop(columns=['EtatImmeuble']), 'Windows-1252'),
+        'IPE/IPE_Z_OPC_V22_20210101.csv': (ipe_frame('c')[['IdentifiantImmeuble']], 'UTF-8'),
+        'IPE/IPE_Z_OPD_V30_20210101.csv': (ipe_frame('d'), 'UTF-8'),
+        })
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('IPE_t1_2021/IPE_Forbach_FIBA_PM_IPEZMD_V30_20210419.csv', '3.0'),
+    ('IPE_t1_2021/IPE_X_V22.csv', '2.2'),
+    ('IPE_t1_2021/IPE_X.csv', None),
+    ])
+def test_member_version(name, expected):
+    assert member_version(name) == expected
+
+
+def test_build_index(archive: Path):
+    index = build_index(archive)
+    assert index.members['IPE/IPE_Z_OPA_V30_20210101.csv'].separator == ';'
+    assert index.members['IPE/IPE_Z_OPC_V22_20210101.csv'].version == '2.2'
+    assert index.column_members()['EtatImmeuble'] == ['IPE/IPE_Z_OPA_V30_20210101.csv',
+                                                      'IPE/IPE_Z_OPD_V30_20210101.csv']
+    assert index.members_with(['EtatImmeuble', 'IdentifiantImmeuble'], all_columns=True) == [
+        'IPE/IPE_Z_OPA_V30_20210101.csv', 'IPE/IPE_Z_OPD_V30_20210101.csv']
+
+    drift = index.drift_report()
+    assert drift['name'].tolist() == ['IPE/IPE_Z_OPB_V30_20210101.csv']
+    assert drift['missing'].tolist() == [['EtatImmeuble']]
+
+    assert build_index(archive) == index
+
+
+def test_parse_ipe__skips_members_without_columns(archive: Path, mocker: MockerFixture):
+    read = mocker.spy(rwp, '_read_single_ipe_file')
+    df = parse_ipe(archive, columns=['EtatImmeuble'], use_store=False)
+    assert len(df) == 6
+    assert read.call_count == 2
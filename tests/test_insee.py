@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from .. import misc
+from ..insee import CommuneLookup
+from ..insee import DEPARTMENT_REGION
+from ..insee import convert_drom_region_to_department
+from ..insee import department_from_city
+from ..insee import department_region
+from ..insee import is_drom
+
+CITIES = ['71378', '2A004', '97411', '98735', '06088']
+
+
+def test_department_from_city__types():
+    expected = [misc.insee_department_from_city(city) for city in CITIES]
+
+    series = pd.Series(CITIES + [None], index=list('abcdefg')[:6], name='insee')
+    result = department_from_city(series)
+    assert result.tolist() == expected + [None]
+    assert list(result.index) == list(series.index)
+    assert result.name == 'insee'
+
+    assert department_from_city(pd.Series(CITIES, dtype='category')).tolist() == expected
+    assert department_from_city(pa.chunked_array([CITIES[:2], CITIES[2:]])).to_pylist() == expected
+    result = department_from_city(np.array(CITIES))
+    assert isinstance(result, np.ndarray)
+    assert result.tolist() == expected
+    assert department_from_city(np.array(['01001', None], dtype=object)).tolist() == ['01', None]
+
+
+def test_department_from_city__not_strings():
+    with pytest.raises(TypeError):
+        department_from_city(pd.Series([1001]))
+
+
+def test_is_drom():
+    assert is_drom(pd.Series(CITIES)).tolist() == [misc.is_drom(insee_city=city) for city in CITIES]
+    regions = ['01', '04', '11', '94']
+    assert is_drom(insee_regions=np.array(regions)).tolist() == [misc.is_drom(insee_region=r) for r in regions]
+
+
+def test_convert_drom_region_to_department():
+    assert convert_drom_region_to_department(pa.array(['01', '06', '11'])).to_pylist() == ['971', '976', None]
+    assert convert_drom_region_to_department(np.array(['01', '11'])).tolist() == ['971', None]
+
+
+def test_department_region():
+    assert len(DEPARTMENT_REGION) == 101
+    assert department_region(pd.Series(['2A', '974', '75', '975', None])).tolist() == ['94', '04', '11', '', '']
+
+
+@pytest.fixture
+def lookup(tmp_path: Path) -> CommuneLookup:
+    pd.DataFrame({
+        'TYPECOM': ['COM', 'COM', 'COMD', 'COM', 'COM'],
+        'COM': ['49126', '44180', '49126', '2A004', '71378'],
+        'DEP': ['49', '44', '49', '2A', '71'],
+        }).to_csv(tmp_path / 'communes.csv', index=False)
+    # 49001 fusionnée dans 49002 en 2016, elle-même fusionnée dans 49126 ; Freigné (49144) passe en Loire-Atlantique
+    pd.DataFrame({
+        'MOD': ['32', '32', '32', '41', '10'],
+        'TYPECOM_AV': ['COM', 'COM', 'COM', 'COM', 'COM'],
+        'COM_AV': ['49001', '49002', '49126', '49144', '71378'],
+        'TYPECOM_AP': ['COM', 'COM', 'COMD', 'COM', 'COM'],
+        'COM_AP': ['49002', '49126', '49126', '44180', '71378'],
+        }).to_csv(tmp_path / 'mvt.csv', index=False)
+    return CommuneLookup.from_cog(tmp_path / 'communes.csv', tmp_path / 'mvt.csv')
+
+
+def test_commune_lookup(lookup: CommuneLookup):
+    codes = pd.Series(['49001', '49144', '2A004', '59350', None])
+    assert lookup.resolve(codes).tolist() == ['49126', '44180', '2A004', '59350', '']
+    assert lookup.department(codes).tolist() == ['49', '44', '2A', '59', '']
+    assert lookup.region(codes).tolist() == ['52', '52', '94', '32', '']
+
+    shards = lookup.shards(['71378', '49001', '71001', '2A004'])
+    assert {department: rows.tolist() for department, rows in shards.items()} == {
+        '2A': [3], '49': [1], '71': [0, 2]}
+
+    frame = lookup.to_frame().set_index('commune')
+    assert frame.loc['49001', 'commune_actuelle'] == '49126'
+    assert frame.loc['49144', 'departement'] == '44'
+
+
+def test_commune_lookup__without_cog():
+    assert CommuneLookup().region(['97411', '2B033']).tolist() == ['04', '94']
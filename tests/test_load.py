@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import shapely
+from pytest_mock import MockerFixture
+
+from ..ipe import load
+from ..ipe.index import build_index
+from ..ipe.load import frame_to_csv
+from ..ipe.load import load_ipe
+from ..ipe.load import prune_sql
+from ..ipe.load import staging_ddl
+from ..ipe.load import swap_sql
+from ..ipe.schema import apply_schema
+from .ipe_samples import COLUMNS
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+def test_staging_ddl():
+    table, progress = staging_ddl('ipe', 'public', ['IdentifiantImmeuble', 'NombreLogementsAdresseIPE'], srid=2154)
+    assert table.startswith('CREATE TABLE IF NOT EXISTS "public"."ipe__staging"')
+    assert '"NombreLogementsAdresseIPE" BIGINT' in table
+    assert '"geom" geometry(Point, 2154)' in table
+    assert '"public"."ipe__progress"' in progress
+
+
+def test_swap_sql():
+    queries = swap_sql('ipe', 'public', srid=2154)
+    assert queries[0] == 'DROP TABLE IF EXISTS "public"."ipe";'
+    assert queries[1] == 'ALTER TABLE "public"."ipe__staging" RENAME TO "ipe";'
+    assert 'RENAME TO "ipe_geom_idx"' in queries[3]
+
+
+def test_prune_sql():
+    staging, progress = prune_sql('ipe', 'public')
+    assert staging == 'DELETE FROM "public"."ipe__staging" WHERE "_member" <> ALL(%(members)s);'
+    assert progress == 'DELETE FROM "public"."ipe__progress" WHERE member <> ALL(%(members)s);'
+
+
+def test_frame_to_csv():
+    df = apply_schema(pd.DataFrame({'NombreLogementsAdresseIPE': ['1', None],
+                                    'DateMiseEnServiceCommercialeImmeuble': ['20210419', None],
+                                    'CommuneImmeuble': ['Saint-Denis; "centre"', 'Paris']}))
+    assert frame_to_csv(df).read().splitlines() == ['1,2021-04-19 00:00:00,"Saint-Denis; ""centre"""', ',,Paris']
+
+
+def test_with_geometry():
+    df = pd.DataFrame({'CoordonneeImmeubleX': [652000.], 'CoordonneeImmeubleY': [6862000.],
+                       'TypeProjection': ['L93']})
+    geom = shapely.from_wkb(load._with_geometry(df, 2154)['geom'].iloc[0])
+    assert shapely.get_srid(geom) == 2154
+
+
+def test_load_ipe__resume(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V30_20210101.csv': (ipe_frame('b'), 'Windows-1252'),
+        })
+    done = build_index(archive).members['IPE/IPE_Z_OPA_V30_20210101.csv']
+
+    tool = mocker.MagicMock()
+    tool.engine.execute.side_effect = lambda query: [(done.name, done.crc)] if 'SELECT member' in query else None
+    mocker.patch('utils.ipe.load.ProcessPoolExecutor', ThreadPoolExecutor)
+    load_member = mocker.patch('utils.ipe.load._load_member', side_effect=lambda *args: (args[2], 3))
+
+    rows = load_ipe(archive, tool, 'ipe', columns=COLUMNS)
+    assert rows == {'IPE/IPE_Z_OPB_V30_20210101.csv': 3}
+    assert load_member.call_count == 1
+    calls = tool.engine.begin.return_value.__enter__.return_value.execute.call_args_list
+    assert [call.args[0] for call in calls] == prune_sql('ipe', 'public') + swap_sql('ipe', 'public')
+    # Les lignes des fichiers retirés de l'archive sont supprimées avant la reprise
+    assert calls[0].args[1] == {'members': list(build_index(archive).members)}
@@ -1,34 +1,181 @@
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from .. import misc
+from .. import serialization
+
+
 def test__clean_path():
     assert False
 
 
-def test_save():
-    assert False
+def test_save(tmp_path: Path):
+    misc.save(data=True, filepath=tmp_path / 'answer.pkl')
+    misc.save(data={'a': 1}, filename='data.pkl', basepath=tmp_path, compression='zstd')
+    assert (tmp_path / 'answer.pkl').exists()
+    assert (tmp_path / 'data.pkl').exists()
 
 
-def test_load():
-    assert False
+def test_load(tmp_path: Path):
+    with open(tmp_path / 'old.pkl', 'wb') as f:
+        pickle.dump(True, f)
+    assert misc.load(filepath=tmp_path / 'old.pkl') is True
+
+    misc.save(data={'a': 1}, filepath=tmp_path / 'data.pkl', compression='lz4')
+    assert misc.load(filename='data.pkl', base_path=tmp_path) == {'a': 1}
 
 
 def test_make_iterator():
     assert False
 
 
-def test_first_file():
-    assert False
+@pytest.fixture
+def tree(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.filescan.pth.tmp_path', return_value=tmp_path)
+    root = tmp_path / 'tree'
+    for relative in ['b.csv', 'a/x.zip', 'a/y.csv', 'c/d/z.csv']:
+        (root / relative).parent.mkdir(parents=True, exist_ok=True)
+        (root / relative).write_text(relative)
+    (root / 'empty').mkdir()
+    return root
 
 
-def test_nth_file():
-    assert False
+FILES = ['b.csv', 'a/x.zip', 'a/y.csv', 'c/d/z.csv']
 
 
-def test_random_first_file():
-    assert False
+def test_first_file(tree: Path):
+    assert misc.first_file(tree) == tree / 'b.csv'
+    assert misc.first_file(tree / 'c') == tree / 'c/d/z.csv'
+    with pytest.raises(FileNotFoundError):
+        misc.first_file(tree / 'empty')
 
 
-def test_iterate_files():
-    assert False
+def test_nth_file(tree: Path):
+    assert [misc.nth_file(tree, n) for n in range(4)] == [tree / path for path in FILES]
+    with pytest.raises(IndexError):
+        misc.nth_file(tree, 4)
+
+
+def test_nth_file__refresh(tree: Path):
+    assert misc.nth_file(tree, 0) == tree / 'b.csv'
+    (tree / 'a.csv').write_text('a')
+    assert misc.nth_file(tree, 0, refresh=False) == tree / 'b.csv'
+    assert misc.nth_file(tree, 0) == tree / 'a.csv'
+
+
+def test_random_first_file(tree: Path):
+    assert {misc.random_first_file(tree) for _ in range(50)} <= {tree / path for path in FILES}
+
+
+def test_iterate_files(tree: Path):
+    assert list(misc.iterate_files(tree)) == [tree / path for path in FILES]
 
 
 def test_insee_department_from_city():
-    assert False
+    assert misc.insee_department_from_city('71378') == '71'
+    assert misc.insee_department_from_city('2A004') == '2A'
+    assert misc.insee_department_from_city('97411') == '974'
+
+
+def test_convert_insee_drom_region_to_department():
+    assert misc.convert_insee_drom_region_to_department('04') == '974'
+
+
+def test_memoize(tmp_path: Path):
+    calls = []
+
+    @misc.memoize(folder=tmp_path, ignore=['verbose'])
+    def square(x, offset=0, verbose=False):
+        calls.append(x)
+        return x ** 2 + offset
+
+    assert square(3) == 9
+    assert square(3, verbose=True) == 9
+    assert square(3, offset=0) == 9
+    assert calls == [3]
+    assert square(3, offset=1) == 10
+    assert square.bypass(3) == 9
+    assert square.refresh(3) == 9
+    assert calls == [3, 3, 3, 3]
+    assert square.cache_path(3).exists()
+
+    square.clear()
+    assert not square.cache_path(3).exists()
+
+
+def test_memoize__version_and_corruption(tmp_path: Path):
+    @misc.memoize(folder=tmp_path, version='1')
+    def identity(x):
+        return x
+
+    identity(1)
+    path = identity.cache_path(1)
+    assert path.name.startswith('v1_')
+    path.write_bytes(b'truncated')
+    assert identity(1) == 1
+
+
+def test_memoize__format(tmp_path: Path):
+    @misc.memoize(folder=tmp_path)
+    def frame():
+        return pd.DataFrame({'a': pd.Categorical([1, 2])})
+
+    @misc.memoize(folder=tmp_path)
+    def array():
+        return np.arange(3)
+
+    assert isinstance(frame()['a'].dtype, pd.CategoricalDtype)
+    assert isinstance(frame()['a'].dtype, pd.CategoricalDtype)  # relu du cache
+    array()
+    for path in (frame.cache_path(), array.cache_path()):
+        assert path.suffix == ''
+        with open(path, 'rb') as f:
+            assert serialization.detect_format(f) == 'pickle'
+
+
+def test_memoize__eviction(tmp_path: Path):
+    @misc.memoize(folder=tmp_path, max_size_mb=0.15)
+    def block(i):
+        return np.full(10000, i, dtype='int64')  # 80 ko
+
+    block(0)
+    block(1)
+    assert not block.cache_path(0).exists()
+    assert block.cache_path(1).exists()
+
+
+def _inverse(x):
+    return 1 / x
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_parallel_map(backend):
+    items = list(range(1, 300))
+    assert misc.parallel_map(_inverse, items, backend=backend, workers=2, chunksize=7) == [1 / x for x in items]
+    assert sorted(misc.parallel_map(_inverse, iter(items), backend=backend, workers=2, ordered=False)) \
+        == sorted(1 / x for x in items)
+
+
+def test_parallel_map__errors():
+    with pytest.raises(misc.ParallelMapError) as e:
+        misc.parallel_map(_inverse, [1, 0, 2, 0], backend='thread', workers=2)
+    assert [error.index for error in e.value.errors] == [1, 3]
+    assert 'ZeroDivisionError' in str(e.value)
+    assert e.value.results == [1., None, .5, None]
+
+    assert misc.parallel_map(_inverse, [0, 1], backend='thread', errors='ignore') == [None, 1.]
+
+
+def test_iter_parallel_map__max_memory():
+    def block(i):
+        time.sleep(0.02 if i == 0 else 0)
+        return np.full(1000, i)
+
+    results = misc.iter_parallel_map(block, range(50), backend='thread', workers=4, max_memory_mb=0.01)
+    assert [int(result[0]) for result in results] == list(range(50))
@@ -1,10 +1,17 @@
 import os
+import subprocess
+import sys
 from pathlib import Path
 
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 import pytest
 from pytest_mock import MockerFixture
 
 from .. import pathtools as pth
+from ..argstruct.geo_table_info import GeoInfo
 
 
 def test__get_tool_path():
@@ -45,3 +52,56 @@ def test_data_path(mocker: MockerFixture, func, folder_to_find):
     # path = pth.data_path()
     path = func(base_path=this_folder_path / 'test_trash_dir')
     assert Path((this_folder_path / 'test_trash_dir') / folder_to_find).exists()
+
+
+def test_hash_data__frames():
+    df = pd.DataFrame({'a': range(1000), 'b': ['x'] * 1000})
+    other = df.copy()
+    other.loc[500, 'a'] = -1
+    assert pth.hash_data(df) == pth.hash_data(df.copy())
+    assert pth.hash_data(df) != pth.hash_data(other)  # str(df) est tronqué : identiques pour hashname_from_data
+    assert pth.hash_data(df) != pth.hash_data(df.rename(columns={'b': 'c'}))
+    assert pth.hash_data(df) != pth.hash_data(df.astype({'a': 'int32'}))
+    assert pth.hash_data(pd.Series([1, 'a'], dtype=object)) != pth.hash_data(pd.Series(['1', 'a'], dtype=object))
+
+
+@pytest.mark.parametrize('left,right', [
+    (('ab', 'c'), ('a', 'bc')),
+    ([1, 2], (1, 2)),
+    (1, 1.),
+    (1, True),
+    (np.arange(4, dtype='int64'), np.arange(4, dtype='int32')),
+    (np.arange(4).reshape(2, 2), np.arange(4)),
+    (GeoInfo(column='geom', table_path='t'), GeoInfo(column='geom', table_path='u')),
+    ])
+def test_hash_data__distinct(left, right):
+    assert pth.hash_data(left) != pth.hash_data(right)
+
+
+def test_hash_data__geo():
+    gdf = pdg.GeoDataFrame({'a': [1, 2]}, geometry=pdg.points_from_xy([0, 1], [0, 1]), crs=2154)
+    assert pth.hash_data(gdf) == pth.hash_data(gdf.copy())
+    assert pth.hash_data(gdf) != pth.hash_data(gdf.set_crs(4326, allow_override=True))
+    unprojected = pdg.GeoSeries(pdg.points_from_xy([0, 1], [0, 1]), name='geometry')
+    assert pth.hash_data(gdf.geometry) != pth.hash_data(unprojected)
+    assert pth.hash_data(gdf.geometry) == pth.hash_data(unprojected.set_crs(2154))
+
+    two = gdf.assign(other=gdf.geometry)
+    assert pth.hash_data(two) != pth.hash_data(two.set_geometry('other'))
+
+
+def test_hash_data__structures():
+    assert pth.hash_data({'a': 1, 'b': [2]}) == pth.hash_data({'b': [2], 'a': 1})
+    assert pth.hash_data({1, 2, 3}) == pth.hash_data({3, 2, 1})
+    table = pa.table({'a': [1, None, 3], 'b': ['x', 'y', None]})
+    assert pth.hash_data(table) == pth.hash_data(pa.table({'a': [1, None, 3], 'b': ['x', 'y', None]}))
+    assert pth.hash_data(table) != pth.hash_data(table.slice(1))
+
+
+def test_hash_data__stable_across_processes():
+    package = pth.__name__.split('.')[0]
+    code = f'from {package} import pathtools as pth; print(pth.hash_data({{"a": ("x", 1.5, None), "b": {{"c"}}}}))'
+    digests = {subprocess.run([sys.executable, '-c', code], env={**os.environ, 'PYTHONHASHSEED': seed},
+                              cwd=Path(__file__).parents[2], capture_output=True, text=True, check=True).stdout
+               for seed in ('1', '2')}
+    assert digests == {pth.hash_data({'a': ('x', 1.5, None), 'b': {'c'}}) + '\n'}
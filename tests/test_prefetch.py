@@ -0,0 +1,83 @@
+import datetime
+import textwrap
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from .. import prefetch
+from ..argstruct.prefetch_job import PrefetchJob
+from ..config.reader import ConfigManager
+from ..dbtool import Tool
+from ..prefetch import format_reports
+from ..prefetch import read_jobs
+from ..prefetch import read_off_hours
+from ..prefetch import run_prefetch
+from ..prefetch import seconds_until_off_hours
+
+JOBFILE = """
+[prefetch]
+secret_file = db.cfg
+off_hours = 20, 7
+
+[job second]
+priority = 2
+query = SELECT * FROM t WHERE a > %(a)s
+param_a = 1
+
+[job first]
+priority = 1
+query = SELECT * FROM t
+geo_column = geom
+geo_table = base_infra.immeuble
+"""
+
+
+def test_read_jobs(tmp_path: Path):
+    (tmp_path / 'jobs.cfg').write_text(JOBFILE)
+    jobs = read_jobs(ConfigManager(filepath=tmp_path / 'jobs.cfg'))
+    assert [job.name for job in jobs] == ['first', 'second']
+    assert jobs[0].geo_info.table_path == 'base_infra.immeuble'
+    assert jobs[1].params == {'a': '1'}
+
+
+def test_read_jobs__docstring_example(tmp_path: Path):
+    example = prefetch.__doc__.split('```')[1]
+    (tmp_path / 'jobs.cfg').write_text(textwrap.dedent(example))
+    cfg = ConfigManager(filepath=tmp_path / 'jobs.cfg')
+    assert cfg.get('prefetch', 'millesime') == '2021'
+    assert cfg.getfloat('prefetch', 'max_age') == 24.
+    assert read_off_hours(cfg) == (20, 7)
+    jobs = read_jobs(cfg)
+    assert [job.name for job in jobs] == ['immeubles_71378']
+    assert jobs[0].params == {'code': '71378'}
+
+
+@pytest.mark.parametrize('start,end,hour,expected', [
+    (20, 7, 22, 0),
+    (20, 7, 3, 0),
+    (20, 7, 19, 3600),
+    (20, 7, 8, 12 * 3600),
+    (1, 5, 6, 19 * 3600),
+    ])
+def test_seconds_until_off_hours(start, end, hour, expected):
+    assert seconds_until_off_hours(start, end, now=datetime.datetime(2021, 4, 1, hour)) == expected
+
+
+def test_run_prefetch(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch('utils.dbtool.pth.tmp_path', return_value=tmp_path)
+    tool = Tool(connection_string=f"sqlite:///{tmp_path / 'db.sqlite'}")
+    pd.DataFrame(data={'a': [1, 2, 3]}).to_sql('t', tool.engine, index=False)
+    (tmp_path / 'jobs.cfg').write_text(JOBFILE.replace('geo_column = geom', ''))
+    jobs = read_jobs(ConfigManager(filepath=tmp_path / 'jobs.cfg'))
+    jobs[1].query = 'SELECT * FROM t WHERE a > :a'
+    jobs.append(PrefetchJob(name='broken', query='SELECT * FROM nope'))
+
+    reports = run_prefetch(tool, jobs)
+    assert [(report.name, report.status) for report in reports] == [
+        ('broken', 'failed'), ('first', 'refreshed'), ('second', 'refreshed')]
+
+    reports = run_prefetch(tool, jobs)
+    assert [report.status for report in reports] == ['failed', 'skipped', 'skipped']
+    assert format_reports(reports).endswith('0 refreshed, 2 skipped, 1 failed')
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import query as query_module
+from ..ipe.query import connect
+from ..ipe.query import query
+from ..ipe.query import table_names
+from ..ipe.store import ingest_ipe
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+SQL = 'SELECT EtatImmeuble, sum(NombreLogementsAdresseIPE) AS logements FROM ipe GROUP BY 1 ORDER BY 1'
+
+
+@pytest.fixture
+def archive(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.query.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.store.pth.specific_datapath', return_value=tmp_path)
+    return make_ipe_zip(tmp_path / 'ipe_t1.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V30_20210101.csv': (ipe_frame('b').assign(EtatImmeuble='CIBLE'), 'Windows-1252'),
+        })
+
+
+def test_table_names():
+    assert list(table_names('a/ipe-t1.zip')) == ['ipe']
+    assert list(table_names(['a/ipe-t1.zip', 'b/ipe t2.zip'])) == ['ipe_t1', 'ipe_t2']
+    assert list(table_names({'t1': 'a.zip'})) == ['t1']
+
+
+@pytest.mark.parametrize('ingested', [False, True])
+def test_query(archive: Path, ingested: bool):
+    if ingested:
+        ingest_ipe(archive)
+    df = query(SQL, archives=archive)
+    assert df.to_dict('list') == {'EtatImmeuble': ['CIBLE', 'DEPLOYE'], 'logements': [6, 6]}
+
+
+def test_query__closes_connection(archive: Path, mocker: MockerFixture):
+    connection = mocker.spy(query_module, 'connect')
+    query(SQL, archives=archive, use_store=False)
+    with pytest.raises(duckdb.Error):
+        connection.spy_return.execute('SELECT 1')
+
+
+def test_query__as_arrow(archive: Path):
+    reader = query('SELECT * FROM ipe_t1 WHERE IdentifiantImmeuble LIKE \'b%\'', archives=[archive], as_arrow=True)
+    assert isinstance(reader, pa.RecordBatchReader)
+    assert reader.read_all().num_rows == 3
+
+
+def test_query__join(archive: Path):
+    sql = 'SELECT count(*) AS n FROM t1 JOIN t2 USING (IdentifiantImmeuble)'
+    df = query(sql, archives={'t1': archive, 't2': archive}, ingest=True)
+    assert df['n'].tolist() == [6]
+
+
+def test_connect__not_ingested_read_twice(archive: Path):
+    con = connect(archive, use_store=False)
+    assert con.execute('SELECT count(*) FROM ipe').fetchone()[0] == 6
+    assert con.execute('SELECT count(*) FROM ipe').fetchone()[0] == 6
+    sql = "SELECT count(*) FROM ipe a JOIN ipe b USING (IdentifiantImmeuble) WHERE a.IdentifiantImmeuble LIKE 'a%'"
+    assert con.execute(sql).fetchone()[0] == 3
@@ -1,5 +1,13 @@
+import io
+
+import pandas as pd
+
 import utils.pathtools as pth
+from utils.ipe import rwp
+from utils.ipe.rwp import iter_ipe
 from utils.ipe.rwp import parse_ipe
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
 
 
 def test_parse_ipe__integration():
@@ -7,3 +15,60 @@ def test_parse_ipe__integration():
 
     df = parse_ipe(ipe_zip_path=ipe_zip_path, columns=['IdentifiantImmeuble', 'CodeAdresseImmeuble'], _test_nrows=20)
     assert df.shape == (23119, 2)
+
+
+def test_parse_ipe__workers(mocker, tmp_path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        f'IPE/{i}.csv': (ipe_frame(f'{i}-'), 'UTF-8' if i % 2 else 'Windows-1252') for i in range(5)})
+    columns = ['IdentifiantImmeuble', 'NombreLogementsAdresseIPE']
+
+    serial = parse_ipe(archive, columns=columns, numeric_cols=['NombreLogementsAdresseIPE'])
+    parallel = parse_ipe(archive, columns=columns, numeric_cols=['NombreLogementsAdresseIPE'], workers=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert parallel.shape == (15, 2)
+
+
+def test_iter_ipe(mocker, tmp_path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    partial = ipe_frame('b', nrows=2).drop(columns=['EtatImmeuble'])
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/a.csv': (ipe_frame('a', nrows=5), 'UTF-8'),
+        'IPE/b.csv': (partial, 'Latin-1'),
+        })
+    columns = ['IdentifiantImmeuble', 'EtatImmeuble']
+
+    chunks = list(iter_ipe(archive, columns=columns, chunksize=2))
+    assert [(member, len(chunk)) for member, chunk in chunks] == [
+        ('IPE/a.csv', 2), ('IPE/a.csv', 2), ('IPE/a.csv', 1), ('IPE/b.csv', 2)]
+    assert all(list(chunk.columns) == columns for _, chunk in chunks)
+    assert chunks[-1][1]['EtatImmeuble'].isna().all()
+
+    strict = list(iter_ipe(archive, columns=columns, chunksize=2, cols_are_optional=False))
+    assert {member for member, _ in strict} == {'IPE/a.csv'}
+
+
+def test_parse_ipe__arrow_engine(mocker, tmp_path):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/a.csv': (ipe_frame('é'), 'UTF-8'),
+        'IPE/b.csv': (ipe_frame('è').drop(columns=['EtatImmeuble']), 'Windows-1252'),
+        })
+    columns = ['IdentifiantImmeuble', 'EtatImmeuble', 'NombreLogementsAdresseIPE']
+    numeric_cols = ['NombreLogementsAdresseIPE']
+
+    expected = parse_ipe(archive, columns=columns, numeric_cols=numeric_cols, use_store=False)
+    for workers in (None, 2):
+        df = parse_ipe(archive, columns=columns, numeric_cols=numeric_cols, use_store=False, engine='arrow',
+                       workers=workers)
+        assert df['EtatImmeuble'].dtype == 'category'
+        pd.testing.assert_frame_equal(df.astype(object), expected.astype(object))
+
+
+def test_read_single_ipe_table__nrows_stops_early():
+    content = ipe_frame('a', nrows=300000).to_csv(sep=';', index=False).encode('UTF-8')
+    stream = io.BytesIO(content)
+    table = rwp._read_single_ipe_table(stream, cols=['IdentifiantImmeuble', 'EtatImmeuble'], nrows=5,
+                                       encoding='UTF-8')
+    assert table.column('IdentifiantImmeuble').to_pylist() == [f'a{i}' for i in range(5)]
+    assert stream.tell() < len(content)
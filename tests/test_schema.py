@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe.rwp import parse_ipe
+from ..ipe.schema import SCHEMAS
+from ..ipe.schema import apply_schema
+from ..ipe.schema import column_types
+from ..ipe.schema import concat_typed
+from ..ipe.schema import read_dtypes
+from ..ipe.schema import register_schema
+from .ipe_samples import COLUMNS
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+def test_read_dtypes():
+    assert read_dtypes(['EtatImmeuble', 'NombreLogementsAdresseIPE', 'Autre']) == {
+        'EtatImmeuble': 'category', 'NombreLogementsAdresseIPE': 'str', 'Autre': 'str'}
+
+
+def test_apply_schema():
+    df = pd.DataFrame({
+        'EtatImmeuble': ['DEPLOYE', 'CIBLE'],
+        'NombreLogementsAdresseIPE': ['3', 'x'],
+        'CoordonneeImmeubleX': ['1,5', '2.5'],
+        'DateMiseEnServiceCommercialeImmeuble': ['20210419', '19/04/2021'],
+        'Autre': ['12', '13'],
+        })
+    df = apply_schema(df, numeric_cols=['Autre'])
+
+    assert isinstance(df['EtatImmeuble'].dtype, pd.CategoricalDtype)
+    assert str(df['NombreLogementsAdresseIPE'].dtype) == 'Int64'
+    assert df['NombreLogementsAdresseIPE'].isna().tolist() == [False, True]
+    assert df['CoordonneeImmeubleX'].tolist() == [1.5, 2.5]
+    assert (df['DateMiseEnServiceCommercialeImmeuble'] == pd.Timestamp('2021-04-19')).all()
+    assert df['Autre'].tolist() == [12., 13.]
+
+
+def test_apply_schema__non_integral():
+    df = apply_schema(pd.DataFrame({'NombreLogementsAdresseIPE': ['1.5', '2.0', '3', None, 'inf']}))
+    assert str(df['NombreLogementsAdresseIPE'].dtype) == 'Int64'
+    assert df['NombreLogementsAdresseIPE'].tolist() == [pd.NA, 2, 3, pd.NA, pd.NA]
+
+
+def test_register_schema(mocker: MockerFixture):
+    mocker.patch.dict(SCHEMAS)
+    register_schema('3.1', {'NouvelleColonne': 'Int64'})
+    assert column_types('3.1')['NouvelleColonne'] == 'Int64'
+    assert column_types('3.1')['EtatImmeuble'] == 'category'
+    assert 'NouvelleColonne' not in column_types('3.0')
+
+
+def test_concat_typed():
+    a = apply_schema(pd.DataFrame({'EtatImmeuble': ['DEPLOYE'], 'NombreLogementsAdresseIPE': ['1']}))
+    b = apply_schema(pd.DataFrame({'EtatImmeuble': ['CIBLE']}))
+    df = concat_typed([a, b])
+
+    assert set(df['EtatImmeuble'].cat.categories) == {'DEPLOYE', 'CIBLE'}
+    assert str(df['NombreLogementsAdresseIPE'].dtype) == 'Int64'
+    assert df['NombreLogementsAdresseIPE'].isna().tolist() == [False, True]
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_parse_ipe__typed(mocker: MockerFixture, tmp_path: Path, engine: str):
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.index.pth.tmp_path', return_value=tmp_path)
+    archive = make_ipe_zip(tmp_path / 'ipe.zip', {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V22_20210101.csv': (ipe_frame('b').assign(EtatImmeuble='CIBLE'), 'Windows-1252'),
+        })
+
+    df = parse_ipe(archive, columns=COLUMNS, use_store=False, engine=engine)
+    assert isinstance(df['EtatImmeuble'].dtype, pd.CategoricalDtype)
+    assert df['EtatImmeuble'].value_counts().to_dict() == {'DEPLOYE': 3, 'CIBLE': 3}
+    assert str(df['NombreLogementsAdresseIPE'].dtype) == 'Int64'
+    assert df['NombreLogementsAdresseIPE'].sum() == 12
+
+    raw = parse_ipe(archive, columns=COLUMNS, use_store=False, engine='pandas', typed=False)
+    assert raw['NombreLogementsAdresseIPE'].dtype == object
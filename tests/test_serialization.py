@@ -0,0 +1,101 @@
+import pickle
+from pathlib import Path
+
+import geopandas as pdg
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from .. import serialization
+from ..serialization import detect_format
+from ..serialization import infer_format
+
+
+@pytest.mark.parametrize('data,expected', [
+    (pd.DataFrame({'a': [1]}), 'pickle'),
+    (pd.DataFrame({0: [1]}), 'pickle'),
+    (np.arange(3), 'npy'),
+    (np.array(['a', None]), 'pickle'),
+    ({'a': np.arange(3)}, 'pickle'),
+    ])
+def test_infer_format(data, expected):
+    assert infer_format(data) == expected
+
+
+@pytest.mark.parametrize('compression', [None, 'zstd', 'lz4'])
+def test_pickle__out_of_band(tmp_path: Path, compression):
+    data = {'array': np.arange(100000, dtype='int64') % 7, 'df': pd.DataFrame({'x': np.random.rand(1000)}), 'n': 1}
+    serialization.save(data, tmp_path / 'data.pkl', format='pickle', compression=compression)
+    loaded = serialization.load(tmp_path / 'data.pkl')
+
+    assert np.array_equal(loaded['array'], data['array'])
+    pd.testing.assert_frame_equal(loaded['df'], data['df'])
+    assert loaded['n'] == 1
+    loaded['array'][0] = -1  # tampons modifiables
+    if compression is not None:
+        assert (tmp_path / 'data.pkl').stat().st_size < data['array'].nbytes / 2
+
+
+def test_pickle__mmap(tmp_path: Path):
+    serialization.save({'array': np.arange(1000)}, tmp_path / 'data.pkl', format='pickle')
+    array = serialization.load(tmp_path / 'data.pkl', mmap=True)['array']
+    assert array[999] == 999
+    assert not array.flags.writeable
+
+
+def test_parquet(tmp_path: Path):
+    df = pd.DataFrame({'a': pd.array([1, None], dtype='Int64'), 'b': pd.Categorical(['x', 'y'])},
+                      index=pd.Index(['i', 'j'], name='key'))
+    serialization.save(df, tmp_path / 'df.pkl', format='parquet', compression='zstd')
+    with open(tmp_path / 'df.pkl', 'rb') as f:
+        assert detect_format(f) == 'parquet'
+    pd.testing.assert_frame_equal(serialization.load(tmp_path / 'df.pkl'), df)
+
+
+def test_parquet__fallback(tmp_path: Path):
+    df = pd.DataFrame({'mixed': [1, 'a', (2, 3)]})
+    serialization.save(df, tmp_path / 'df.pkl', format='parquet')
+    with open(tmp_path / 'df.pkl', 'rb') as f:
+        assert detect_format(f) == 'pickle'
+    pd.testing.assert_frame_equal(serialization.load(tmp_path / 'df.pkl'), df)
+
+
+def test_parquet__geodataframe(tmp_path: Path):
+    gdf = pdg.GeoDataFrame({'a': [1]}, geometry=[shapely.Point(1, 2)], crs=2154)
+    serialization.save(gdf, tmp_path / 'gdf.pkl', format='parquet')
+    loaded = serialization.load(tmp_path / 'gdf.pkl')
+    assert isinstance(loaded, pdg.GeoDataFrame)
+    assert loaded.crs == 'EPSG:2154'
+
+
+def test_npy__mmap(tmp_path: Path):
+    serialization.save(np.arange(10.), tmp_path / 'array.pkl')
+    array = serialization.load(tmp_path / 'array.pkl', mmap=True)
+    assert isinstance(array, np.memmap)
+    assert array[3] == 3.
+
+
+def test_load__legacy_pickle(tmp_path: Path):
+    with open(tmp_path / 'old.pkl', 'wb') as f:
+        pickle.dump({'a': 1}, f)
+    assert serialization.load(tmp_path / 'old.pkl') == {'a': 1}
+
+
+def test_save__unknown_compression(tmp_path: Path):
+    with pytest.raises(ValueError):
+        serialization.save(1, tmp_path / 'x.pkl', compression='gzip')
+
+
+def test_save__dataframe_round_trip(tmp_path: Path):
+    df = pd.DataFrame({'lists': [[1, 2], [3]], 'categories': pd.Categorical([1, 2])},
+                      index=pd.date_range('2021-01-01', periods=2, freq='D'))
+    df.attrs['source'] = 'ipe'
+    serialization.save(df, tmp_path / 'df.pkl')
+    loaded = serialization.load(tmp_path / 'df.pkl')
+
+    pd.testing.assert_frame_equal(loaded, df)
+    assert isinstance(loaded['lists'].iloc[0], list)
+    assert loaded['categories'].dtype == df['categories'].dtype
+    assert loaded.attrs == {'source': 'ipe'}
+    assert loaded.index.freq == 'D'
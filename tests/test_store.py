@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pytest_mock import MockerFixture
+
+from ..ipe import store
+from ..ipe.rwp import parse_ipe
+from ..ipe.store import ingest_ipe
+from ..ipe.store import is_ingested
+from ..ipe.store import member_operator
+from ..ipe.store import read_store
+from .ipe_samples import ipe_frame
+from .ipe_samples import make_ipe_zip
+
+
+@pytest.fixture
+def ipe_dir(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch('utils.ipe.encoding.pth.tmp_path', return_value=tmp_path)
+    mocker.patch('utils.ipe.store.pth.specific_datapath', return_value=tmp_path)
+    return tmp_path
+
+
+def test_member_operator():
+    assert member_operator('IPE_t1_2021/IPE_Forbach_FIBA_PM_IPEZMD_V30_20210419.csv') == 'FIBA'
+
+
+def test_ingest_ipe(ipe_dir: Path, mocker: MockerFixture):
+    drom = ipe_frame('r', nrows=2).assign(CodeInseeImmeuble=['97411', '97412'])
+    members = {
+        'IPE/IPE_Z_OPA_V30_20210101.csv': (ipe_frame('a').assign(CodeInseeImmeuble='71378'), 'UTF-8'),
+        'IPE/IPE_Z_OPB_V30_20210101.csv': (drom, 'Windows-1252'),
+        }
+    archive = make_ipe_zip(ipe_dir / 'ipe.zip', members)
+    assert not is_ingested(archive)
+
+    path = ingest_ipe(archive)
+    assert is_ingested(archive)
+    assert (path / 'operateur=OPB' / 'departement=974').is_dir()
+
+    columns = ['IdentifiantImmeuble', 'NombreLogementsAdresseIPE']
+    from_zip = parse_ipe(archive, columns=columns, use_store=False)
+    from_store = parse_ipe(archive, columns=columns)
+    pd.testing.assert_frame_equal(from_zip.sort_values('IdentifiantImmeuble', ignore_index=True),
+                                  from_store.sort_values('IdentifiantImmeuble', ignore_index=True))
+
+    # Seul le fichier modifié est relu
+    members['IPE/IPE_Z_OPB_V30_20210101.csv'] = (drom.assign(EtatImmeuble='SIGNE'), 'UTF-8')
+    make_ipe_zip(archive, members)
+    read_member = mocker.spy(store, '_read_member')
+    ingest_ipe(archive)
+    assert [call.args[1] for call in read_member.call_args_list] == ['IPE/IPE_Z_OPB_V30_20210101.csv']
+    etats = read_store(archive, columns=['IdentifiantImmeuble', 'EtatImmeuble']).set_index('IdentifiantImmeuble')
+    assert etats.loc['r0', 'EtatImmeuble'] == 'SIGNE'
+    assert len(etats) == 5
+
+
+def test_ingest_ipe__same_name_in_two_folders(ipe_dir: Path):
+    archives = []
+    for quarter in ('t1', 't2'):
+        (ipe_dir / quarter).mkdir()
+        archives.append(make_ipe_zip(ipe_dir / quarter / 'ipe.zip', {
+            f'IPE/IPE_Z_OPA_V30_2021010{len(archives) + 1}.csv': (ipe_frame(quarter), 'UTF-8')}))
+    paths = [ingest_ipe(archive) for archive in archives]
+
+    assert paths[0] != paths[1]
+    assert all(is_ingested(archive) for archive in archives)
+    df = read_store(archives[1], columns=['IdentifiantImmeuble'])
+    assert df['IdentifiantImmeuble'].tolist() == ['t20', 't21', 't22']